@@ -3,25 +3,15 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 from auth_helper import require_login
+from data_access import get_usetype_totals, get_portfolio_eui_by_year, get_portfolio_emissions_by_year, get_portfolio_normalized_eui_by_year
+from reference_data import UNCATEGORIZED, USETYPE_CATEGORY
 
 require_login()
 
 st.title("Portfolio Data")
 
-conn = st.connection("sql", type="sql")
-
 # Get total square footage for each building type
-query = """
-    SELECT 
-        [usetype],
-        COALESCE(SUM(TRY_CAST([sqfootage] AS DECIMAL(10,2))), 0) as total_sqft,
-        COUNT(*) as building_count
-    FROM [dbo].[ESPMFIRSTTEST]
-    GROUP BY [usetype]
-    ORDER BY total_sqft DESC
-"""
-
-df = conn.query(query)
+df = get_usetype_totals()
 
 # Summary stats
 col1, col2 = st.columns(2)
@@ -60,47 +50,8 @@ st.dataframe(df, height=500, hide_index=True)
 
 
 # Pie Chart - 4 categories: Commercial,City-Owned,Multi-Unit,Institutional
-building_categorization = {
-    'Commercial': [
-        'Bar/Nightclub', 'Bowling Alley', 'Convenience Store without Gas Station',
-        'Financial Office', 'Fitness Center/Health Club/Gym', 'Food Service',
-        'Hotel', 'Ice/Curling Rink', 'Mixed Use Property', 'Museum', 'Office',
-        'Other - Entertainment/Public Assembly', 'Other - Mall', 'Other - Recreation',
-        'Other - Restaurant/Bar', 'Other - Services', 'Parking',
-        'Personal Services (Health/Beauty, Dry Cleaning, etc)', 'Restaurant',
-        'Retail Store', 'Self-Storage Facility', 'Strip Mall', 'Supermarket/Grocery Store',
-        'Swimming Pool', 'Vehicle Dealership', 'Vehicle Repair Services',
-        'Wholesale Club/Supercenter', 'Other - Lodging/Residential'
-    ],
-    
-    'City-Owned': [
-        'Courthouse', 'Fire Station', 'Library', 'Police Station', 'Prison/Incarceration',
-        'Drinking Water Treatment & Distribution', 'Wastewater Treatment Plant',
-        'Transportation Terminal/Station', 'Other - Public Services', 'Other - Utility'
-    ],
-    
-    'Multi-Unit': [
-        'Multifamily Housing', 'Residence Hall/Dormitory', 'Residential Care Facility',
-        'Senior Living Community'
-    ],
-    
-    'Institutional': [
-        'Adult Education', 'College/University', 'Community Center and Social Meeting Hall',
-        'K-12 School', 'Laboratory', 'Medical Office', 'Other - Education',
-        'Other - Technology/Science', 'Worship Facility', 'Distribution Center',
-        'Energy/Power Station', 'Manufacturing/Industrial Plant',
-        'Non-Refrigerated Warehouse', 'Other'
-    ]
-}
-
-# Create a mapping from building type to category
-type_to_category = {}
-for category, building_list in building_categorization.items():
-    for building_type in building_list:
-        type_to_category[building_type] = category
-
 # Add category column to your dataframe
-df['category'] = df['usetype'].map(type_to_category).fillna('Uncategorized')
+df['category'] = df['usetype'].map(USETYPE_CATEGORY).fillna(UNCATEGORIZED)
 
 # NOW aggregate by category to get your 4 totals
 category_totals = df.groupby('category').agg({
@@ -192,254 +143,132 @@ fig.update_layout(
 )
 st.plotly_chart(fig, use_container_width=True)
 
+# District EUI by year, from one grouped query over the building metrics the weekly ingest maintains. Only
+# complete years count, so the latest EUI and the year-over-year change never compare a partial year to a full one
+eui_df = get_portfolio_eui_by_year()
+
+st.subheader("Energy Use Intensity from Meter Data")
+if eui_df.empty:
+    st.warning("No meter data found for any buildings.")
+else:
+    eui_df['eui'] = (eui_df['total_kbtu'].astype(float) / eui_df['total_sqft'].astype(float)).round(2)
+
+    # Show quick stats
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        # Read each column on its own; .iloc[-1] of the row upcasts year to float when every column is numeric
+        st.metric(f"Latest EUI ({int(eui_df['year'].iloc[-1])})", f"{eui_df['eui'].iloc[-1]:.1f}")
+    with col2:
+        st.metric("Years with Data", len(eui_df))
+    with col3:
+        if len(eui_df) > 1:
+            change = eui_df['eui'].iloc[-1] - eui_df['eui'].iloc[-2]
+            st.metric("Year-over-Year Change", f"{change:+.1f}")
+
+    fig = px.line(
+        eui_df,
+        x='year',
+        y='eui',
+        markers=True,
+        text='eui',
+        hover_data={'building_count': True}
+    )
+    fig.update_traces(textposition='top center')
+    fig.update_layout(
+        height=500,
+        xaxis_title="Year",
+        yaxis_title="EUI (kBTU/sq ft)",
+        title={
+            'text': "Energy Use Intensity By Year",
+            'font': {'size': 20}
+        }
+    )
+    fig.update_xaxes(
+        tickmode='array',
+        tickvals=eui_df['year'].tolist()
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+# Actual vs weather-normalized EUI, over buildings with a full year of every fuel to normalize
+normalized_df = get_portfolio_normalized_eui_by_year()
+if not normalized_df.empty:
+    st.subheader("Weather-Normalized Energy Use Intensity")
+    normalized_df['actual'] = (normalized_df['total_kbtu'].astype(float) / normalized_df['total_sqft'].astype(float)).round(2)
+    normalized_df['weather_normalized'] = (normalized_df['total_normalized_kbtu'].astype(float) / normalized_df['total_sqft'].astype(float)).round(2)
+    df_melted = normalized_df.melt(id_vars=['year', 'building_count'],
+                                   value_vars=['actual', 'weather_normalized'],
+                                   var_name=' ',
+                                   value_name='eui')
+
+    fig = px.line(
+        df_melted,
+        x='year',
+        y='eui',
+        color=' ',
+        markers=True,
+        hover_data={'building_count': True}
+    )
+    fig.update_layout(
+        height=500,
+        xaxis_title="Year",
+        yaxis_title="EUI (kBTU/sq ft)",
+        title={
+            'text': "Actual vs. Weather-Normalized EUI By Year",
+            'font': {'size': 20}
+        }
+    )
+    fig.update_xaxes(
+        tickmode='array',
+        tickvals=normalized_df['year'].tolist()
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+# District carbon emissions from the meter data: year-specific emission factors applied by the weekly ingest,
+# with on-site solar netted off at the grid factor. Fuels without a factor are left out and named below the chart.
+emissions_df = get_portfolio_emissions_by_year()
+covered_df = emissions_df[emissions_df['buildings_with_factor'] > 0]
+
+if covered_df.empty:
+    st.info("No emissions computed yet. Add emission factors to data/emission_factors.csv (see data/README.md).")
+else:
+    covered_df = covered_df.merge(eui_df[['year', 'total_sqft']], on='year')
+    covered_df['kg_co2e_per_sqft'] = (covered_df['kg_co2e'].astype(float) / covered_df['total_sqft'].astype(float)).round(2)
+    covered_df['mt_co2e'] = (covered_df['kg_co2e'].astype(float) / 1000).round(0)
+
+    fig = px.bar(
+        covered_df,
+        x='year',
+        y='kg_co2e_per_sqft',
+        color='fuel',
+        hover_data={'mt_co2e': True}
+    )
+
+    fig.update_layout(
+        barmode='relative',
+        height=500,
+        xaxis_title="Year",
+        yaxis_title="Emissions (kg CO2e / sq ft)",
+        title={
+            'text': "District Carbon Emissions By Square Foot, From Meter Data",
+            'font': {'size': 20}
+        }
+    )
+    fig.update_xaxes(
+        tickmode='array',
+        tickvals=sorted(covered_df['year'].unique().tolist())
+    )
+
+    st.plotly_chart(fig, use_container_width=True)
+
+    missing_fuels = sorted(set(emissions_df['fuel']) - set(covered_df['fuel']))
+    if missing_fuels:
+        st.caption(
+            f"Not included: {', '.join(missing_fuels)}. data/emission_factors.csv has no emission factor for "
+            f"{'it' if len(missing_fuels) == 1 else 'them'} yet, so these totals understate the district's emissions."
+        )
+
 # Hardcoded data
 st.subheader("Hardcoded Data from 2025 Annual Report")
-eui_data = {
-    "years": [2018, 2019, 2021, 2022, 2023, 2024],
-    "baseline": [94.5, 78.33, 54.32, 80, 74.14, 64.2],
-    "actual": [113.08, 74.15, 50.91, 79.68, 70.3, 63.3],
-    "target": [64.3, 53.3, 36.9, 54.4, 50.4, 43.7]
-}
-
-# Create dataframe and reshape for Plotly
-df = pd.DataFrame(eui_data)
-df_melted = df.melt(id_vars=['years'], 
-                    value_vars=['baseline', 'actual', 'target'],
-                    var_name=' ', 
-                    value_name='eui')
-
-fig = px.line(
-    df_melted,
-    x='years',
-    y='eui',
-    color=' ',
-    markers=True
-)
-
-fig.update_layout(
-    height=500,
-    xaxis_title="Year",
-    yaxis_title="EUI (kBTU/sq ft)",
-    title={
-        'text': "Energy Use Intensity By Year",
-        'font': {'size': 20}
-    }
-)
-
-st.subheader("Data from SQL Database")
-
-# # Function to get meter data - FIXED with correct table names
-# def get_meter_data(table_name, espmid, energy_type):
-#     query = f"""
-#         SELECT 
-#             [entryid],
-#             [meterid],
-#             TRY_CAST([usage] AS FLOAT) as usage,
-#             [startdate],
-#             [enddate]
-#         FROM [dbo].[{table_name}]
-#         WHERE [espmid] = '{espmid}'
-#         ORDER BY [startdate]
-#     """
-#     try:
-#         df = conn.query(query)
-#         if not df.empty:
-#             df['energy_type'] = energy_type
-#             df['startdate'] = pd.to_datetime(df['startdate'])
-#             df['enddate'] = pd.to_datetime(df['enddate'])
-#             df['year'] = df['startdate'].dt.year
-#         else:
-#             # Create empty dataframe WITH the 'year' column
-#             df = pd.DataFrame(columns=['entryid', 'meterid', 'usage', 'startdate', 'enddate', 'energy_type', 'year'])
-        
-#         return df
-#     except Exception as e:
-#         # Return empty dataframe if table doesn't exist or query fails
-#         st.warning(f"Could not query table '{table_name}' for building {espmid}: {str(e)[:100]}...")
-#         return pd.DataFrame(columns=['entryid', 'meterid', 'usage', 'startdate', 'enddate', 'energy_type', 'year'])
-
-# # Get all ESPMIDs and their square footage from ESPMFIRSTTEST table
-# st.write("### Calculating EUI from Actual Meter Data")
-
-# buildings_query = """
-#     SELECT [espmid], TRY_CAST([sqfootage] AS FLOAT) as sqft
-#     FROM [dbo].[ESPMFIRSTTEST]
-#     WHERE [sqfootage] IS NOT NULL 
-#     AND TRY_CAST([sqfootage] AS FLOAT) > 0
-# """
-# buildings_df = conn.query(buildings_query)
-
-# if buildings_df.empty:
-#     st.warning("No buildings found with valid square footage.")
-# else:
-#     st.write(f"Processing {len(buildings_df)} buildings...")
-    
-#     # Initialize totals for each year
-#     KWH_TO_KBTU = 3.412
-#     THERM_TO_KBTU = 100
-    
-#     # Initialize dictionaries
-#     total_energy_by_year = {year: 0 for year in range(2018, 2026)}
-#     total_sqft_by_year = {year: 0 for year in range(2018, 2026)}
-    
-#     # Progress bar for processing
-#     progress_bar = st.progress(0)
-#     total_buildings = len(buildings_df)
-    
-#     buildings_processed = 0
-#     for idx, building_row in buildings_df.iterrows():
-#         espmid = building_row['espmid']
-#         sqft = building_row['sqft']
-        
-#         if sqft > 0:
-#             # Get meter data for this building - USING CORRECT TABLE NAMES
-#             electric_df = get_meter_data('electric', espmid, 'Electric')
-#             gas_df = get_meter_data('naturalgas', espmid, 'Natural Gas')
-#             solar_df = get_meter_data('solar', espmid, 'Solar')
-            
-#             # Process each year
-#             for year in range(2018, 2026):
-#                 # Check if building has any data this year
-#                 has_electric = not electric_df[electric_df['year'] == year].empty
-#                 has_gas = not gas_df[gas_df['year'] == year].empty
-#                 has_solar = not solar_df[solar_df['year'] == year].empty
-                
-#                 if has_electric or has_gas or has_solar:
-#                     # Add square footage for this year
-#                     total_sqft_by_year[year] += sqft
-                    
-#                     # Process electric
-#                     if has_electric:
-#                         electric_usage = electric_df[electric_df['year'] == year]['usage'].sum()
-#                         total_energy_by_year[year] += electric_usage * KWH_TO_KBTU
-                    
-#                     # Process gas
-#                     if has_gas:
-#                         gas_usage = gas_df[gas_df['year'] == year]['usage'].sum()
-#                         total_energy_by_year[year] += gas_usage * THERM_TO_KBTU
-                    
-#                     # Process solar (subtract from total)
-#                     if has_solar:
-#                         solar_usage = solar_df[solar_df['year'] == year]['usage'].sum()
-#                         total_energy_by_year[year] -= solar_usage * KWH_TO_KBTU
-            
-#             buildings_processed += 1
-        
-#         # Update progress
-#         if (idx + 1) % 10 == 0 or (idx + 1) == total_buildings:
-#             progress_bar.progress((idx + 1) / total_buildings)
-    
-#     progress_bar.empty()
-    
-#     # Calculate EUI for each year
-#     eui_by_year = {}
-#     for year in range(2018, 2026):
-#         if total_sqft_by_year[year] > 0:
-#             eui = total_energy_by_year[year] / total_sqft_by_year[year]
-#             eui_by_year[year] = round(eui, 2)
-#         else:
-#             eui_by_year[year] = None
-    
-#     # Create EUI data for the line graph
-#     valid_years = [year for year in eui_by_year.keys() if eui_by_year[year] is not None]
-#     valid_eui = [eui_by_year[year] for year in valid_years]
-    
-#     st.write(f"Successfully processed {buildings_processed} buildings with meter data.")
-    
-#     # Show quick stats
-#     if valid_years:
-#         col1, col2, col3 = st.columns(3)
-#         with col1:
-#             latest_year = max(valid_years)
-#             st.metric(f"Latest EUI ({latest_year})", f"{eui_by_year[latest_year]:.1f}")
-#         with col2:
-#             st.metric("Years with Data", len(valid_years))
-#         with col3:
-#             if len(valid_years) > 1:
-#                 change = eui_by_year[valid_years[-1]] - eui_by_year[valid_years[-2]]
-#                 st.metric("Year-over-Year Change", f"{change:+.1f}")
-    
-#     # Create the EUI line graph
-#     if len(valid_years) > 0:
-#         fig = px.line(
-#             x=valid_years,
-#             y=valid_eui,
-#             markers=True,
-#             labels={'x': 'Year', 'y': 'EUI (kBTU/sq ft)'}
-#         )
-        
-#         fig.update_layout(
-#             height=500,
-#             xaxis_title="Year",
-#             yaxis_title="EUI (kBTU/sq ft)",
-#             title={
-#                 'text': "Calculated EUI from Actual Meter Data",
-#                 'font': {'size': 20}
-#             }
-#         )
-        
-#         # Customize x-axis to show all years 2018-2025
-#         fig.update_xaxes(
-#             tickmode='array',
-#             tickvals=list(range(2018, 2026)),
-#             range=[2017.5, 2025.5]
-#         )
-        
-#         # Add data labels
-#         for i, (x, y) in enumerate(zip(valid_years, valid_eui)):
-#             fig.add_annotation(
-#                 x=x,
-#                 y=y,
-#                 text=str(y),
-#                 showarrow=True,
-#                 arrowhead=1,
-#                 ax=0,
-#                 ay=-30
-#             )
-        
-#         st.plotly_chart(fig, use_container_width=True)
-        
-#         # Show comparison with hardcoded data
-#         st.write("#### Comparison with Hardcoded EUI Data")
-        
-#         # Hardcoded EUI data
-#         hardcoded_data = {
-#             2018: 94.5, 
-#             2019: 78.33, 
-#             2021: 54.32, 
-#             2022: 80, 
-#             2023: 74.14, 
-#             2024: 64.2
-#         }
-        
-#         # Create comparison dataframe
-#         comparison_years = sorted(set(valid_years + list(hardcoded_data.keys())))
-#         comparison_rows = []
-        
-#         for year in comparison_years:
-#             row = {'Year': year}
-#             row['Calculated EUI'] = eui_by_year.get(year)
-#             row['Hardcoded EUI'] = hardcoded_data.get(year)
-#             if row['Calculated EUI'] is not None and row['Hardcoded EUI'] is not None:
-#                 row['Difference'] = row['Calculated EUI'] - row['Hardcoded EUI']
-#             else:
-#                 row['Difference'] = None
-#             comparison_rows.append(row)
-        
-#         comparison_df = pd.DataFrame(comparison_rows)
-        
-#         # Display comparison
-#         st.dataframe(comparison_df.style.format({
-#             'Calculated EUI': '{:.2f}',
-#             'Hardcoded EUI': '{:.2f}',
-#             'Difference': '{:+.2f}'
-#         }))
-        
-#     else:
-#         st.warning("No meter data found for any buildings in the years 2018-2025.")
-
-
-# st.plotly_chart(fig, use_container_width=True)
 
 wui_data = {
     "years": [2021, 2022, 2023, 2024],
@@ -3,77 +3,16 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from auth_helper import require_login
+from data_access import get_building_list, get_building_meter_data, get_building_monthly, get_building_normalized, get_building_peers, get_building_rollup
+from meter_types import KWH_TO_KBTU
+from reference_data import BASELINE_EUI
 
 require_login()
 
 st.title("Building Energy Analysis")
 
-conn = st.connection("sql", type="sql")
-
-# Conversion factors
-
-KWH_TO_KBTU = 3.412  # 1 kWh = 3.412 kBTU
-THERM_TO_KBTU = 100  # 1 therm = 100 kBTU (also ~1 CCF = 100 kBTU)
-
-# Baseline EUI lookup dictionary (in kBTU/sq ft) - is this correct? 
-baseline_eui = {
-    "Adult Education": 60,
-    "Bar/Nightclub": 150,
-    "College/University": 100,
-    "Courthouse": 79,
-    "Distribution Center": 50,
-    "Drinking Water Treatment & Distribution": 300,
-    "Energy/Power Station": 100,
-    "Financial Office": 100,
-    "Fire Station": 79,
-    "Fitness Center/Health Club/Gym": 55,
-    "Heated Swimming Pool": 354,
-    "Hotel": 88,
-    "Ice/Curling Rink": 150,
-    "K-12 School": 80,
-    "Laboratory": 50,
-    "Library": 50,
-    "Manufacturing/Industrial Plant": 50,
-    "Mixed Use Property": 50,
-    "Multifamily Housing": 55,
-    "Museum": 50,
-    "Non-Refrigerated Warehouse": 50,
-    "Office": 80,
-    "Other": 40,
-    "Other - Education": 40,
-    "Other - Entertainment/Public Assembly": 40,
-    "Other - Mall": 40,
-    "Other - Public Services": 40,
-    "Other - Recreation": 50,
-    "Other - Restaurant/Bar": 231,
-    "Other - Technology/Science": 50,
-    "Other - Utility": 50,
-    "Personal Services (Health/Beauty, Dry Cleaning, etc.)": 50,
-    "Residence Hall/Dormitory": 125,
-    "Restaurant": 200,
-    "Retail Store": 105,
-    "Single-Family Home": 39,
-    "Social/Meeting Hall": 100,
-    "Strip Mall": 110,
-    "Transportation Terminal/Station": 150,
-    "Worship Facility": 50
-}
-
 # Get all buildings for dropdown
-buildings_query = """
-    SELECT DISTINCT 
-        [espmid],
-        [buildingname],
-        [usetype],
-        [sqfootage],
-        [address]
-    FROM [dbo].[ESPMFIRSTTEST]
-    WHERE [buildingname] IS NOT NULL
-    AND [espmid] IS NOT NULL
-    ORDER BY [buildingname]
-"""
-
-buildings_df = conn.query(buildings_query)
+buildings_df = get_building_list()
 
 # Create dropdown with building names
 building_names = buildings_df['buildingname'].tolist()
@@ -100,7 +39,7 @@ with col2:
 
 # Get baseline EUI
 building_use_type = str(building_info['usetype']) if pd.notna(building_info['usetype']) else ""
-baseline_eui_value = baseline_eui.get(building_use_type, None)
+baseline_eui_value = BASELINE_EUI.get(building_use_type, None)
 building_type = building_info['usetype']
 
 # Tabling averaged eui of usetype for now...
@@ -176,80 +115,44 @@ building_type = building_info['usetype']
 # total_kbtu = (electric_total * KWH_TO_KBTU) - (solar_total * KWH_TO_KBTU) + (gas_total * THERM_TO_KBTU)
 # average_eui_of_usetype = total_kbtu / total_sq_ft if total_sq_ft > 0 else 0
 
-# Function to get meter data
-def get_meter_data(table_name, espmid, energy_type):
-    query = f"""
-        SELECT 
-            [entryid],
-            [meterid],
-            TRY_CAST([usage] AS FLOAT) as usage,
-            [startdate],
-            [enddate]
-        FROM [dbo].[{table_name}]
-        WHERE [espmid] = '{espmid}'
-        ORDER BY [startdate]
-    """
-    df = conn.query(query)
-    if not df.empty:
-        df['energy_type'] = energy_type
-        df['startdate'] = pd.to_datetime(df['startdate'])
-        df['enddate'] = pd.to_datetime(df['enddate'])
-        df['year'] = df['startdate'].dt.year
-    else:
-        # Create empty dataframe WITH the 'year' column
-        df = pd.DataFrame(columns=['entryid', 'meterid', 'usage', 'startdate', 'enddate', 'energy_type', 'year'])
-    
-    return df
-
-# Then after getting the data, ensure all dataframes have 'year' column
-# Get data from all tables
-electric_df = get_meter_data('electric', selected_espmid, 'Electric')
-gas_df = get_meter_data('naturalgas', selected_espmid, 'Natural Gas')
-solar_df = get_meter_data('solar', selected_espmid, 'Solar')
+# All fuels for one building in a single round-trip, tagged by energy_type
+all_meter_data = get_building_meter_data(selected_espmid)
+electric_df = all_meter_data[all_meter_data['energy_type'] == 'Electric']
+gas_df = all_meter_data[all_meter_data['energy_type'] == 'Natural Gas']
+solar_df = all_meter_data[all_meter_data['energy_type'] == 'Solar']
 
-# Combine all data for display
-all_meter_data = pd.concat([electric_df, gas_df, solar_df], ignore_index=True)
+# Annual totals per fuel, calendarized and pre-aggregated by the weekly ingest (kbtu is already negative for solar)
+rollup_df = get_building_rollup(selected_espmid)
 
 # 1. Calculate EUI for MOST RECENT YEAR ONLY
 if pd.notna(building_info['sqfootage']):
     try:
         sqft_value = float(building_info['sqfootage'])
         
-        if not all_meter_data.empty:
+        if not rollup_df.empty:
             # Find the most recent year with data
-            years_with_data = sorted(all_meter_data['year'].unique())
+            years_with_data = sorted(rollup_df['year'].unique())
             
             if years_with_data:
                 latest_year = years_with_data[-1]
                 latest_year = 2024
                 
-                # Calculate total kBTU for the most recent year only
-                total_kbtu = 0
-                
+                # Total kBTU for the most recent year, straight from the rollup
+                year_rollup = rollup_df[rollup_df['year'] == latest_year]
+                usage_by_fuel = year_rollup.groupby('fuel')['usage'].sum()
+                total_kbtu = year_rollup['kbtu'].sum()
 
                 # Electric for most recent year
-                electric_recent = electric_df[electric_df['year'] == latest_year]
-                if not electric_recent.empty and 'usage' in electric_recent.columns:
-                    electric_kwh = electric_recent['usage'].sum()
-                    one = electric_kwh * KWH_TO_KBTU
+                if 'Electric' in usage_by_fuel:
+                    electric_kwh = usage_by_fuel['Electric']
                     st.subheader(str(electric_kwh))
-                    st.subheader(str(one))
-                    total_kbtu += electric_kwh * KWH_TO_KBTU
-                
-                # Natural Gas for most recent year
-                gas_recent = gas_df[gas_df['year'] == latest_year]
-                if not gas_recent.empty and 'usage' in gas_recent.columns:
-                    gas_therms = gas_recent['usage'].sum()
-                    total_kbtu += gas_therms * THERM_TO_KBTU
-                
-                # Solar for most recent year (subtract since it reduces energy use)
-                solar_recent = solar_df[solar_df['year'] == latest_year]
-                if not solar_recent.empty and 'usage' in solar_recent.columns:
-                    solar_kwh = solar_recent['usage'].sum()
-                    one = electric_kwh * KWH_TO_KBTU
+                    st.subheader(str(electric_kwh * KWH_TO_KBTU))
+
+                # Solar for most recent year (already subtracted in total_kbtu)
+                if 'Solar' in usage_by_fuel:
+                    solar_kwh = usage_by_fuel['Solar']
                     st.subheader(str(solar_kwh))
-                    st.subheader(str(one))
-                    total_kbtu -= solar_kwh * KWH_TO_KBTU
+                    st.subheader(str(solar_kwh * KWH_TO_KBTU))
                 
                 # Calculate EUI for most recent year
                 
@@ -300,6 +203,64 @@ if pd.notna(building_info['sqfootage']):
     except (ValueError, TypeError) as e:
         st.info(f"Cannot calculate EUI: {e}")
 
+# Percentile within peer groups (same use type, same category), precomputed by the weekly ingest over complete
+# years only, so the latest year here is the latest one with all 12 months for this building
+peers_df = get_building_peers(selected_espmid)
+if not peers_df.empty:
+    peer_year = int(peers_df['year'].max())
+    year_peers = peers_df[peers_df['year'] == peer_year]
+    st.write(f"### Peer Comparison ({peer_year})")
+    peer_cols = st.columns(len(year_peers))
+    for peer_col, (_, peer) in zip(peer_cols, year_peers.iterrows()):
+        with peer_col:
+            label = "Use type" if peer['peer_type'] == 'usetype' else "Category"
+            if pd.notna(peer['percentile']):
+                st.metric(
+                    f"{label}: {peer['peer_group']}",
+                    f"{peer['percentile']:.0f}th percentile",
+                    help="Share of peer buildings with a lower EUI (0 = most efficient)"
+                )
+                st.caption(
+                    f"EUI {peer['eui']:.1f} vs. peer median {peer['eui_median']:.1f} "
+                    f"(quartiles {peer['eui_p25']:.1f}-{peer['eui_p75']:.1f}) across {int(peer['peer_count'])} buildings"
+                )
+            else:
+                st.metric(f"{label}: {peer['peer_group']}", "No peers")
+
+# Weather-normalized EUI (what the building would use in a typical weather year), fitted by the weekly ingest
+normalized_df = get_building_normalized(selected_espmid)
+if not normalized_df.empty and pd.notna(building_info['sqfootage']) and float(building_info['sqfootage']) > 0:
+    normalized_year = normalized_df.iloc[-1]
+    sqft_value = float(building_info['sqfootage'])
+    st.write(f"### Weather-Normalized EUI ({int(normalized_year['year'])})")
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Actual EUI", f"{normalized_year['kbtu'] / sqft_value:.1f}")
+    with col2:
+        st.metric(
+            "Weather-Normalized EUI",
+            f"{normalized_year['normalized_kbtu'] / sqft_value:.1f}",
+            help="Monthly use regressed on heating and cooling degree days, evaluated under typical weather"
+        )
+
+# Monthly energy by fuel, with each bill prorated across the calendar months it covers
+monthly_df = get_building_monthly(selected_espmid)
+if not monthly_df.empty:
+    fig_monthly = px.bar(
+        monthly_df,
+        x='month_start',
+        y='kbtu',
+        color='fuel',
+        title="Monthly Site Energy by Fuel (kBTU, calendarized)"
+    )
+    fig_monthly.update_layout(
+        barmode='relative',
+        xaxis_title="Month",
+        yaxis_title="kBTU",
+        height=400
+    )
+    st.plotly_chart(fig_monthly, use_container_width=True)
+
 # 2. Stepped line graphs for each energy type
 
 # Electric stepped line graph
@@ -1,12 +1,105 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from auth_helper import require_login
+from building_comparison import RANK_METRICS, compare_buildings, complete_years, default_year, fuel_breakdown, rank_buildings, year_metrics
+from data_access import get_building_metrics
 
 require_login()
 
 st.title("Building Comparison Tool")
-st.write("This tool is in progress.")
-conn = st.connection("sql", type="sql")
 
+# The whole per-building matrix, refreshed by the weekly ingest; everything below works on it in memory
+matrix = get_building_metrics()
+
+if matrix.empty:
+    st.info("No building metrics yet. They are computed by the weekly data refresh.")
+    st.stop()
+
+# Pick the year and metric to compare on; a year still being billed is marked, since its totals cover only part of it
+years = sorted((int(year) for year in matrix['year'].unique()), reverse=True)
+full_years = complete_years(matrix)
+col1, col2 = st.columns(2)
+with col1:
+    selected_year = st.selectbox(
+        "Year:",
+        years,
+        index=years.index(default_year(matrix)),
+        format_func=lambda year: str(year) if year in full_years else f"{year} (partial year)"
+    )
+with col2:
+    selected_metric = st.selectbox("Rank by:", list(RANK_METRICS), format_func=RANK_METRICS.get)
+
+metrics = year_metrics(matrix, selected_year)
+
+# Ranking of every building (optionally within some use types)
+st.subheader("Building Rankings")
+usetypes = sorted(metrics['usetype'].dropna().unique())
+selected_usetypes = st.multiselect("Limit to use types:", usetypes)
+ranked = rank_buildings(metrics, selected_metric, selected_usetypes)
+
+display_cols = ['rank', 'buildingname', 'usetype', 'eui', 'baseline_eui', 'pct_vs_baseline', 'cost_per_sqft', 'site_kbtu', 'sqfootage', 'months_covered']
+st.dataframe(
+    ranked[display_cols],
+    column_config={
+        'rank': 'Rank',
+        'buildingname': 'Building',
+        'usetype': 'Use Type',
+        'eui': st.column_config.NumberColumn(RANK_METRICS['eui'], format="%.1f"),
+        'baseline_eui': st.column_config.NumberColumn('Baseline EUI', format="%.0f"),
+        'pct_vs_baseline': st.column_config.NumberColumn(RANK_METRICS['pct_vs_baseline'], format="%+.1f%%"),
+        'cost_per_sqft': st.column_config.NumberColumn(RANK_METRICS['cost_per_sqft'], format="$%.2f"),
+        'site_kbtu': st.column_config.NumberColumn(RANK_METRICS['site_kbtu'], format="%.0f"),
+        'sqfootage': st.column_config.NumberColumn('Sq Ft', format="%.0f"),
+        'months_covered': st.column_config.NumberColumn('Months of Data', format="%d"),
+    },
+    hide_index=True,
+    use_container_width=True,
+    height=400
+)
+st.write(f"**Buildings ranked:** {ranked['rank'].notna().sum()} of {len(ranked)}")
+
+# Side-by-side comparison of selected buildings
+st.subheader("Compare Buildings")
+building_options = ranked.index.tolist()
+building_names = metrics['buildingname'].to_dict()
+selected_espmids = st.multiselect(
+    "Select buildings to compare:",
+    building_options,
+    default=building_options[:min(5, len(building_options))],
+    format_func=lambda espmid: building_names.get(espmid) or str(espmid)
+)
+
+if selected_espmids:
+    compared = compare_buildings(ranked, selected_espmids)
+
+    # EUI against each building's baseline
+    fig_eui = go.Figure()
+    fig_eui.add_trace(go.Bar(x=compared['buildingname'], y=compared['eui'], name='Current EUI'))
+    fig_eui.add_trace(go.Bar(x=compared['buildingname'], y=compared['baseline_eui'], name='Baseline EUI'))
+    fig_eui.update_layout(
+        barmode='group',
+        title=f"Energy Use Intensity Comparison, {selected_year} (kBTU/sq ft)",
+        yaxis_title="kBTU/sq ft",
+        height=450
+    )
+    st.plotly_chart(fig_eui, use_container_width=True)
+
+    # Annual energy by fuel (solar generation shows below zero)
+    fig_fuel = px.bar(
+        fuel_breakdown(compared),
+        x='buildingname',
+        y='kbtu',
+        color='fuel',
+        title=f"Site Energy by Fuel, {selected_year} (kBTU)"
+    )
+    fig_fuel.update_layout(barmode='relative', xaxis_title="Building", yaxis_title="kBTU", height=450)
+    st.plotly_chart(fig_fuel, use_container_width=True)
+
+    st.dataframe(
+        compared[display_cols].reset_index(drop=True),
+        hide_index=True,
+        use_container_width=True
+    )
+else:
+    st.info("Select one or more buildings to compare.")
@@ -1,5 +1,8 @@
 import streamlit as st
 from auth_helper import require_login
+from query_cache import cache_stats
+from data_access import get_buildings, get_meter_periods
+from meter_types import METER_TYPES
 from datetime import timedelta
 import pandas as pd
 
@@ -8,10 +11,8 @@ st.title("Account Details")
 st.write("Welcome to the 2030 District data hub. Building data is sourced from [Energy Star Portfolio Manager](https://portfoliomanager.energystar.gov/pm/login?testEnv=false) and refreshed weekly.")
 st.write("Access a list of all the buildings in your portfolio here. Check to make sure none of your buildings are missing meter data.")
 
-conn = st.connection("sql", type="sql")
-
 # excluded espmid, 865 entries for total portfolio in 
-df = conn.query("SELECT TOP (1000) [espmid],[buildingname],[sqfootage],[usetype], [occupancy], [numbuildings] FROM [dbo].[ESPMFIRSTTEST];")
+df = get_buildings()
 
 # Display the table without espmid and edit labels
 display_df = df.drop(columns=['espmid']).rename(columns={
@@ -27,77 +28,57 @@ st.dataframe(display_df, height=500, hide_index=True)
 
 
 
-# Get all espmids first
-espmids = df['espmid'].tolist()
-
-electric_gaps = {}
-gas_gaps = {}
-solar_gaps = {}
-
-def find_gaps(database_nm, gap_dict):
-    if espmids:
-        # Create a comma-separated list for SQL IN clause
-        espmid_list = ",".join([f"'{str(espmid)}'" for espmid in espmids])
-    
-        all_meters_query = f"""
-            SELECT [espmid], [meterid], [startdate], [enddate]
-            FROM [dbo].[{database_nm}]
-            WHERE [espmid] IN ({espmid_list})
-            ORDER BY [espmid], [startdate]
-        """
-    
-        all_meters_df = conn.query(all_meters_query)
-    
-        # Group by espmid in Python
-        grouped = all_meters_df.groupby('espmid')
-    
-    
-        for espmid, group_df in grouped:
-            if len(group_df) <= 1:
-                gap_dict[espmid] = []
-                continue
-        
-            group_df['startdate'] = pd.to_datetime(group_df['startdate'])
-            group_df['enddate'] = pd.to_datetime(group_df['enddate'])
-        
-            espmid_gaps = []
-            for i in range(len(group_df) - 1):
-                if group_df.iloc[i + 1]['startdate'] > group_df.iloc[i]['enddate'] + timedelta(days=1):
-                    espmid_gaps.append({
-                        'gap_start': group_df.iloc[i]['enddate'] + timedelta(days=1),
-                        'gap_end': group_df.iloc[i + 1]['startdate'] - timedelta(days=1)
-                    })
-        
-            gap_dict[espmid] = espmid_gaps
-
-def print_gaps(gap_dict):
-    if any(gap_dict.values()):
-        for espmid, gap_list in gap_dict.items():
-            if gap_list:
-                # Get building name for this espmid
-                building_row = df[df['espmid'] == espmid]
-                if not building_row.empty:
-                    building_name = building_row.iloc[0]['buildingname']
-                else:
-                    building_name = f"ESPM ID {espmid}"  # Fallback
-            
-                for gap in gap_list:
-                    # Format dates in words
-                    start_date_str = gap['gap_start'].strftime('%b %d, %Y')  
-                    end_date_str = gap['gap_end'].strftime('%b %d, %Y')      
-                
-                    st.error(f"**{building_name}**: Gap from {start_date_str} to {end_date_str}")
-    else:
+def find_gaps(periods_df):
+    """
+    Find gaps between consecutive billing periods on each meter. Periods are sorted by
+    (energy_type, espmid, meterid, startdate) and each one is compared with the next period on the same
+    meter using shift(), so the whole portfolio is checked in one vectorized pass.
+    """
+    one_day = timedelta(days=1)
+    meter_keys = ['energy_type', 'espmid', 'meterid']
+    periods = periods_df.sort_values(meter_keys + ['startdate'])
+    periods['startdate'] = pd.to_datetime(periods['startdate'])
+    periods['enddate'] = pd.to_datetime(periods['enddate'])
+
+    by_meter = periods.groupby(meter_keys, sort=False)
+    next_start = by_meter['startdate'].shift(-1)
+    # Latest end date so far on the meter, so an overlapping bill can't hide a later gap
+    covered_until = by_meter['enddate'].cummax()
+    is_gap = next_start > covered_until + one_day
+
+    gaps = periods.loc[is_gap, meter_keys].copy()
+    gaps['gap_start'] = covered_until[is_gap] + one_day
+    gaps['gap_end'] = next_start[is_gap] - one_day
+    return gaps.sort_values(['espmid', 'gap_start'])
+
+def print_gaps(gaps):
+    if gaps.empty:
         st.success("No gaps found in meter data.")
+        return
+    building_names = df.set_index('espmid')['buildingname']
+    for gap in gaps.itertuples(index=False):
+        # Get building name for this espmid
+        building_name = building_names.get(gap.espmid)
+        if pd.isna(building_name):
+            building_name = f"ESPM ID {gap.espmid}"  # Fallback
+
+        # Format dates in words
+        start_date_str = gap.gap_start.strftime('%b %d, %Y')
+        end_date_str = gap.gap_end.strftime('%b %d, %Y')
+
+        st.error(f"**{building_name}**: Gap from {start_date_str} to {end_date_str}")
 
-st.header("Electric Meter Gaps")
-find_gaps('electric', electric_gaps)
-print_gaps(electric_gaps)
+# Every meter period for the listed buildings, across all meter tables, in one query
+all_gaps = find_gaps(get_meter_periods(df['espmid']))
 
-st.header("Natural Gas Meter Gaps")
-find_gaps('naturalgas', gas_gaps)
-print_gaps(gas_gaps)
+for meter_type in METER_TYPES.values():
+    st.header(f"{meter_type['energy_type']} Meter Gaps")
+    print_gaps(all_gaps[all_gaps['energy_type'] == meter_type['energy_type']])
 
-st.header("Solar Meter Gaps")
-find_gaps('solar', solar_gaps)
-print_gaps(solar_gaps)
+# Dashboard cache counters (shared by all pages since the app started)
+with st.expander("Dashboard cache"):
+    stats = cache_stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Cache Hits", f"{stats['hits']:,}")
+    col2.metric("Cache Misses", f"{stats['misses']:,}")
+    col3.metric("Hit Rate", f"{stats['hit_rate']:.0%}")
@@ -0,0 +1,328 @@
+# fake_espm.py
+# Local stand-in for the Portfolio Manager web services that full_update.py calls. Serves recorded XML from a
+# directory when a file exists for the path, otherwise deterministic synthetic data for a portfolio of any size,
+# so the ingest can be run end-to-end offline. Point full_update.py at it with ESPM_BASE_URL=http://host:port/ws.
+#
+#   python bench/fake_espm.py --properties 1000 --latency-ms 40 --port 8765
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from xml.sax.saxutils import escape
+
+FIRST_ESPMID = 10000000
+DEFAULT_START_DATE = date(2020, 1, 1)
+DEFAULT_END_DATE = date(2025, 12, 31)
+
+USETYPES = [
+    'Office', 'K-12 School', 'Multifamily Housing', 'Retail Store', 'Worship Facility',
+    'Non-Refrigerated Warehouse', 'Restaurant', 'Hotel', 'College/University', 'Fire Station',
+]
+
+# (ESPM meter type, unit of measure, typical monthly usage per 1,000 sq ft)
+METER_KINDS = {
+    'electric': ('Electric', 'kWh (thousand Watt-hours)', 1200.0),
+    'gas': ('Natural Gas', 'therms', 45.0),
+    'solar': ('Electric on Site Solar', 'kWh (thousand Watt-hours)', 150.0),
+    'water': ('Municipally Supplied Potable Water - Indoor', 'kGal (thousand gallons) (US)', 2.0),
+}
+
+ROUTES = [
+    ('property_list', re.compile(r'^/ws/account/(\d+)/property/list$')),
+    ('property', re.compile(r'^/ws/property/(\d+)$')),
+    ('meter_association', re.compile(r'^/ws/association/property/(\d+)/meter$')),
+    ('meter', re.compile(r'^/ws/meter/(\d+)$')),
+    ('consumption', re.compile(r'^/ws/meter/(\d+)/consumptionData$')),
+]
+
+
+def month_starts(start, end):
+    """First day of every month from the month containing start through the month containing end."""
+    year, month = start.year, start.month
+    while date(year, month, 1) <= end:
+        yield date(year, month, 1)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def month_end(month_start):
+    if month_start.month == 12:
+        return date(month_start.year, 12, 31)
+    return date.fromordinal(date(month_start.year, month_start.month + 1, 1).toordinal() - 1)
+
+
+class SyntheticPortfolio:
+    """
+    Deterministic fake portfolio: the same seed and size always produce the same XML, byte for byte.
+    Property IDs run from FIRST_ESPMID; meter IDs are espmid * 10 + meter number.
+    """
+
+    def __init__(self, properties, seed=0, end_date=DEFAULT_END_DATE):
+        self.properties = properties
+        self.seed = seed
+        self.end_date = end_date
+
+    def _rng(self, *key):
+        return random.Random(f'{self.seed}:' + ':'.join(str(part) for part in key))
+
+    def espmids(self):
+        return range(FIRST_ESPMID, FIRST_ESPMID + self.properties)
+
+    def has_property(self, espmid):
+        return FIRST_ESPMID <= espmid < FIRST_ESPMID + self.properties
+
+    def meter_kinds(self, espmid):
+        """Meter kinds on a property, in meter-number order. Every property has electric."""
+        rng = self._rng('meters', espmid)
+        kinds = ['electric']
+        if rng.random() < 0.8:
+            kinds.append('gas')
+        if rng.random() < 0.15:
+            kinds.append('solar')
+        # A meter type the ingest ignores, so the skip path gets exercised too
+        if rng.random() < 0.3:
+            kinds.append('water')
+        return kinds
+
+    def meter(self, meterid):
+        """(espmid, kind, in_use) for a meter ID, or None if it doesn't exist."""
+        espmid, number = divmod(meterid, 10)
+        if not self.has_property(espmid):
+            return None
+        kinds = self.meter_kinds(espmid)
+        if number >= len(kinds):
+            return None
+        in_use = self._rng('inuse', meterid).random() >= 0.05
+        return espmid, kinds[number], in_use
+
+    def gross_floor_area(self, espmid):
+        return self._rng('gfa', espmid).randrange(5000, 400000, 500)
+
+    def property_list_xml(self):
+        links = ''.join(
+            f'<link id="{espmid}" hint="Building {espmid}" link="/property/{espmid}" httpMethod="GET"/>'
+            for espmid in self.espmids()
+        )
+        return f'<?xml version="1.0" encoding="UTF-8"?><response status="Ok"><links>{links}</links></response>'
+
+    def property_xml(self, espmid):
+        rng = self._rng('property', espmid)
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><property>'
+            f'<name>Building {espmid}</name>'
+            f'<primaryFunction>{escape(rng.choice(USETYPES))}</primaryFunction>'
+            f'<address address1="{rng.randrange(1, 5000)} Main St" city="Ann Arbor" postalCode="48104" state="MI" country="US"/>'
+            f'<numberOfBuildings>{rng.choice([1, 1, 1, 2, 3])}</numberOfBuildings>'
+            f'<constructionStatus>Existing</constructionStatus>'
+            f'<grossFloorArea units="Square Feet" temporary="false"><value>{self.gross_floor_area(espmid)}</value></grossFloorArea>'
+            f'<occupancyPercentage>{rng.choice([50, 75, 90, 100])}</occupancyPercentage>'
+            '</property>'
+        )
+
+    def meter_association_xml(self, espmid):
+        meter_ids = ''.join(f'<meterId>{espmid * 10 + number}</meterId>' for number in range(len(self.meter_kinds(espmid))))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><meterPropertyAssociationList>'
+            f'<energyMeterAssociation><meters>{meter_ids}</meters><propertyRepresentation>'
+            '<propertyRepresentationType>Whole Property</propertyRepresentationType></propertyRepresentation>'
+            '</energyMeterAssociation></meterPropertyAssociationList>'
+        )
+
+    def meter_xml(self, meterid):
+        espmid, kind, in_use = self.meter(meterid)
+        meter_type, unit, _ = METER_KINDS[kind]
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?><meter>'
+            f'<id>{meterid}</id><type>{escape(meter_type)}</type><name>{kind} meter {meterid}</name>'
+            f'<metered>true</metered><unitOfMeasure>{escape(unit)}</unitOfMeasure>'
+            f'<firstBillDate>{DEFAULT_START_DATE.isoformat()}</firstBillDate><inUse>{"true" if in_use else "false"}</inUse>'
+            '</meter>'
+        )
+
+    def consumption_xml(self, meterid, start_date):
+        espmid, kind, _ = self.meter(meterid)
+        _, _, usage_per_ksqft = METER_KINDS[kind]
+        base_usage = usage_per_ksqft * self.gross_floor_area(espmid) / 1000
+        entries = []
+        for month_start in month_starts(max(start_date, DEFAULT_START_DATE), self.end_date):
+            rng = self._rng('usage', meterid, month_start.isoformat())
+            # Heating fuels peak in winter, electric a little in summer
+            season = 1 + 0.5 * abs(month_start.month - 7) / 6 if kind == 'gas' else 1 + 0.2 * (month_start.month in (6, 7, 8))
+            usage = round(base_usage * season * rng.uniform(0.85, 1.15), 2)
+            entry_id = meterid * 1000 + (month_start.year - DEFAULT_START_DATE.year) * 12 + month_start.month
+            entries.append(
+                '<meterConsumption estimatedValue="false">'
+                f'<id>{entry_id}</id><cost>{round(usage * 0.14, 2)}</cost>'
+                f'<startDate>{month_start.isoformat()}</startDate><endDate>{month_end(month_start).isoformat()}</endDate>'
+                f'<usage>{usage}</usage></meterConsumption>'
+            )
+        return f'<?xml version="1.0" encoding="UTF-8"?><meterData>{"".join(entries)}</meterData>'
+
+
+class RequestStats:
+    """Per-endpoint request counts, bytes served and handler latencies (including simulated latency)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, status, nbytes, seconds):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, {'requests': 0, 'errors': 0, 'bytes': 0, 'latencies': []})
+            stats['requests'] += 1
+            stats['errors'] += status >= 400
+            stats['bytes'] += nbytes
+            stats['latencies'].append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            report = {}
+            for endpoint, stats in self._endpoints.items():
+                latencies = sorted(stats['latencies'])
+                report[endpoint] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'bytes': stats['bytes'],
+                    'latency_ms_mean': round(1000 * sum(latencies) / len(latencies), 2),
+                    'latency_ms_p95': round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 2),
+                }
+            return report
+
+
+class FakeEspmHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeESPM/1.0'
+
+    def log_message(self, format, *args):
+        # One line per request would swamp the ingest's own output at 10k properties
+        pass
+
+    def do_GET(self):
+        started = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.path == '/__stats':
+            self._send(200, json.dumps(self.server.stats.snapshot()).encode(), 'application/json')
+            return
+        endpoint, status, body = self._route(url)
+        delay = self.server.latency + self.server.jitter * self.server.rng.random()
+        if delay:
+            time.sleep(delay)
+        self._send(status, body, 'application/xml')
+        self.server.stats.record(endpoint, status, len(body), time.perf_counter() - started)
+
+    def _route(self, url):
+        for endpoint, pattern in ROUTES:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            return 'unknown', 404, b'<response status="Error"><errors><error errorNumber="404"/></errors></response>'
+
+        if self.server.throttle_rate and self.server.rng.random() < self.server.throttle_rate:
+            return endpoint, 429, b'<response status="Error"><errors><error errorNumber="429"/></errors></response>'
+
+        recorded = self.server.recorded_body(url.path)
+        if recorded is not None:
+            return endpoint, 200, recorded
+
+        portfolio = self.server.portfolio
+        object_id = int(match.group(1))
+        if endpoint == 'property_list':
+            body = portfolio.property_list_xml()
+        elif endpoint in ('property', 'meter_association'):
+            if not portfolio.has_property(object_id):
+                return endpoint, 404, b'<response status="Error"/>'
+            body = portfolio.property_xml(object_id) if endpoint == 'property' else portfolio.meter_association_xml(object_id)
+        else:
+            if portfolio.meter(object_id) is None:
+                return endpoint, 404, b'<response status="Error"/>'
+            if endpoint == 'meter':
+                body = portfolio.meter_xml(object_id)
+            else:
+                start = parse_qs(url.query).get('startDate', [DEFAULT_START_DATE.isoformat()])[0]
+                body = portfolio.consumption_xml(object_id, date.fromisoformat(start))
+        return endpoint, 200, body.encode()
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeEspmServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server for the fake Portfolio Manager. Bind to port 0 to get a free port;
+    the URL to use as ESPM_BASE_URL is base_url once constructed.
+
+    Args:
+        portfolio: SyntheticPortfolio answering anything not found in record_dir
+        latency_ms / jitter_ms: each response is delayed latency + uniform(0, jitter)
+        record_dir: directory of recorded responses, laid out as <path under /ws>.xml
+            (e.g. property/123.xml, meter/456/consumptionData.xml); these win over synthetic data
+        throttle_rate: fraction of requests answered with 429, to exercise the ingest's retry path
+    """
+    daemon_threads = True
+
+    def __init__(self, address, portfolio, latency_ms=0, jitter_ms=0, record_dir=None, throttle_rate=0.0, seed=0):
+        super().__init__(address, FakeEspmHandler)
+        self.portfolio = portfolio
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.record_dir = record_dir
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.stats = RequestStats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/ws'
+
+    def recorded_body(self, path):
+        if not self.record_dir:
+            return None
+        recorded_path = os.path.join(self.record_dir, *path[len('/ws/'):].split('/')) + '.xml'
+        if not os.path.isfile(recorded_path):
+            return None
+        with open(recorded_path, 'rb') as f:
+            return f.read()
+
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help='base delay added to every response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra uniform random delay per response')
+    parser.add_argument('--record-dir', help='directory of recorded XML responses served ahead of synthetic data')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 429')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic portfolio and latency jitter')
+    parser.add_argument('--end-date', type=date.fromisoformat, default=DEFAULT_END_DATE,
+                        help='last month of synthetic consumption (YYYY-MM-DD)')
+
+
+def make_server(args, properties, host='127.0.0.1', port=0):
+    portfolio = SyntheticPortfolio(properties, seed=args.seed, end_date=args.end_date)
+    return FakeEspmServer((host, port), portfolio, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                          record_dir=args.record_dir, throttle_rate=args.throttle_rate, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake Portfolio Manager web service for offline ingest runs.')
+    parser.add_argument('--properties', type=int, default=100, help='number of synthetic properties')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args, args.properties, args.host, args.port)
+    print(f'Serving {args.properties} properties at {server.base_url} (stats at /__stats)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,143 @@
+# run_ingest_bench.py
+# Runs full_update.py end-to-end against the fake Portfolio Manager (fake_espm.py) and a local database at one
+# or more portfolio sizes, and reports wall time, throughput, peak memory and request counts/latencies as JSON.
+#
+#   python bench/run_ingest_bench.py --properties 100 1000 10000 --latency-ms 40 \
+#       --db "Driver={ODBC Driver 18 for SQL Server};Server=localhost,1433;Database=bench;Uid=sa;Pwd=...;TrustServerCertificate=yes"
+#   python bench/run_ingest_bench.py --properties 100 1000 --sqlite bench/logs/bench.db
+#
+# Each size should start from an empty database (or pass --full-sync) so runs are comparable.
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+from fake_espm import add_server_arguments, make_server
+
+FULL_UPDATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'full_update.py')
+
+
+def run_once(args, properties):
+    """
+    Serve a portfolio of the given size, run full_update.py against it once and return the measurements.
+    """
+    server = make_server(args, properties)
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    env = dict(os.environ)
+    env.update({
+        'ESPM_BASE_URL': server.base_url,
+        'ESPM_ACCOUNT_ID': '1',
+        'ENERGY_STAR_PORTFOLIO_MANAGER_USERNAME': 'bench',
+        'ENERGY_STAR_PORTFOLIO_MANAGER_PASSWORD': 'bench',
+        # The fake server is local, so don't let the production rate limit hide regressions
+        'ESPM_MAX_REQUESTS_PER_SECOND': str(args.max_requests_per_second),
+        'PYTHONUNBUFFERED': '1',
+    })
+    if args.sqlite:
+        env.update({'STORAGE_BACKEND': 'sqlite', 'SQLITE_PATH': os.path.abspath(args.sqlite)})
+    else:
+        env.update({'STORAGE_BACKEND': 'sqlserver', 'DATABASE_CONNECTION_STRING': args.db})
+    if args.workers:
+        env['ESPM_MAX_WORKERS'] = str(args.workers)
+    if args.full_sync:
+        env['ESPM_FULL_SYNC'] = '1'
+
+    log_path = os.path.join(args.log_dir, f'full_update_{properties}.log')
+    # The ingest's own per-stage report, embedded in the result below
+    ingest_report_path = os.path.join(args.log_dir, f'ingest_report_{properties}.json')
+    env['INGEST_REPORT_PATH'] = ingest_report_path
+    try:
+        with open(log_path, 'w') as log:
+            started = time.perf_counter()
+            process = subprocess.Popen([sys.executable, FULL_UPDATE], env=env, stdout=log, stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(FULL_UPDATE))
+            # wait4 gives this child's own resource usage, not the running max over every child so far
+            _, status, rusage = os.wait4(process.pid, 0)
+            wall_seconds = time.perf_counter() - started
+        exit_code = os.waitstatus_to_exitcode(status)
+
+        with urllib.request.urlopen(f'{server.base_url.rsplit("/ws", 1)[0]}/__stats') as response:
+            endpoints = json.load(response)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    ingest_report = None
+    if os.path.exists(ingest_report_path):
+        with open(ingest_report_path) as f:
+            ingest_report = json.load(f)
+
+    total_requests = sum(stats['requests'] for stats in endpoints.values())
+    return {
+        'properties': properties,
+        'exit_code': exit_code,
+        'wall_seconds': round(wall_seconds, 2),
+        'properties_per_second': round(properties / wall_seconds, 2) if wall_seconds else None,
+        'requests': total_requests,
+        'requests_per_second': round(total_requests / wall_seconds, 2) if wall_seconds else None,
+        'bytes_served': sum(stats['bytes'] for stats in endpoints.values()),
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        'peak_rss_mb': round(rusage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1),
+        'user_cpu_seconds': round(rusage.ru_utime, 2),
+        'system_cpu_seconds': round(rusage.ru_stime, 2),
+        'endpoints': endpoints,
+        'ingest': ingest_report,
+        'log': log_path,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark full_update.py offline against a fake Portfolio Manager.')
+    parser.add_argument('--properties', type=int, nargs='+', default=[100],
+                        help='portfolio sizes to run, e.g. 100 1000 10000')
+    parser.add_argument('--db', default=os.environ.get('BENCH_DATABASE_CONNECTION_STRING'),
+                        help='ODBC connection string of the local target database (or BENCH_DATABASE_CONNECTION_STRING)')
+    parser.add_argument('--sqlite', help='write to this SQLite file instead of SQL Server')
+    parser.add_argument('--workers', type=int, help='ESPM_MAX_WORKERS for the ingest (defaults to its own)')
+    parser.add_argument('--max-requests-per-second', type=float, default=10000,
+                        help='ESPM_MAX_REQUESTS_PER_SECOND for the ingest')
+    parser.add_argument('--full-sync', action='store_true', help='ignore watermarks and re-pull all history')
+    parser.add_argument('--log-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs'))
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.db and not args.sqlite:
+        parser.error('a local target database is required: pass --db (or set BENCH_DATABASE_CONNECTION_STRING) or --sqlite')
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    report = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'settings': {
+            'latency_ms': args.latency_ms,
+            'jitter_ms': args.jitter_ms,
+            'throttle_rate': args.throttle_rate,
+            'seed': args.seed,
+            'record_dir': args.record_dir,
+            'workers': args.workers,
+            'full_sync': args.full_sync,
+            'storage': 'sqlite' if args.sqlite else 'sqlserver',
+        },
+        'runs': [],
+    }
+    for properties in args.properties:
+        print(f'Running full_update.py against {properties} properties...', file=sys.stderr)
+        result = run_once(args, properties)
+        print(f"  exit {result['exit_code']} in {result['wall_seconds']}s, {result['requests']} requests, "
+              f"peak RSS {result['peak_rss_mb']} MB", file=sys.stderr)
+        report['runs'].append(result)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
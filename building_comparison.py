@@ -0,0 +1,68 @@
+# building_comparison.py
+# Comparison and ranking over the building_metrics matrix that full_update.py refreshes. The page loads the
+# whole matrix once (cached until the next refresh), so picking buildings or re-sorting is vectorized pandas
+# work on a few thousand rows, never a query per building.
+import pandas as pd
+
+from meter_types import FUEL_KBTU_COLUMNS
+
+# Metrics buildings can be ranked on: column -> label. Lower is better for all of them.
+RANK_METRICS = {
+    'eui': 'EUI (kBTU/sq ft)',
+    'pct_vs_baseline': '% vs Baseline EUI',
+    'cost_per_sqft': 'Cost per Sq Ft ($)',
+    'site_kbtu': 'Site Energy (kBTU)',
+}
+
+
+def complete_years(matrix):
+    """
+    Years with all 12 calendarized months for at least half as many buildings as the best-covered year. The
+    current year is still being billed, so calendarization gives every building a few months of it and it
+    only becomes complete once it's over.
+    """
+    counts = matrix[matrix['months_covered'] == 12].groupby('year')['espmid'].count()
+    if counts.empty:
+        return []
+    return sorted(int(year) for year in counts[counts >= counts.max() / 2].index)
+
+
+def default_year(matrix):
+    """Most recent complete year, or the most recent year at all if none is complete yet."""
+    years = complete_years(matrix)
+    return years[-1] if years else int(matrix['year'].max())
+
+
+def year_metrics(matrix, year):
+    """One row per building for a year, indexed by espmid."""
+    return matrix[matrix['year'] == year].set_index('espmid')
+
+
+def rank_buildings(metrics, metric, usetypes=None):
+    """
+    Rank buildings on a metric, 1 being the lowest value; ties share a rank and buildings without a value
+    (e.g. no square footage) are left unranked at the bottom. With usetypes, only those use types are ranked.
+
+    Returns:
+        metrics with a 'rank' column, sorted by it
+    """
+    if usetypes:
+        metrics = metrics[metrics['usetype'].isin(usetypes)]
+    ranked = metrics.assign(rank=metrics[metric].rank(method='min', na_option='keep').astype('Int64'))
+    return ranked.sort_values(['rank', 'buildingname'], na_position='last')
+
+
+def compare_buildings(metrics, espmids):
+    """The selected buildings' rows, in selection order."""
+    return metrics.loc[[espmid for espmid in espmids if espmid in metrics.index]]
+
+
+def fuel_breakdown(metrics):
+    """
+    Long-format kBTU per building and fuel for a stacked bar chart (solar is negative, as in the rollup).
+    """
+    fuels = metrics[['buildingname'] + list(FUEL_KBTU_COLUMNS.values())].melt(
+        id_vars='buildingname', var_name='fuel', value_name='kbtu'
+    )
+    fuels['fuel'] = fuels['fuel'].map({column: fuel for fuel, column in FUEL_KBTU_COLUMNS.items()})
+    return fuels[pd.notna(fuels['kbtu']) & (fuels['kbtu'] != 0)]
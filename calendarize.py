@@ -0,0 +1,66 @@
+# calendarize.py
+# Splits billing periods across the calendar months they cover, weighted by days, so a bill running
+# Dec 15 - Jan 14 counts half toward each year instead of landing wholly in the year it starts. The split is
+# done for every period at once with NumPy date arithmetic, not row by row.
+import numpy as np
+import pandas as pd
+
+
+def split_by_month(startdates, enddates):
+    """
+    Split periods into their calendar-month pieces.
+
+    Args:
+        startdates, enddates: datetime64 arrays; both days are part of the period. A period that ends before
+            it starts is treated as the single day it starts on.
+
+    Returns:
+        (period, month, weight) arrays with one element per piece: the index of the period it came from, its
+        month (datetime64[M]) and the share of the period's days that fall in that month. Each period's
+        weights sum to 1.
+    """
+    starts = np.asarray(startdates, dtype='datetime64[D]')
+    # Exclusive end, so day counts are plain differences
+    ends = np.maximum(np.asarray(enddates, dtype='datetime64[D]') + 1, starts + 1)
+    period_days = (ends - starts).astype(np.int64)
+
+    first_months = starts.astype('datetime64[M]')
+    last_months = (ends - 1).astype('datetime64[M]')
+    month_counts = (last_months - first_months).astype(np.int64) + 1
+
+    # One row per (period, month): repeat each period once per month it touches, then step through its months
+    period = np.repeat(np.arange(len(starts)), month_counts)
+    offsets = np.arange(len(period)) - np.repeat(np.cumsum(month_counts) - month_counts, month_counts)
+    month = first_months[period] + offsets
+
+    month_starts = month.astype('datetime64[D]')
+    month_ends = (month + 1).astype('datetime64[D]')
+    overlap_days = (np.minimum(ends[period], month_ends) - np.maximum(starts[period], month_starts)).astype(np.int64)
+    return period, month, overlap_days / period_days[period]
+
+
+def calendarize(periods, key_columns, value_columns):
+    """
+    Prorate each period's values across calendar months and total them per key and month.
+
+    Args:
+        periods: DataFrame with startdate, enddate, key_columns and value_columns; rows without both dates are skipped
+        key_columns: columns identifying a series, e.g. ['espmid', 'fuel']
+        value_columns: additive columns to prorate, e.g. ['usage', 'kbtu', 'cost']; missing values stay missing
+
+    Returns:
+        DataFrame of key_columns, year, month (1-12) and value_columns
+    """
+    startdates = pd.to_datetime(periods['startdate'])
+    enddates = pd.to_datetime(periods['enddate'])
+    valid = (startdates.notna() & enddates.notna()).to_numpy()
+    period, month, weight = split_by_month(startdates[valid].to_numpy(), enddates[valid].to_numpy())
+
+    monthly = periods.loc[valid, key_columns].iloc[period].reset_index(drop=True)
+    months_since_epoch = month.astype(np.int64)
+    monthly['year'] = months_since_epoch // 12 + 1970
+    monthly['month'] = months_since_epoch % 12 + 1
+    for column in value_columns:
+        values = pd.to_numeric(periods.loc[valid, column], errors='coerce').to_numpy(dtype=float)
+        monthly[column] = values[period] * weight
+    return monthly.groupby(key_columns + ['year', 'month'], as_index=False)[value_columns].sum(min_count=1)
@@ -0,0 +1,236 @@
+# connection_pool.py
+# Database connections for full_update.py. A small pool hands each thread its own connection and cursor
+# (a DB-API connection can't be shared between threads), checks a connection is alive only when there's
+# reason to doubt it (after an error, or after sitting idle), and retries transient failures under one
+# RetryPolicy instead of a ping before every statement.
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Substrings of driver errors that mean the link dropped or timed out, rather than a problem with the statement
+TRANSIENT_ERROR_MARKERS = ('communication link failure', '08s01', 'connection', 'timeout', 'timed out')
+
+
+class RetryPolicy:
+    """
+    How many times to try a database operation and how long to wait between attempts
+    (backoff_factor ** attempt seconds). Only transient (connection/timeout) errors are retried.
+    """
+
+    def __init__(self, max_attempts=3, backoff_factor=2):
+        self.max_attempts = max_attempts
+        self.backoff_factor = backoff_factor
+
+    def is_transient(self, error):
+        error_str = str(error).lower()
+        return any(marker in error_str for marker in TRANSIENT_ERROR_MARKERS)
+
+    def should_retry(self, error, attempt):
+        return self.is_transient(error) and attempt < self.max_attempts - 1
+
+    def wait(self, attempt):
+        time.sleep(self.backoff_factor ** attempt)
+
+
+class PooledConnection:
+    """
+    A connection, its cursor and when it was last handed out.
+    """
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+        self.last_used = time.monotonic()
+
+    def close(self):
+        for closeable in (self.cursor, self.connection):
+            try:
+                closeable.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """
+    Per-thread connections to a storage backend (see storage.py), kept in a pool of up to `size` idle ones.
+
+    current() binds a connection to the calling thread until release_current() (or the end of a session()),
+    so every statement a thread runs shares one transaction. A connection is pinged only when it comes back
+    into use after more than idle_check_seconds; otherwise a dead link shows up as an error on the next
+    statement, and run() throws that connection away and retries on a fresh one.
+    """
+
+    def __init__(self, storage, size=4, idle_check_seconds=60, retry_policy=None, metrics=None):
+        self.storage = storage
+        self.size = size
+        self.idle_check_seconds = idle_check_seconds
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.local = threading.local()
+
+    def _increment(self, name):
+        if self.metrics is not None:
+            self.metrics.increment(name)
+
+    def _open(self):
+        """
+        Open a new connection, retrying transient failures under the retry policy.
+        """
+        for attempt in range(self.retry_policy.max_attempts):
+            try:
+                connection = self.storage.connect()
+                self._increment('db_connections_opened')
+                return PooledConnection(connection, self.storage.cursor(connection))
+            except self.storage.Error as e:
+                if not self.retry_policy.should_retry(e, attempt):
+                    print(f'Failed to connect to {self.storage.name} after {attempt + 1} attempts: {e}')
+                    raise
+                print(f'Connection error. Retrying in {self.retry_policy.backoff_factor ** attempt} seconds... '
+                      f'(attempt {attempt + 1}/{self.retry_policy.max_attempts})')
+                self.retry_policy.wait(attempt)
+
+    def _is_alive(self, pooled):
+        try:
+            pooled.cursor.execute("SELECT 1")
+            pooled.cursor.fetchone()
+            return True
+        except self.storage.Error:
+            return False
+
+    def _check_idle(self, pooled):
+        """
+        Ping a connection that has sat idle long enough for the server or a firewall to have dropped it,
+        replacing it if it's dead.
+        """
+        if time.monotonic() - pooled.last_used > self.idle_check_seconds:
+            self._increment('db_liveness_checks')
+            if not self._is_alive(pooled):
+                print("Idle connection was dropped. Reconnecting...")
+                pooled.close()
+                self._increment('db_reconnects')
+                pooled = self._open()
+        pooled.last_used = time.monotonic()
+        return pooled
+
+    def acquire(self):
+        with self.lock:
+            pooled = self.idle.pop() if self.idle else None
+        if pooled is None:
+            return self._open()
+        return self._check_idle(pooled)
+
+    def release(self, pooled):
+        """
+        Return a connection to the pool, rolling back anything left uncommitted. Connections beyond the
+        pool size, or that fail the rollback, are closed.
+        """
+        try:
+            pooled.connection.rollback()
+        except self.storage.Error:
+            pooled.close()
+            return
+        pooled.last_used = time.monotonic()
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(pooled)
+                return
+        pooled.close()
+
+    def current(self):
+        """
+        The calling thread's (connection, cursor), acquiring one from the pool on first use.
+        """
+        pooled = getattr(self.local, 'pooled', None)
+        if pooled is None:
+            pooled = self.acquire()
+        else:
+            pooled = self._check_idle(pooled)
+        self.local.pooled = pooled
+        return pooled.connection, pooled.cursor
+
+    def release_current(self):
+        pooled = getattr(self.local, 'pooled', None)
+        if pooled is not None:
+            self.local.pooled = None
+            self.release(pooled)
+
+    def invalidate_current(self):
+        """
+        Throw away the calling thread's connection after an error; its next current() opens a fresh one.
+        """
+        pooled = getattr(self.local, 'pooled', None)
+        if pooled is not None:
+            self.local.pooled = None
+            pooled.close()
+            self._increment('db_reconnects')
+
+    @contextmanager
+    def session(self):
+        """
+        Bind a connection to the calling thread for the block, e.g. for one task on a worker thread.
+        """
+        try:
+            yield self.current()
+        finally:
+            self.release_current()
+
+    def run(self, operation, description='query'):
+        """
+        Call operation(connection, cursor) on the calling thread's connection. On a transient error the
+        transaction is rolled back, the connection replaced, and the whole operation retried, so it
+        should do its own commit.
+        """
+        for attempt in range(self.retry_policy.max_attempts):
+            connection, cursor = self.current()
+            try:
+                return operation(connection, cursor)
+            except self.storage.Error as e:
+                try:
+                    connection.rollback()
+                except Exception:
+                    pass
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                self.invalidate_current()
+                self._increment('db_retries')
+                print(f"Connection error during {description}. Retrying in {self.retry_policy.backoff_factor ** attempt} seconds... "
+                      f"(attempt {attempt + 1}/{self.retry_policy.max_attempts})")
+                self.retry_policy.wait(attempt)
+
+    def execute(self, query, params=None):
+        """
+        Execute one statement with retries and return the cursor for fetching.
+        """
+        def execute(connection, cursor):
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+            return cursor
+        return self.run(execute)
+
+    def commit(self):
+        """
+        Commit the calling thread's transaction. If the link dropped the transaction is gone, so the
+        connection is replaced and the error raised for the caller to redo its work (run() does this).
+        """
+        connection, _ = self.current()
+        try:
+            connection.commit()
+        except self.storage.Error as e:
+            if self.retry_policy.is_transient(e):
+                self.invalidate_current()
+            raise
+
+    def close_all(self):
+        """
+        Roll back and close the calling thread's connection and every idle one.
+        """
+        self.release_current()
+        with self.lock:
+            idle, self.idle = list(self.idle), deque()
+        for pooled in idle:
+            pooled.close()
@@ -0,0 +1,259 @@
+# data_access.py
+# Every dashboard read goes through here. Queries are fixed SQL text with bound parameters (never values
+# formatted into the string), and results are served from the shared query cache between data refreshes.
+# On SQL Server the connection is mssql+pyodbc, whose ODBC driver sends the parameters separately
+# (sp_executesql), so each statement is compiled once and its plan reused for every building; a driver that
+# inlines parameters client-side, like pymssql, would send new literal text each time. The text is written
+# once with {placeholders} for the few dialect-specific pieces, filled in for SQL Server or SQLite from
+# storage.DASHBOARD_SQL.
+import json
+from functools import lru_cache
+
+import pandas as pd
+import streamlit as st
+
+from meter_types import METER_TYPES
+from query_cache import cached_query
+from storage import dashboard_sql
+
+
+def _conn():
+    # st.connection is itself cached, so every page shares one engine and connection pool
+    return st.connection("sql", type="sql")
+
+
+@lru_cache(maxsize=None)
+def _format_sql(template, dialect_name):
+    return template.format(**dashboard_sql(dialect_name))
+
+
+def _query(template, params=None):
+    conn = _conn()
+    return cached_query(conn, _format_sql(template, conn.engine.dialect.name), params)
+
+
+def _espmid_list_param(espmids):
+    # A whole ID set travels as one JSON parameter and is expanded server-side (OPENJSON / json_each), so the SQL
+    # text (and its plan) is the same however many buildings are passed
+    return json.dumps([int(espmid) for espmid in espmids])
+
+
+def _meter_union(select_columns, where_clause):
+    return " UNION ALL ".join(
+        f"""
+            SELECT '{meter_type['energy_type']}' as energy_type, {select_columns}
+            FROM {{schema}}[{meter_type['table']}]
+            WHERE {where_clause}
+        """
+        for meter_type in METER_TYPES.values()
+    )
+
+
+def _normalized_building_years(where_clause):
+    # Actual and weather-normalized site kBTU per building and year; only building-years whose every fuel was normalized count
+    return f"""
+        SELECT r.[espmid], r.[year], SUM(r.[kbtu]) as kbtu, SUM(w.[normalized_kbtu]) as normalized_kbtu
+        FROM {{schema}}[energy_rollup] r
+        LEFT JOIN {{schema}}[weather_normalized] w
+            ON w.[espmid] = r.[espmid] AND w.[year] = r.[year] AND w.[fuel] = r.[fuel]
+        WHERE {where_clause}
+        GROUP BY r.[espmid], r.[year]
+        HAVING COUNT(w.[fuel]) = COUNT(*)
+    """
+
+
+BUILDINGS_QUERY = """
+    SELECT {top_1000} [espmid], [buildingname], [sqfootage], [usetype], [occupancy], [numbuildings]
+    FROM {schema}[ESPMFIRSTTEST]
+    {limit_1000}
+"""
+
+BUILDING_LIST_QUERY = """
+    SELECT DISTINCT
+        [espmid],
+        [buildingname],
+        [usetype],
+        [sqfootage],
+        [address]
+    FROM {schema}[ESPMFIRSTTEST]
+    WHERE [buildingname] IS NOT NULL
+    AND [espmid] IS NOT NULL
+    ORDER BY [buildingname]
+"""
+
+USETYPE_TOTALS_QUERY = """
+    SELECT
+        [usetype],
+        COALESCE(SUM([sqfootage]), 0) as total_sqft,
+        COUNT(*) as building_count
+    FROM {schema}[ESPMFIRSTTEST]
+    GROUP BY [usetype]
+    ORDER BY total_sqft DESC
+"""
+
+# Site kBTU of every building with all 12 months of meter data that year, over the square footage of those same
+# buildings. A year still being billed (or a building's year with a gap) would divide part of a year's energy by
+# a full year's floor area, so it is left out rather than reported as a drop in EUI.
+PORTFOLIO_EUI_QUERY = """
+    SELECT
+        m.[year],
+        SUM(m.[site_kbtu]) as total_kbtu,
+        SUM(m.[sqfootage]) as total_sqft,
+        COUNT(*) as building_count
+    FROM {schema}[building_metrics] m
+    WHERE m.[sqfootage] > 0 AND m.[months_covered] = 12
+    GROUP BY m.[year]
+    ORDER BY m.[year]
+"""
+
+PORTFOLIO_NORMALIZED_EUI_QUERY = f"""
+    SELECT
+        n.[year],
+        SUM(n.[kbtu]) as total_kbtu,
+        SUM(n.[normalized_kbtu]) as total_normalized_kbtu,
+        SUM(b.[sqfootage]) as total_sqft,
+        COUNT(*) as building_count
+    FROM ({_normalized_building_years("1 = 1")}) n
+    JOIN {{schema}}[ESPMFIRSTTEST] b ON b.[espmid] = n.[espmid]
+    WHERE b.[sqfootage] > 0
+    GROUP BY n.[year]
+    ORDER BY n.[year]
+"""
+
+# District emissions per year and fuel, over the same complete building-years as PORTFOLIO_EUI_QUERY (so its
+# total_sqft is the denominator). A fuel without an emission factor comes back with NULL kg_co2e.
+PORTFOLIO_EMISSIONS_QUERY = """
+    SELECT
+        m.[year],
+        r.[fuel],
+        SUM(e.[kg_co2e]) as kg_co2e,
+        COUNT(e.[fuel]) as buildings_with_factor
+    FROM {schema}[building_metrics] m
+    JOIN {schema}[energy_rollup] r ON r.[espmid] = m.[espmid] AND r.[year] = m.[year]
+    LEFT JOIN {schema}[emissions] e
+        ON e.[espmid] = r.[espmid] AND e.[year] = r.[year] AND e.[fuel] = r.[fuel]
+    WHERE m.[sqfootage] > 0 AND m.[months_covered] = 12
+    GROUP BY m.[year], r.[fuel]
+    ORDER BY m.[year], r.[fuel]
+"""
+
+BUILDING_NORMALIZED_QUERY = _normalized_building_years("r.[espmid] = :espmid") + " ORDER BY r.[year]"
+
+BUILDING_METER_QUERY = _meter_union(
+    "[entryid], [meterid], [usage], [startdate], [enddate]",
+    "[espmid] = :espmid"
+) + " ORDER BY [startdate]"
+
+BUILDING_ROLLUP_QUERY = """
+    SELECT [year], [fuel], [usage], [kbtu]
+    FROM {schema}[energy_rollup]
+    WHERE [espmid] = :espmid
+"""
+
+# The whole comparison matrix (~870 buildings x a few years) in one read; comparing and ranking happen in memory
+BUILDING_METRICS_QUERY = """
+    SELECT m.*, b.[buildingname], b.[usetype]
+    FROM {schema}[building_metrics] m
+    JOIN {schema}[ESPMFIRSTTEST] b ON b.[espmid] = m.[espmid]
+    ORDER BY m.[year], m.[espmid]
+"""
+
+BUILDING_MONTHLY_QUERY = """
+    SELECT [year], [month], [fuel], [usage], [kbtu]
+    FROM {schema}[energy_monthly]
+    WHERE [espmid] = :espmid
+    ORDER BY [year], [month]
+"""
+
+# One building's place among its peers, read by primary key from tables the ingest precomputes
+BUILDING_PEERS_QUERY = """
+    SELECT p.[year], p.[peer_type], p.[peer_group], p.[eui], p.[percentile], p.[peer_count],
+           b.[eui_p25], b.[eui_median], b.[eui_p75]
+    FROM {schema}[peer_percentiles] p
+    JOIN {schema}[peer_benchmarks] b
+        ON b.[peer_type] = p.[peer_type] AND b.[peer_group] = p.[peer_group] AND b.[year] = p.[year]
+    WHERE p.[espmid] = :espmid
+    ORDER BY p.[year], p.[peer_type] DESC
+"""
+
+METER_PERIODS_QUERY = _meter_union(
+    "[espmid], [meterid], [startdate], [enddate]",
+    "[espmid] IN (SELECT CAST([value] AS INT) FROM {json_values}(:espmids))"
+)
+
+
+def get_buildings():
+    """Portfolio listing for Account Details."""
+    return _query(BUILDINGS_QUERY)
+
+
+def get_building_list():
+    """Named buildings for the Building Data dropdown, sorted by name."""
+    return _query(BUILDING_LIST_QUERY)
+
+
+def get_usetype_totals():
+    """Square footage and building count per use type."""
+    return _query(USETYPE_TOTALS_QUERY)
+
+
+def get_portfolio_eui_by_year():
+    """District-wide site kBTU, square footage and building count per complete year, from building_metrics."""
+    return _query(PORTFOLIO_EUI_QUERY)
+
+
+def get_portfolio_normalized_eui_by_year():
+    """District actual and weather-normalized site kBTU and square footage per year, over fully normalized buildings."""
+    return _query(PORTFOLIO_NORMALIZED_EUI_QUERY)
+
+
+def get_portfolio_emissions_by_year():
+    """District emissions (kg CO2e, solar negative) per complete year and fuel; NULL for fuels without a factor."""
+    return _query(PORTFOLIO_EMISSIONS_QUERY)
+
+
+def get_building_normalized(espmid):
+    """Actual and weather-normalized site kBTU per year for one building, for years every fuel was normalized."""
+    return _query(BUILDING_NORMALIZED_QUERY, {"espmid": int(espmid)})
+
+
+def get_building_meter_data(espmid):
+    """
+    Every meter period for one building across all fuels, tagged by energy_type. Periods are as billed;
+    per-year and per-month totals come from the calendarized get_building_rollup / get_building_monthly.
+    """
+    df = _query(BUILDING_METER_QUERY, {"espmid": int(espmid)})
+    df['startdate'] = pd.to_datetime(df['startdate'])
+    df['enddate'] = pd.to_datetime(df['enddate'])
+    return df
+
+
+def get_building_rollup(espmid):
+    """Annual (calendarized) usage and signed kBTU per fuel for one building."""
+    return _query(BUILDING_ROLLUP_QUERY, {"espmid": int(espmid)})
+
+
+def get_building_metrics():
+    """Every building-year of building_metrics, with building name and use type."""
+    return _query(BUILDING_METRICS_QUERY)
+
+
+def get_building_monthly(espmid):
+    """
+    Calendarized monthly usage and signed kBTU per fuel for one building, with a 'month_start' date column.
+    """
+    df = _query(BUILDING_MONTHLY_QUERY, {"espmid": int(espmid)})
+    df['month_start'] = pd.to_datetime(dict(year=df['year'], month=df['month'], day=1))
+    return df
+
+
+def get_building_peers(espmid):
+    """
+    One building's EUI percentile and its peer groups' quartiles per year, for its use type and its category.
+    """
+    return _query(BUILDING_PEERS_QUERY, {"espmid": int(espmid)})
+
+
+def get_meter_periods(espmids):
+    """Start/end dates of every meter period for the given buildings, across all fuels."""
+    return _query(METER_PERIODS_QUERY, {"espmids": _espmid_list_param(espmids)})
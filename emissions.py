@@ -0,0 +1,74 @@
+# emissions.py
+# Year-specific emission factors (data/emission_factors.csv) resolved for every meter type and year, ready to
+# be applied to energy_rollup in one set-based statement by full_update.py.
+import pandas as pd
+
+from meter_types import METER_TYPES
+
+
+def load_emission_factors(path):
+    """
+    Emission factors from a CSV of year, fuel, unit, kg_co2e_per_unit, source.
+
+    Returns:
+        DataFrame of those columns (empty if the file has no rows or doesn't exist)
+    """
+    columns = ['year', 'fuel', 'unit', 'kg_co2e_per_unit', 'source']
+    try:
+        factors = pd.read_csv(path)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=columns)
+    factors = factors.dropna(subset=['year', 'fuel', 'kg_co2e_per_unit'])
+    return factors.astype({'year': int, 'kg_co2e_per_unit': float})[columns]
+
+
+def factors_by_year(factors, years):
+    """
+    The factor each meter type uses in each year: the latest row for its emission_factor fuel at or before
+    the year, or the fuel's earliest row for years before that. Generation (sign -1) gets a negative factor,
+    so its emissions net off. A row whose unit doesn't match the meter type's is ignored.
+
+    Returns:
+        DataFrame of year, fuel (energy_type), kg_co2e_per_unit and factor_year (the year of the row used)
+        for every year and meter type with a factor
+    """
+    resolved = []
+    for meter_type in METER_TYPES.values():
+        fuel_factors = factors[
+            (factors['fuel'] == meter_type['emission_factor']) & (factors['unit'] == meter_type['unit'])
+        ].sort_values('year')
+        if fuel_factors.empty or not len(years):
+            continue
+        wanted = pd.DataFrame({'year': sorted(set(int(year) for year in years))})
+        fuel_factors = fuel_factors[['year', 'kg_co2e_per_unit']].assign(factor_year=fuel_factors['year'])
+        matched = pd.merge_asof(wanted, fuel_factors, on='year', direction='backward')
+        matched['kg_co2e_per_unit'] = matched['kg_co2e_per_unit'].fillna(fuel_factors['kg_co2e_per_unit'].iloc[0])
+        matched['factor_year'] = matched['factor_year'].fillna(fuel_factors['factor_year'].iloc[0]).astype(int)
+        matched['kg_co2e_per_unit'] *= meter_type['sign']
+        matched['fuel'] = meter_type['energy_type']
+        resolved.append(matched)
+    columns = ['year', 'fuel', 'kg_co2e_per_unit', 'factor_year']
+    if not resolved:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(resolved, ignore_index=True)[columns]
+
+
+def describe_factors(year_factors):
+    """
+    What factors_by_year() had to do for each meter type, for the ingest log.
+
+    Returns:
+        (fuels with no factor at all, as 'fuel (unit)' strings,
+         list of (fuel, factor_year, first year, last year) for years that borrowed another year's factor)
+    """
+    missing = [
+        f"{meter_type['energy_type']} ({meter_type['unit']})"
+        for meter_type in METER_TYPES.values()
+        if meter_type['energy_type'] not in set(year_factors['fuel'])
+    ]
+    borrowed = year_factors[year_factors['year'] != year_factors['factor_year']]
+    fallbacks = [
+        (fuel, int(factor_year), int(group['year'].min()), int(group['year'].max()))
+        for (fuel, factor_year), group in borrowed.groupby(['fuel', 'factor_year'])
+    ]
+    return missing, fallbacks
@@ -1,1477 +1,1931 @@
-import pyodbc
 import random
 import datetime
 import pandas as pd
 import requests
-import sqlite3
+import hashlib
+import json
 from requests.auth import HTTPBasicAuth 
 import xml.etree.ElementTree as et
 import xmltodict
 from requests.adapters import HTTPAdapter
 import os
 import time
+import math
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib3.util.retry import Retry
+from meter_types import METER_TYPES, METER_TABLES, FUEL_KBTU_COLUMNS
+from reference_data import BASELINE_EUI
+from storage import get_storage
+from calendarize import calendarize
+from weather_normalization import load_degree_days, normalize
+from emissions import describe_factors, factors_by_year, load_emission_factors
+from peer_benchmarks import PEER_QUANTILES, compute_peer_benchmarks
+from connection_pool import ConnectionPool, RetryPolicy
+from ingest_metrics import IngestMetrics, endpoint_name
 
-user = ENERGY_STAR_PORTFOLIO_MANAGER_USERNAME
-pw = ENERGY_STAR_PORTFOLIO_MANAGER_PASSWORD
-retry_strategy = Retry(
+user = os.environ.get('ENERGY_STAR_PORTFOLIO_MANAGER_USERNAME')
+pw = os.environ.get('ENERGY_STAR_PORTFOLIO_MANAGER_PASSWORD')
+server='aa2030dashboardfree.database.windows.net'
+database='dashboarddb'
+username=os.environ.get('DATABASEUSER')
+password=os.environ.get('DATABASEPW')
+driver= '{ODBC Driver 18 for SQL Server}'
+# DATABASE_CONNECTION_STRING points the ingest at another SQL Server, e.g. a local one for benchmarking
+connection_string = os.environ.get('DATABASE_CONNECTION_STRING') or f'Driver={driver};Server=tcp:aa2030dashboardfree.database.windows.net,1433;Database=dashboarddb;Uid=CloudSA3d4fc968;Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;'
+# SQL Server by default; STORAGE_BACKEND=sqlite writes the same tables to a local file instead
+storage = get_storage(connection_string)
+# Run report locations: the JSON report is always written, Prometheus text only when a path is set
+INGEST_REPORT_PATH = os.environ.get('INGEST_REPORT_PATH', 'ingest_report.json')
+INGEST_PROMETHEUS_PATH = os.environ.get('INGEST_PROMETHEUS_PATH')
+metrics = IngestMetrics()
+
+# Connections idle longer than this are pinged before reuse; otherwise a dead one is only noticed when a statement fails
+DB_IDLE_CHECK_SECONDS = float(os.environ.get('DB_IDLE_CHECK_SECONDS', '60'))
+# Idle connections kept open, and the most meter tables merged at once on backends that allow concurrent writers
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+# Shared by connecting, statements and meter merges: 3 attempts, waiting 1s then 2s
+db_retry_policy = RetryPolicy(max_attempts=3, backoff_factor=2)
+db = ConnectionPool(storage, size=DB_POOL_SIZE, idle_check_seconds=DB_IDLE_CHECK_SECONDS,
+                    retry_policy=db_retry_policy, metrics=metrics)
+
+
+# Portfolio Manager fetch settings. Property and meter calls run on a small thread pool so the weekly
+# refresh isn't thousands of strictly serial round-trips.
+# ESPM_BASE_URL can point at bench/fake_espm.py to run the ingest offline
+ESPM_BASE_URL = os.environ.get('ESPM_BASE_URL', 'https://portfoliomanager.energystar.gov/ws')
+ESPM_ACCOUNT_ID = os.environ.get('ESPM_ACCOUNT_ID', '216165')
+# Maximum number of Portfolio Manager requests in flight at once
+MAX_WORKERS = int(os.environ.get('ESPM_MAX_WORKERS', '8'))
+# Cap on requests started per second across all workers, to stay under Portfolio Manager's throttling
+MAX_REQUESTS_PER_SECOND = float(os.environ.get('ESPM_MAX_REQUESTS_PER_SECOND', '10'))
+
+
+class RateLimiter:
+    """
+    Spaces out request start times so no more than `rate` requests begin per second across all threads.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# Consumption is pulled from this date on a full sync, and for meters with nothing stored yet
+CONSUMPTION_START_DATE = datetime.date(2020, 1, 1)
+# Days before a meter's latest stored period to request again, so revised bills are picked up
+SYNC_LOOKBACK_DAYS = int(os.environ.get('ESPM_SYNC_LOOKBACK_DAYS', '90'))
+# Set ESPM_FULL_SYNC=1 to ignore the stored watermarks and re-pull everything since CONSUMPTION_START_DATE
+FULL_SYNC = os.environ.get('ESPM_FULL_SYNC') == '1'
+# Consumption rows are buffered and flushed to the meter tables once this many are pending
+FLUSH_ROWS = int(os.environ.get('ESPM_FLUSH_ROWS', '20000'))
+# Monthly heating/cooling degree days for weather normalization (see data/README.md)
+DEGREE_DAYS_PATH = os.environ.get('DEGREE_DAYS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'degree_days.csv'))
+# Year-specific grid and natural gas emission factors (see data/README.md)
+EMISSION_FACTORS_PATH = os.environ.get('EMISSION_FACTORS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'emission_factors.csv'))
+# Buildings whose meter periods are calendarized and rolled up together (bounds memory on a full backfill)
+ROLLUP_CHUNK = int(os.environ.get('ESPM_ROLLUP_CHUNK', '500'))
+# A run that died part way is picked up where it stopped; set ESPM_RESUME=0 to abandon it and start over
+RESUME = os.environ.get('ESPM_RESUME', '1') != '0'
+# Only a run started this recently is resumed; an older one is abandoned so the next scheduled run starts fresh
+# rather than skipping everything a long-dead run had already checkpointed
+RESUME_MAX_AGE_HOURS = float(os.environ.get('ESPM_RESUME_MAX_AGE_HOURS', '24'))
+# Id of this run in ingest_run, set by start_ingest_run()
+ingest_run_id = None
+NAN = float('nan')
+# Numeric columns that older databases still hold as NVARCHAR(100), and the type they are migrated to
+NUMERIC_COLUMNS = {
+    'ESPMFIRSTTEST': {'sqfootage': 'DECIMAL(18,2)', 'occupancy': 'INT', 'numbuildings': 'INT'},
+    **{table_name: {'cost': 'DECIMAL(18,2)', 'usage': 'FLOAT'} for table_name in METER_TABLES},
+}
+# Column definitions shared by every meter table, its staging table and its bulk-load table type
+METER_TABLE_COLUMNS = """
+    entryid NVARCHAR(100) PRIMARY KEY,
+    espmid INT,
+    meterid NVARCHAR(100),
+    cost DECIMAL(18,2),
+    usage FLOAT,
+    startdate SMALLDATETIME,
+    enddate SMALLDATETIME
+"""
+METER_VALUE_COLUMNS = ('espmid', 'meterid', 'cost', 'usage', 'startdate', 'enddate')
+# How consumption flushes reach SQL Server: 'tvp' streams each flush as one table-valued parameter into a
+# per-table merge procedure; 'executemany' fills a temp table in 1000-row batches and MERGEs from it.
+# Tables whose procedure can't be created fall back to executemany, and SQLite always stages.
+BULK_MODE = os.environ.get('ESPM_BULK_MODE', 'tvp').lower()
+# Meter tables loaded through their merge procedure, filled in by ensure_bulk_merge()
+bulk_merge_tables = set()
+# Nonclustered indexes kept on every meter table: name suffix -> (key columns, included columns)
+METER_INDEXES = {
+    # Per-building reads on the Building Data page and the gap scans on Account Details
+    'espmid_startdate': ('espmid, startdate', 'usage, enddate, meterid'),
+    # MAX(enddate) per meter for the sync watermarks
+    'meterid_enddate': ('meterid, enddate', None),
+}
+# meterid -> latest enddate already stored for that meter, filled in by load_sync_watermarks()
+sync_watermarks = {}
+
+class CountingRetry(Retry):
+    """
+    urllib3 Retry that counts every retry it makes in the run metrics.
+    """
+
+    def increment(self, *args, **kwargs):
+        metrics.increment('http_retries')
+        return super().increment(*args, **kwargs)
+
+
+rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+retry_strategy = CountingRetry(
     total=3,  # Try 3 times
     backoff_factor=1,
-    status_forcelist=[500, 502, 503, 504]
+    status_forcelist=[429, 500, 502, 503, 504]  # 429 = throttled, honors Retry-After
 )
 session = requests.Session()
-adapter = HTTPAdapter(max_retries=retry_strategy)
+# Size the connection pool to the worker count so threads don't queue for sockets
+adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
 session.mount("https://", adapter)
-server='aa2030dashboardfree.database.windows.net'
-database='dashboarddb'
-username=DATABASEUSER
-password=DATABASEPW
-driver= '{ODBC Driver 18 for SQL Server}'
-connection = None
-cursor = None
+session.mount("http://", adapter)
+
 
-def connect_with_retry(max_retries=4, backoff_factor=2, timeout=30):
+def espm_get(path, timeout=60, stream=False, headers=None):
     """
-    Attempt to connect to SQL Server with retry logic for timeouts.
-    
-    Args:
-        max_retries: Maximum number of connection attempts
-        backoff_factor: Multiplier for wait time between retries
-        timeout: Connection timeout in seconds
-    
-    Returns:    
-        pyodbc.Connection object if successful
+    GET a Portfolio Manager web service path through the shared (retrying) session, honoring the rate limit.
+    With stream=True the body is left unread so it can be parsed incrementally from response.raw; its bytes
+    are counted by whoever reads it (see HashingReader).
     """
-    connection_string = f'Driver={driver};Server=tcp:aa2030dashboardfree.database.windows.net,1433;Database=dashboarddb;Uid=CloudSA3d4fc968;Pwd={password};Encrypt=yes;TrustServerCertificate=no;Connection Timeout=30;'
-    
-    for attempt in range(max_retries):
+    rate_limiter.wait()
+    started = time.perf_counter()
+    response = session.get(f'{ESPM_BASE_URL}{path}', auth=HTTPBasicAuth(user, pw), timeout=timeout, stream=stream, headers=headers)
+    metrics.observe_request(path, time.perf_counter() - started, response.status_code, 0 if stream else len(response.content))
+    return response
+
+
+class HashingReader:
+    """
+    Read-only file-like view of a streamed response body that hashes (and counts) the bytes as they are read,
+    so a document can be parsed incrementally and content-hashed in the same pass.
+    """
+
+    def __init__(self, path, response):
+        response.raw.decode_content = True
+        self.path = path
+        self.raw = response.raw
+        self.sha256 = hashlib.sha256()
+        self.nbytes = 0
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.sha256.update(chunk)
+        self.nbytes += len(chunk)
+        return chunk
+
+    def finish(self):
+        """Read whatever the parser left (e.g. trailing whitespace), record the body size and return the hash."""
+        while self.read(64 * 1024):
+            pass
+        metrics.increment('http_bytes', self.nbytes, endpoint=endpoint_name(self.path))
+        return self.sha256.hexdigest()
+
+
+class SyncState:
+    """
+    What each Portfolio Manager document looked like on the last run: its content hash, any ETag /
+    Last-Modified the server sent, and a little parsed info (a meter's type, a property's meter list) so an
+    unchanged document can be used without parsing it again. Documents that come back unchanged are skipped
+    before they're parsed, so nothing downstream of them is written.
+
+    New states are handed back to the caller and only saved with save_sync_state() once the data they
+    describe has been committed; a failed run re-fetches anything it didn't finish.
+    """
+
+    KINDS = ('property', 'meter_association', 'meter', 'consumption')
+
+    def __init__(self, saved=None):
+        # resource -> (etag, last_modified, content_hash, info)
+        self.saved = saved or {}
+        self.lock = threading.Lock()
+        self.counts = {kind: {'fetched': 0, 'unchanged': 0, 'changed': 0} for kind in self.KINDS}
+
+    @staticmethod
+    def resource_key(path):
+        # The consumption startDate moves with the watermark, so it isn't part of the key
+        return path.split('?', 1)[0].lstrip('/')
+
+    def info(self, resource):
+        saved = self.saved.get(resource)
+        return json.loads(saved[3]) if saved and saved[3] else None
+
+    def fetch(self, kind, path, parse=None):
+        """
+        GET a document, conditionally when the server gave us validators last time.
+
+        With parse, the body is never held whole: it is streamed through parse(body), which reads it
+        incrementally from a HashingReader, and parse's result is returned in place of the response. The hash
+        is only known once the body has been read, so a document that turns out unchanged has still been
+        parsed, but its result is dropped (None).
+
+        Returns:
+            (response, or parse's result with parse, new_state) where new_state is None if the document is
+            unchanged, otherwise a (resource, etag, last_modified, content_hash) tuple; the caller appends the
+            info to keep and saves it once the document's data is committed
+        """
+        resource = self.resource_key(path)
+        saved = None if FULL_SYNC else self.saved.get(resource)
+        headers = {}
+        if saved and saved[0]:
+            headers['If-None-Match'] = saved[0]
+        if saved and saved[1]:
+            headers['If-Modified-Since'] = saved[1]
+        response = espm_get(path, stream=parse is not None, headers=headers or None)
+        with self.lock:
+            self.counts[kind]['fetched'] += 1
+        result = response
         try:
-            print(f'Attempting to connect to SQL Server (attempt {attempt + 1}/{max_retries})...')
-            connection = pyodbc.connect(connection_string)
-            print('Connection Successful')
-            return connection
-        except pyodbc.OperationalError as e:
-            error_str = str(e).lower()
-            # Check if it's a timeout or connection error
-            if 'timeout' in error_str or 'timed out' in error_str or 'connection' in error_str:
-                if attempt < max_retries - 1:
-                    wait_time = backoff_factor ** attempt
-                    print(f'Connection timeout. Retrying in {wait_time} seconds...')
-                    time.sleep(wait_time)
-                else:
-                    print(f'Failed to connect after {max_retries} attempts.')
-                    raise
+            if response.status_code == 304:
+                unchanged, new_state = True, None
             else:
-                # Not a timeout error, re-raise immediately
-                raise
-        except pyodbc.Error as e:
-            # For other pyodbc errors, check if it's connection-related
-            error_str = str(e).lower()
-            if 'timeout' in error_str or 'timed out' in error_str or 'connection' in error_str:
-                if attempt < max_retries - 1:
-                    wait_time = backoff_factor ** attempt
-                    print(f'Connection error. Retrying in {wait_time} seconds...')
-                    time.sleep(wait_time)
+                response.raise_for_status()
+                if parse is None:
+                    content_hash = hashlib.sha256(response.content).hexdigest()
                 else:
-                    print(f'Failed to connect after {max_retries} attempts.')
-                    raise
-            else:
-                # Not a connection-related error, re-raise immediately
-                raise
-    
-    # Should not reach here, but just in case
-    raise pyodbc.OperationalError("Failed to establish connection after all retries")
+                    body = HashingReader(path, response)
+                    result = parse(body)
+                    content_hash = body.finish()
+                unchanged = saved is not None and saved[2] == content_hash
+                new_state = None if unchanged else (
+                    resource, response.headers.get('ETag'), response.headers.get('Last-Modified'), content_hash
+                )
+        finally:
+            if parse is not None:
+                response.close()
+        if unchanged and parse is not None:
+            result = None
+        with self.lock:
+            self.counts[kind]['unchanged' if unchanged else 'changed'] += 1
+        metrics.increment('documents', kind=kind, outcome='unchanged' if unchanged else 'changed')
+        return result, new_state
+
+    def report(self):
+        for kind, counts in self.counts.items():
+            print(f"Sync state {kind}: {counts['fetched']} fetched, {counts['unchanged']} unchanged (skipped), {counts['changed']} changed.")
+
+
+sync_state = SyncState()
+
 
-def check_and_reconnect():
+def iter_concurrently(func, items, max_workers=None):
     """
-    Check if connection is alive, reconnect if needed.
-    Returns: (connection, cursor) tuple
+    Run func over items on a bounded thread pool and yield the results in the same order as items,
+    so downstream output is identical to a serial loop. At most 2 * max_workers calls are queued at once.
     """
-    global connection, cursor
+    max_workers = max_workers or MAX_WORKERS
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_sync_watermarks():
+    """
+    Read the latest stored enddate for every meter in the meter tables.
+    Tables that don't exist yet are skipped, so a first run falls back to a full sync.
+
+    Returns:
+        dict of meterid (str) -> latest enddate (datetime)
+    """
+    watermarks = {}
+    if FULL_SYNC:
+        print("ESPM_FULL_SYNC is set, pulling all consumption since " + CONSUMPTION_START_DATE.isoformat())
+        return watermarks
+    for table_name in METER_TABLES:
+        try:
+            rows = db.execute(f"SELECT meterid, MAX(enddate) FROM {table_name} GROUP BY meterid").fetchall()
+        except storage.Error as e:
+            print(f"Could not read sync watermarks from {table_name}, doing a full pull for its meters: {e}")
+            continue
+        for meterid, latest_enddate in rows:
+            if meterid and latest_enddate:
+                watermarks[str(meterid)] = storage.parse_datetime(latest_enddate)
+    print(f"Loaded sync watermarks for {len(watermarks)} meters (look-back {SYNC_LOOKBACK_DAYS} days).")
+    return watermarks
+
+
+def ensure_sync_state_table():
+    connection, cursor = db.current()
+    storage.create_table_if_missing(cursor, 'sync_state', """
+        resource NVARCHAR(200) PRIMARY KEY,
+        etag NVARCHAR(200),
+        last_modified NVARCHAR(100),
+        content_hash CHAR(64),
+        info NVARCHAR(4000)
+    """)
+    db.commit()
+
+
+def load_sync_state():
+    """
+    Read the saved document states from sync_state.
+
+    Returns:
+        dict of resource -> (etag, last_modified, content_hash, info)
+    """
+    if FULL_SYNC:
+        return {}
+    rows = db.execute("SELECT resource, etag, last_modified, content_hash, info FROM sync_state").fetchall()
+    print(f"Loaded sync state for {len(rows)} Portfolio Manager documents.")
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def save_sync_state(states):
+    """
+    Upsert (resource, etag, last_modified, content_hash, info) rows into sync_state. Called only after the
+    data from those documents has been committed. A failure here just means they're fetched again next run.
+    """
+    if not states:
+        return
+    connection, cursor = db.current()
+    temp_table = storage.staging_table('TempSyncState')
     try:
-        # Try a simple query to check if connection is alive
-        cursor.execute("SELECT 1")
-        cursor.fetchone()
-        return connection, cursor
-    except (pyodbc.Error, AttributeError):
-        # Connection is dead or doesn't exist, reconnect
-        print("Connection lost. Reconnecting...")
+        storage.create_staging_table(cursor, temp_table, """
+            resource NVARCHAR(200) PRIMARY KEY,
+            etag NVARCHAR(200),
+            last_modified NVARCHAR(100),
+            content_hash CHAR(64),
+            info NVARCHAR(4000)
+        """)
+        # Last state wins if a document was seen twice (e.g. a meter shared by two properties)
+        rows = list({state[0]: state for state in states}.values())
+        cursor.executemany(f"INSERT INTO {temp_table} (resource, etag, last_modified, content_hash, info) VALUES (?, ?, ?, ?, ?)", rows)
+        cursor.execute(storage.upsert_sql('sync_state', temp_table, ('resource',), ('etag', 'last_modified', 'content_hash', 'info')))
+        db.commit()
+        cursor.execute(f"DROP TABLE {temp_table}")
+    except storage.Error as e:
         try:
-            if connection:
-                try:
-                    connection.close()
-                except:
-                    pass
-            if cursor:
-                try:
-                    cursor.close()
-                except:
-                    pass
+            cursor.execute(f"DROP TABLE {temp_table}")
         except:
             pass
-        
-        connection = connect_with_retry(max_retries=3, backoff_factor=2, timeout=30)
-        cursor = connection.cursor()
-        cursor.fast_executemany = True
-        print("Reconnection successful.")
-        return connection, cursor
+        try:
+            connection.rollback()
+        except:
+            pass
+        print(f"Warning: Could not save sync state, those documents will be fetched and parsed again next run: {e}")
+
+
+def ensure_ingest_run_tables():
+    connection, cursor = db.current()
+    storage.create_table_if_missing(cursor, 'ingest_run', """
+        run_id INT PRIMARY KEY,
+        status NVARCHAR(20) NOT NULL,
+        properties_done INT NOT NULL,
+        started_at DATETIME2 NOT NULL,
+        finished_at DATETIME2
+    """)
+    # One row per property whose meter data this run has committed
+    storage.create_table_if_missing(cursor, 'ingest_checkpoint', """
+        run_id INT NOT NULL,
+        espmid INT NOT NULL,
+        completed_at DATETIME2 NOT NULL,
+        PRIMARY KEY (run_id, espmid)
+    """)
+    db.commit()
+
 
-def execute_with_retry(query, params=None, max_retries=3):
+def start_ingest_run():
     """
-    Execute a database query with retry logic for connection failures.
+    Resume the last unfinished run if there is one started within ESPM_RESUME_MAX_AGE_HOURS (and ESPM_RESUME
+    allows it), otherwise abandon any unfinished runs and start a new one.
+
+    Returns:
+        (run_id, set of espmids already checkpointed by the run, whether property details are already done)
     """
-    for attempt in range(max_retries):
-        try:
-            connection, cursor = check_and_reconnect()
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            return cursor
-        except pyodbc.Error as e:
-            error_str = str(e).lower()
-            if ('communication link failure' in error_str or '08S01' in str(e) or 
-                'connection' in error_str or 'timeout' in error_str):
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    print(f"Connection error during query. Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-                    # Force reconnection
-                    connection, cursor = check_and_reconnect()
-                else:
-                    print(f"Failed to execute query after {max_retries} attempts: {e}")
-                    raise
-            else:
-                # Not a connection error, re-raise immediately
-                raise
+    connection, cursor = db.current()
+    resume_cutoff = datetime.datetime.now() - datetime.timedelta(hours=RESUME_MAX_AGE_HOURS)
+    cursor.execute(
+        "SELECT run_id, properties_done FROM ingest_run WHERE status = 'running' AND started_at >= ? ORDER BY run_id DESC",
+        (resume_cutoff,)
+    )
+    unfinished = cursor.fetchone()
+    if unfinished and RESUME:
+        run_id, properties_done = unfinished
+        cursor.execute("SELECT espmid FROM ingest_checkpoint WHERE run_id = ?", (run_id,))
+        completed = {row[0] for row in cursor.fetchall()}
+        print(f"Resuming ingest run {run_id}: {len(completed)} properties already done.")
+        return run_id, completed, bool(properties_done)
+    cursor.execute("UPDATE ingest_run SET status = 'abandoned' WHERE status = 'running'")
+    if cursor.rowcount > 0:
+        reason = "ESPM_RESUME=0" if not RESUME else f"started over {RESUME_MAX_AGE_HOURS:g} hours ago"
+        print(f"Abandoning {cursor.rowcount} unfinished ingest run(s) ({reason}).")
+    cursor.execute("SELECT COALESCE(MAX(run_id), 0) + 1 FROM ingest_run")
+    run_id = cursor.fetchone()[0]
+    cursor.execute(
+        "INSERT INTO ingest_run (run_id, status, properties_done, started_at) VALUES (?, 'running', 0, ?)",
+        (run_id, datetime.datetime.now())
+    )
+    db.commit()
+    print(f"Started ingest run {run_id}.")
+    return run_id, set(), False
 
-##Establish Database Columns 
-try:
-    connection = connect_with_retry(max_retries=3, backoff_factor=2, timeout=30)
-    
-    # Create cursor with fast_executemany for better performance
-    cursor = connection.cursor()
-    # Enable fast_executemany for bulk operations (much faster for large datasets)
-    cursor.fast_executemany = True
 
-    # Define the CREATE TABLE SQL query
-    create_table_query = """
-    CREATE TABLE ESPMFIRSTTEST (
-        espmid INT PRIMARY KEY,
-        buildingname NVARCHAR(100),
-        sqfootage NVARCHAR(100),
-        address NVARCHAR(100),
-        occupancy NVARCHAR(100),
-        numbuildings NVARCHAR(100),
-        usetype NVARCHAR(100)
+def mark_properties_done():
+    def mark(connection, cursor):
+        cursor.execute("UPDATE ingest_run SET properties_done = 1 WHERE run_id = ?", (ingest_run_id,))
+        connection.commit()
+
+    db.run(mark, 'ingest run update')
+
+
+def checkpoint_properties(espmids):
+    """
+    Record properties whose meter data is committed, so a restart of this run skips them.
+    """
+    if not espmids:
+        return
+    completed_at = datetime.datetime.now()
+
+    def checkpoint(connection, cursor):
+        cursor.executemany(
+            "INSERT INTO ingest_checkpoint (run_id, espmid, completed_at) VALUES (?, ?, ?)",
+            [(ingest_run_id, int(espmid), completed_at) for espmid in espmids]
+        )
+        connection.commit()
+
+    db.run(checkpoint, 'ingest checkpoint')
+
+
+def finish_ingest_run():
+    """
+    Mark this run complete and drop its checkpoints, which are only needed to resume it.
+    """
+    connection, cursor = db.current()
+    cursor.execute("UPDATE ingest_run SET status = 'complete', finished_at = ? WHERE run_id = ?", (datetime.datetime.now(), ingest_run_id))
+    cursor.execute("DELETE FROM ingest_checkpoint WHERE run_id = ?", (ingest_run_id,))
+    db.commit()
+    print(f"Ingest run {ingest_run_id} complete.")
+
+
+def consumption_start_date(meterid):
+    """
+    First date to request consumption for a meter: the stored watermark minus the look-back window,
+    never earlier than CONSUMPTION_START_DATE.
+    """
+    watermark = sync_watermarks.get(str(meterid))
+    if watermark is None:
+        return CONSUMPTION_START_DATE.isoformat()
+    start = watermark.date() - datetime.timedelta(days=SYNC_LOOKBACK_DAYS)
+    return max(start, CONSUMPTION_START_DATE).isoformat()
+
+
+def fetch_property_details(espmid):
+    """
+    Pull the basic details (name, address, floor area, occupancy, building count, use type) for one property.
+
+    Returns:
+        dict of property details plus its new 'sync_state', or None if the property is unchanged since the
+        last run or could not be read
+    """
+    try:
+        response, new_state = sync_state.fetch('property', f'/property/{espmid}')
+        if new_state is None:
+            return None
+        with metrics.stage('xml_parse'):
+            dict_data = xmltodict.parse(response.content)
+        name=dict_data['property']['name']
+        address=dict_data['property']['address']['@address1']
+        gfa=dict_data['property']['grossFloorArea']['value']
+        occupancy=dict_data['property']['occupancyPercentage']
+        numbuildings=dict_data['property']['numberOfBuildings']
+        usetype=dict_data['property']['primaryFunction']
+
+        return {
+            'espmid': espmid,
+            'name': str(name) if name else None,
+            'address': str(address) if address else None,
+            'gfa': parse_optional_number(gfa, 'grossFloorArea'),
+            'occupancy': parse_optional_int(occupancy, 'occupancyPercentage'),
+            'numbuildings': parse_optional_int(numbuildings, 'numberOfBuildings'),
+            'usetype': str(usetype) if usetype else None,
+            'sync_state': new_state + (None,),
+        }
+    except Exception as e:
+        print(f"Error processing espmid {espmid}: {e}")
+        return None
+
+
+# SMALLDATETIME covers 1900-01-01 through 2079-06-06
+SMALLDATETIME_MIN = datetime.datetime(1900, 1, 1)
+SMALLDATETIME_MAX = datetime.datetime(2079, 6, 6, 23, 59)
+
+
+def parse_espm_date(date_str, field_name):
+    """
+    Parse a Portfolio Manager YYYY-MM-DD date for a SMALLDATETIME column.
+    Returns None (and prints a warning) if it can't be parsed or falls outside the smalldatetime range.
+    """
+    if not date_str:
+        return None
+    try:
+        parsed = datetime.datetime.strptime(date_str, '%Y-%m-%d')
+    except ValueError as e:
+        print(f"Warning: Could not parse {field_name} {date_str}: {e}")
+        return None
+    if SMALLDATETIME_MIN <= parsed <= SMALLDATETIME_MAX:
+        return parsed
+    print(f"Warning: {field_name} {date_str} is outside smalldatetime range")
+    return None
+
+
+# meterConsumption child elements we keep, in the order iter_consumption_entries() yields them
+CONSUMPTION_FIELDS = ('id', 'cost', 'usage', 'startDate', 'endDate')
+
+
+def iter_consumption_entries(source):
+    """
+    Incrementally parse a consumptionData document and yield one (id, cost, usage, startDate, endDate)
+    tuple of strings (None where missing) per meterConsumption element. Each element is discarded as
+    soon as it is read, so memory stays flat however many periods the meter has, and a single entry
+    needs no special casing.
+
+    Args:
+        source: file-like object with the XML body, e.g. the HashingReader SyncState.fetch() streams it through
+    """
+    root = None
+    for event, elem in et.iterparse(source, events=('start', 'end')):
+        if root is None:
+            root = elem
+            continue
+        if event != 'end' or elem.tag.rsplit('}', 1)[-1] != 'meterConsumption':
+            continue
+        values = dict.fromkeys(CONSUMPTION_FIELDS)
+        for child in elem:
+            tag = child.tag.rsplit('}', 1)[-1]
+            if tag in values:
+                values[tag] = child.text
+        yield tuple(values[field] for field in CONSUMPTION_FIELDS)
+        # Drop the finished entry (and everything before it) from the partial tree
+        root.clear()
+
+
+def parse_number(value_str, field_name):
+    """
+    Parse a cost/usage string to a float. Missing or unparseable values become NaN.
+    """
+    if not value_str:
+        return NAN
+    try:
+        return float(value_str)
+    except ValueError:
+        print(f"Warning: Could not parse {field_name} {value_str}")
+        return NAN
+
+
+def parse_optional_number(value_str, field_name):
+    """
+    Parse a numeric property field to a float, or None when it is missing or unparseable.
+    """
+    number = parse_number(value_str, field_name)
+    return None if math.isnan(number) else number
+
+
+def parse_optional_int(value_str, field_name):
+    """
+    Parse a whole-number property field (occupancy, building count) to an int, or None.
+    """
+    number = parse_optional_number(value_str, field_name)
+    return None if number is None else int(round(number))
+
+
+def build_consumption_row(espmid, meterid, entry):
+    """
+    Turn one (id, cost, usage, startDate, endDate) consumption entry into a compact typed row:
+    (espmid, meterid, entryid, cost, usage, startdate, enddate, fallback_id) with integer ids,
+    float cost/usage (NaN = missing) and date ordinals (0 = missing).
+    fallback_id is only set for entries that come without an id of their own.
+    """
+    entryid, cost, usage, startdate_str, enddate_str = entry
+    startdate = parse_espm_date(startdate_str, 'startdate')
+    enddate = parse_espm_date(enddate_str, 'enddate')
+
+    fallback_id = None
+    if not entryid:
+        if startdate_str and enddate_str:
+            fallback_id = f"{meterid}_{startdate_str}_{enddate_str}"
+        elif startdate_str:
+            fallback_id = f"{meterid}_{startdate_str}"
+        # Otherwise the ConsumptionStore numbers it by position as rows are collected
+
+    return (
+        int(espmid),
+        int(meterid),
+        int(entryid) if entryid else None,
+        parse_number(cost, 'cost'),
+        parse_number(usage, 'usage'),
+        startdate.toordinal() if startdate else 0,
+        enddate.toordinal() if enddate else 0,
+        fallback_id,
     )
+
+
+def db_number(value):
     """
-    
-    # Execute the query
+    Buffered cost/usage as a DB parameter: NaN (missing) becomes NULL.
+    """
+    return None if math.isnan(value) else value
+
+
+def db_rows(df):
+    """
+    DataFrame rows as DB parameters: plain Python values, with missing values as NULL.
+    """
+    return df.astype(object).where(pd.notna(df), None).values.tolist()
+
+
+class ConsumptionBuffer:
+    """
+    Column-wise buffer of consumption rows for one meter table. Ids are kept as machine integers,
+    cost/usage as doubles (NaN = missing) and dates as ordinals (0 = missing), so a buffered row costs
+    a few dozen bytes instead of a dict of strings.
+    """
+
+    __slots__ = ('espmid', 'meterid', 'entryid', 'cost', 'usage', 'startdate', 'enddate', 'fallback_ids')
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.espmid = array('q')
+        self.meterid = array('q')
+        self.entryid = array('q')
+        self.cost = array('d')
+        self.usage = array('d')
+        self.startdate = array('l')
+        self.enddate = array('l')
+        # row index -> synthesized entryid, only for entries without an id of their own
+        self.fallback_ids = {}
+
+    def __len__(self):
+        return len(self.espmid)
+
+    def append(self, row, fallback_id=None):
+        espmid, meterid, entryid, cost, usage, startdate, enddate, _ = row
+        if fallback_id is not None:
+            self.fallback_ids[len(self)] = fallback_id
+        self.espmid.append(espmid)
+        self.meterid.append(meterid)
+        self.entryid.append(-1 if entryid is None else entryid)
+        self.cost.append(cost)
+        self.usage.append(usage)
+        self.startdate.append(startdate)
+        self.enddate.append(enddate)
+
+    def rows(self):
+        """
+        Yield buffered rows as (entryid, espmid, meterid, cost, usage, startdate, enddate) for the meter tables.
+        """
+        for i in range(len(self)):
+            meterid = self.meterid[i]
+            entryid = self.fallback_ids.get(i) or f"{meterid}_{self.entryid[i]}"
+            startdate = self.startdate[i]
+            enddate = self.enddate[i]
+            yield (
+                entryid,
+                self.espmid[i],
+                str(meterid),
+                db_number(self.cost[i]),
+                db_number(self.usage[i]),
+                datetime.datetime.fromordinal(startdate) if startdate else None,
+                datetime.datetime.fromordinal(enddate) if enddate else None,
+            )
+
+
+class ConsumptionStore:
+    """
+    Collects consumption rows for every meter table and MERGEs them into the database in chunks,
+    so memory during the run scales with flush_rows rather than the size of the portfolio.
+
+    Duplicates are dropped on the way in: repeated entries within a meter, and whole meters that were
+    already loaded through another property (a meter can be associated with more than one).
+    """
+
+    def __init__(self, table_names, flush_rows=FLUSH_ROWS):
+        self.flush_rows = flush_rows
+        self.buffers = {table_name: ConsumptionBuffer() for table_name in table_names}
+        self.loaded_meters = {table_name: set() for table_name in table_names}
+        self.rows_accepted = {table_name: 0 for table_name in table_names}
+        self.duplicates_removed = {table_name: 0 for table_name in table_names}
+        self.rows_affected = {table_name: 0 for table_name in table_names}
+        # Buildings whose meter rows were inserted or updated, for the rollup refresh
+        self.touched_espmids = set()
+        # Sync states of the documents behind the buffered rows, saved once those rows are merged
+        self.sync_states = []
+        # Properties whose rows are all buffered, checkpointed once those rows are merged
+        self.completed_espmids = []
+
+    def pending(self):
+        return sum(len(buffer) for buffer in self.buffers.values())
+
+    def add_rows(self, table_name, rows):
+        """
+        Buffer one property's rows for a table, flushing every table once flush_rows are pending.
+        """
+        buffer = self.buffers[table_name]
+        loaded_meters = self.loaded_meters[table_name]
+        batch_meters = set()
+        batch_keys = set()
+        for row in rows:
+            espmid, meterid, entryid = row[0], row[1], row[2]
+            fallback_id = row[7]
+            if meterid in loaded_meters:
+                self.duplicates_removed[table_name] += 1
+                continue
+            if entryid is None and fallback_id is None:
+                fallback_id = f"{meterid}_{espmid}_{self.rows_accepted[table_name]}"
+            key = (meterid, entryid) if entryid is not None else fallback_id
+            if key in batch_keys:
+                self.duplicates_removed[table_name] += 1
+                print(f"Warning: Duplicate entry {key} on meter {meterid}. Skipping duplicate entry.")
+                continue
+            batch_keys.add(key)
+            batch_meters.add(meterid)
+            buffer.append(row, fallback_id if entryid is None else None)
+            self.rows_accepted[table_name] += 1
+        loaded_meters.update(batch_meters)
+
+    def add_sync_states(self, states):
+        self.sync_states.extend(states)
+
+    def complete_property(self, espmid):
+        self.completed_espmids.append(espmid)
+
+    def flush_if_full(self):
+        if self.pending() >= self.flush_rows:
+            self.flush()
+
+    def merge_table(self, table_name):
+        with db.session():
+            return merge_meter_data(table_name, list(self.buffers[table_name].rows()))
+
+    def flush(self):
+        """
+        MERGE everything buffered into the meter tables and empty the buffers, then record the documents
+        those rows came from as seen and checkpoint the properties they belong to.
+        """
+        table_names = [table_name for table_name, buffer in self.buffers.items() if len(buffer)]
+        # The tables are independent, so backends that allow concurrent writers merge them at once,
+        # each on its own pooled connection
+        max_workers = min(DB_POOL_SIZE, len(table_names)) if storage.supports_concurrent_writes else 1
+        results = iter_concurrently(self.merge_table, table_names, max_workers=max_workers) if table_names else []
+        for table_name, (rows_affected, touched_espmids) in zip(table_names, results):
+            metrics.increment('rows_merged', len(self.buffers[table_name]), table=table_name)
+            metrics.increment('rows_affected', rows_affected, table=table_name)
+            self.rows_affected[table_name] += rows_affected
+            self.touched_espmids.update(touched_espmids)
+            self.buffers[table_name].clear()
+        with metrics.stage('checkpoint'):
+            save_sync_state(self.sync_states)
+            checkpoint_properties(self.completed_espmids)
+        self.sync_states = []
+        self.completed_espmids = []
+
+
+def parse_meter_ids(espmid, content):
+    """
+    Meter IDs from a property's meter association document, as a list (empty if it has none).
+    """
+    dict_data = xmltodict.parse(content)
+
+    # Handle case where meterId might be a single value or a list
+    meter_list_data = dict_data.get('meterPropertyAssociationList', {}).get('energyMeterAssociation', {}).get('meters', {})
+    if not meter_list_data:
+        print(f"No meter data found for espmid {espmid}")
+        return []
+
+    meter_ids = meter_list_data.get('meterId')
+    if meter_ids is None:
+        print(f"No meterId found for espmid {espmid}")
+        return []
+
+    # Normalize to list: if it's a single value, make it a list
+    if isinstance(meter_ids, list):
+        return meter_ids
+    return [meter_ids]
+
+
+def fetch_property_meters(espmid):
+    """
+    Discover the meters on one property and pull consumption for every in-use meter whose type is in METER_TYPES.
+    Documents unchanged since the last run aren't parsed: the meter list and meter types come from sync_state,
+    and unchanged consumption is skipped outright. Safe to run on a worker thread since it only builds its own lists.
+
+    Returns:
+        (dict of meter table name -> list of build_consumption_row() tuples for this property,
+         list of new sync states to save once those rows are committed)
+    """
+    property_rows = {table_name: [] for table_name in METER_TABLES}
+    new_states = []
     try:
-        cursor.execute(create_table_query)
-        print("Table 'espm basics' created successfully!")
-        connection.commit()
-    except pyodbc.Error as create_error:
-        # Table might already exist, that's okay
-        if "already exists" in str(create_error).lower() or "There is already an object" in str(create_error):
-            print("Table 'ESPM basics' already exists (or creation failed), continuing...")
-            connection.rollback()
-            
-            # Add new columns if they don't exist (for existing tables)
-            try:
-                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD occupancy NVARCHAR(100)")
-                print("Added 'occupancy' column to ESPMFIRSTTEST table.")
-                connection.commit()
-            except pyodbc.Error as e:
-                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                    pass  # Column already exists
-                else:
-                    print(f"Warning: Could not add 'occupancy' column: {e}")
-            
+        association_path = f'/association/property/{espmid}/meter'
+        with metrics.stage('meter_discovery'):
+            response, new_state = sync_state.fetch('meter_association', association_path)
+        if new_state is None:
+            meter_id_list = sync_state.info(SyncState.resource_key(association_path)) or []
+        else:
+            with metrics.stage('xml_parse'):
+                meter_id_list = parse_meter_ids(espmid, response.content)
+            new_states.append(new_state + (json.dumps(meter_id_list),))
+
+        for meter in meter_id_list:
             try:
-                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD numbuildings NVARCHAR(100)")
-                print("Added 'numbuildings' column to ESPMFIRSTTEST table.")
-                connection.commit()
-            except pyodbc.Error as e:
-                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                    pass  # Column already exists
+                meter_path = f'/meter/{meter}'
+                with metrics.stage('meter_discovery'):
+                    response, new_state = sync_state.fetch('meter', meter_path)
+                if new_state is None:
+                    meter_info = sync_state.info(SyncState.resource_key(meter_path)) or {}
                 else:
-                    print(f"Warning: Could not add 'numbuildings' column: {e}")
-            
-            try:
-                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD usetype NVARCHAR(100)")
-                print("Added 'usetype' column to ESPMFIRSTTEST table.")
-                connection.commit()
-            except pyodbc.Error as e:
-                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
-                    pass  # Column already exists
-                else:
-                    print(f"Warning: Could not add 'usetype' column: {e}")
-        else:
-            raise  # Re-raise if it's a different error
-    
+                    with metrics.stage('xml_parse'):
+                        dict_data = xmltodict.parse(response.content)
+                    # Check if 'meter' key exists in the response
+                    if 'meter' not in dict_data:
+                        print(f"Warning: 'meter' key not found in response for meter ID {meter}")
+                        print(f'ESPM ID of affected meter{espmid}')
+                        print(f"Response keys: {list(dict_data.keys())}")
+                        continue
+                    # Keep just what later runs need if this document doesn't change
+                    meter_info = {key: dict_data['meter'].get(key) for key in ('id', 'type', 'inUse')}
+                    new_states.append(new_state + (json.dumps(meter_info),))
+                if meter_info.get('inUse')=="False":
+                    continue
+                meter_type = METER_TYPES.get(meter_info.get('type'))
+                if meter_type is None:
+                    continue
+                metrics.increment('meters', type=meter_type['label'])
+                meter_id = meter_info.get('id')
+                if not meter_id:
+                    print(f"Warning: No meter ID found for meter {meter}")
+                    continue
+                def parse_consumption(body):
+                    with metrics.stage('xml_parse'):
+                        return [build_consumption_row(espmid, meter, entry) for entry in iter_consumption_entries(body)]
 
-#Pull All ESPM ID's and input them into database
-    idlist=[]
-    response = requests.get(f'https://portfoliomanager.energystar.gov/ws/account/216165/property/list', auth=HTTPBasicAuth(user, pw), timeout=60)
-    dict_data = xmltodict.parse(response.content)
-    print("This is the meter list info")
-    for entry in dict_data['response']['links']['link']:
-        idlist.append(entry['@id'])
-    
-    # Mass insert/update espmid values using optimized bulk insert
-    # Convert idlist items to integers (they come as strings from XML)
-    idlist_int = [int(id_val) for id_val in idlist]
-    
-    if not idlist_int:
-        print("No IDs to insert.")
-    else:
-        print(f"Processing {len(idlist_int)} ESPM IDs...")
-        
-        #Merge using temp table - PUT espm ID's into new table and check vs existing one
+                # Parsed straight off the socket while it's hashed; consumption_fetch time includes that xml_parse
+                with metrics.stage('consumption_fetch'):
+                    meter_rows, new_state = sync_state.fetch(
+                        'consumption', f'/meter/{meter_id}/consumptionData?startDate={consumption_start_date(meter)}',
+                        parse=parse_consumption
+                    )
+                if new_state is None:
+                    continue  # Same periods as last run, nothing to write
+                property_rows[meter_type['table']].extend(meter_rows)
+                new_states.append(new_state + (None,))
+                if not meter_rows:
+                    print(f"No consumption data found for meter {meter}")
+            except Exception as meter_error:
+                print(f"Error processing meter {meter} for espmid {espmid}: {meter_error}")
+                continue
+    except Exception as espmid_error:
+        print(f"Error processing espmid {espmid}: {espmid_error}")
+    return property_rows, new_states
+
+
+def ensure_meter_table(table_name):
+    """
+    Create a meter table if it doesn't exist yet, or widen entryid on an older one.
+    """
+    connection, cursor = db.current()
+    if not storage.table_exists(cursor, table_name):
         try:
-            # Create temporary table
-            cursor.execute("""
-                CREATE TABLE #TempESPMIDs (
-                    espmid INT PRIMARY KEY
-                )
-            """)
-            # Bulk insert into temp table using fast_executemany (optimized for bulk operations)
-            temp_insert_query = "INSERT INTO #TempESPMIDs (espmid) VALUES (?)"
-            cursor.executemany(temp_insert_query, [(id_val,) for id_val in idlist_int])
-            
-            # Use merge to insert only new ID
-            merge_query = """
-                MERGE ESPMFIRSTTEST AS target
-                USING #TempESPMIDs AS source
-                ON target.espmid = source.espmid
-                WHEN NOT MATCHED THEN
-                    INSERT (espmid)
-                    VALUES (source.espmid);
-            """
-            cursor.execute(merge_query)
-            
-            # Get count of inserted rows (MERGE returns affected rows)
-            cursor.execute("SELECT @@ROWCOUNT")
-            rows_inserted = cursor.fetchone()[0]
-            
-            connection.commit()
-            
-            # Drop temp table (in finally block to ensure cleanup)
-            
-            print(f"Successfully processed {len(idlist_int)} ESPM IDs. {rows_inserted} new IDs inserted.")
-            
-        except pyodbc.Error as e:
-            # Ensure temp table is cleaned up
+            cursor.execute(f"CREATE TABLE {table_name} ({METER_TABLE_COLUMNS})")
+            db.commit()
+            print(f"Table '{table_name}' created successfully!")
+        except storage.Error as create_error:
             try:
-                cursor.execute("DROP TABLE #TempESPMIDs")
+                connection.rollback()
             except:
                 pass
-            
-            # Fallback: If MERGE fails, try direct insert with error handling
-            print(f"MERGE approach failed, trying alternative method: {e}")
+            print(f"Error creating {table_name} table: {create_error}")
+        return
+    if not storage.supports_maintenance:
+        return
+    try:
+        # Older tables were created with a narrower entryid
+        cursor.execute(f"ALTER TABLE {table_name} ALTER COLUMN entryid NVARCHAR(100)")
+        db.commit()
+        print(f"Updated 'entryid' column size in {table_name} table.")
+    except storage.Error:
+        # Column is already the right size (or is locked in by the primary key), nothing to do
+        try:
             connection.rollback()
-            
+        except:
+            pass
+
+
+def migrate_numeric_columns(table_name):
+    """
+    Convert the numeric columns of a table that older databases still hold as NVARCHAR(100) to the types in
+    NUMERIC_COLUMNS. Each column is backfilled with TRY_CAST into a new typed column, which then replaces
+    the original. The migration always finishes, since the readers expect numbers: a non-blank value that
+    won't convert becomes NULL, and how many there were (with a few examples) is reported first. Indexes
+    that use the column are dropped for the swap; ensure_meter_indexes() puts back the METER_INDEXES.
+    Only SQL Server databases predate the typed schema.
+    """
+    if not storage.supports_maintenance:
+        return
+    connection, cursor = db.current()
+    for column_name, sql_type in NUMERIC_COLUMNS[table_name].items():
+        cursor.execute(
+            "SELECT DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS WHERE TABLE_NAME = ? AND COLUMN_NAME = ?",
+            (table_name, column_name)
+        )
+        row = cursor.fetchone()
+        if row is None or row[0].lower() not in ('nvarchar', 'varchar'):
+            continue  # Missing, or already migrated
+
+        unconvertible = f"""
+            FROM {table_name}
+            WHERE NULLIF(LTRIM(RTRIM({column_name})), '') IS NOT NULL
+            AND TRY_CAST({column_name} AS {sql_type}) IS NULL
+        """
+        cursor.execute(f"SELECT COUNT(*) {unconvertible}")
+        incompatible = cursor.fetchone()[0]
+        if incompatible:
+            cursor.execute(f"SELECT DISTINCT TOP (5) {column_name} {unconvertible}")
+            examples = ", ".join(repr(row[0]) for row in cursor.fetchall())
+            print(f"Warning: {incompatible} rows in {table_name}.{column_name} don't convert to {sql_type} "
+                  f"(e.g. {examples}); they will be NULL after the migration.")
+
+        # An index that has the column as a key or included column would block DROP COLUMN
+        cursor.execute("""
+            SELECT DISTINCT i.name
+            FROM sys.indexes i
+            JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+            JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            WHERE i.object_id = OBJECT_ID(?) AND c.name = ? AND i.is_primary_key = 0
+        """, (table_name, column_name))
+        dependent_indexes = [row[0] for row in cursor.fetchall()]
+
+        typed_column = f"{column_name}_typed"
+        try:
+            for index_name in dependent_indexes:
+                cursor.execute(f"DROP INDEX {index_name} ON {table_name}")
+            cursor.execute(f"ALTER TABLE {table_name} ADD {typed_column} {sql_type} NULL")
+            cursor.execute(f"UPDATE {table_name} SET {typed_column} = TRY_CAST({column_name} AS {sql_type})")
+            cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN {column_name}")
+            cursor.execute(f"EXEC sp_rename '{table_name}.{typed_column}', '{column_name}', 'COLUMN'")
+            db.commit()
+            print(f"Migrated {table_name}.{column_name} to {sql_type}.")
+            unmanaged = [name for name in dependent_indexes
+                         if name not in {f"IX_{table_name}_{suffix}" for suffix in METER_INDEXES}]
+            if unmanaged:
+                print(f"Warning: Dropped index(es) {', '.join(unmanaged)} on {table_name} to migrate {column_name}; recreate them if still needed.")
+        except storage.Error as e:
             try:
-                # Try using INSERT with error handling - batch in chunks for better performance
-                batch_size = 1000  # Process in batches to avoid memory issues
-                insert_query = "INSERT INTO ESPMFIRSTTEST (espmid) VALUES (?)"
-                
-                total_inserted = 0
-                for i in range(0, len(idlist_int), batch_size):
-                    batch = idlist_int[i:i + batch_size]
-                    try:
-                        cursor.executemany(insert_query, [(id_val,) for id_val in batch])
-                        total_inserted += len(batch)
-                    except pyodbc.IntegrityError:
-                        # Some IDs in this batch exist, insert individually
-                        connection.rollback()
-                        for id_val in batch:
-                            try:
-                                cursor.execute(insert_query, (id_val,))
-                                total_inserted += 1
-                            except pyodbc.IntegrityError:
-                                pass  # ID already exists, skip
-                        connection.commit()
-                    else:
-                        connection.commit()
-                
-                print(f"Inserted {total_inserted} new ESPM IDs. {len(idlist_int) - total_inserted} IDs already existed.")
-                
-            except pyodbc.Error as fallback_error:
-                print(f"Error inserting ESPM IDs: {fallback_error}")
                 connection.rollback()
+            except:
+                pass
+            print(f"Warning: Could not migrate {table_name}.{column_name} to {sql_type}: {e}")
 
-    
 
-    # For each ESPM id, iterate through and pull specific data
-    # data we need - sq footage,name,postal code,primary use type, gas data, electric data,water data,year built,#buildings # stories,, Migreenpower    
-    # Collect all property data first
-    property_data = []
-    for espmid in idlist:
-        try:
-            response=session.get(f'https://portfoliomanager.energystar.gov/ws/property/{espmid}', auth=HTTPBasicAuth(user, pw), timeout=60)
-            dict_data = xmltodict.parse(response.content)
-            name=dict_data['property']['name']
-            address=dict_data['property']['address']['@address1']
-            gfa=dict_data['property']['grossFloorArea']['value']
-            occupancy=dict_data['property']['occupancyPercentage']
-            numbuildings=dict_data['property']['numberOfBuildings']
-            usetype=dict_data['property']['primaryFunction']
-            
-            
-            # Store data for bulk update
-            property_data.append({
-                'espmid': espmid,
-                'name': str(name) if name else None,
-                'address': str(address) if address else None,
-                'gfa': str(gfa) if gfa else None,
-                'occupancy': str(occupancy) if occupancy else None,
-                'numbuildings': str(numbuildings) if numbuildings else None,
-                'usetype': str(usetype) if usetype else None
-            })
-        except Exception as e:
-            print(f"Error processing espmid {espmid}: {e}")
-            continue
-    
-    # Create temp table and perform bulk update if we have data
-    if property_data:
+def ensure_meter_indexes(table_name):
+    """
+    Create any of the METER_INDEXES that are missing on a meter table.
+    Runs after migrate_numeric_columns(), which drops any index on a column it swaps.
+    """
+    connection, cursor = db.current()
+    for suffix, (key_columns, included_columns) in METER_INDEXES.items():
+        index_name = f"IX_{table_name}_{suffix}"
         try:
-            # Create temporary table with all property data
-            cursor.execute("""
-                CREATE TABLE #TempPropertyData (
-                    espmid INT PRIMARY KEY,
-                    buildingname NVARCHAR(100),
-                    sqfootage NVARCHAR(100),
-                    address NVARCHAR(100),
-                    occupancy NVARCHAR(100),
-                    numbuildings NVARCHAR(100),
-                    usetype NVARCHAR(100)
-                )
-            """)
-            
-            # Insert all property data into temp table
-            temp_insert_query = """
-                INSERT INTO #TempPropertyData (espmid, buildingname, sqfootage, address, occupancy, numbuildings, usetype) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """
-            insert_data = [
-                (
-                    prop['espmid'],
-                    prop['name'],
-                    prop['gfa'],
-                    prop['address'],
-                    prop['occupancy'],
-                    prop['numbuildings'],
-                    prop['usetype']
-                )
-                for prop in property_data
-            ]
-            cursor.executemany(temp_insert_query, insert_data)
-            
-            # Use MERGE to update only where values differ
-            merge_query = """
-                MERGE ESPMFIRSTTEST AS target
-                USING #TempPropertyData AS source
-                ON target.espmid = source.espmid
-                WHEN MATCHED AND (
-                    ISNULL(target.buildingname, '') <> ISNULL(source.buildingname, '') OR
-                    ISNULL(target.sqfootage, '') <> ISNULL(source.sqfootage, '') OR
-                    ISNULL(target.address, '') <> ISNULL(source.address, '') OR
-                    ISNULL(target.occupancy, '') <> ISNULL(source.occupancy, '') OR
-                    ISNULL(target.numbuildings, '') <> ISNULL(source.numbuildings, '') OR
-                    ISNULL(target.usetype, '') <> ISNULL(source.usetype, '')
-                ) THEN
-                    UPDATE SET
-                        buildingname = source.buildingname,
-                        sqfootage = source.sqfootage,
-                        address = source.address,
-                        occupancy = source.occupancy,
-                        numbuildings = source.numbuildings,
-                        usetype = source.usetype
-                WHEN NOT MATCHED THEN
-                    INSERT (espmid, buildingname, sqfootage, address, occupancy, numbuildings, usetype)
-                    VALUES (source.espmid, source.buildingname, source.sqfootage, source.address, source.occupancy, source.numbuildings, source.usetype);
-            """
-            cursor.execute(merge_query)
-            
-            # Get count of updated rows
-            cursor.execute("SELECT @@ROWCOUNT")
-            rows_affected = cursor.fetchone()[0]
-            
-            connection.commit()
-            
-            # Drop temp table
-            cursor.execute("DROP TABLE #TempPropertyData")
-            
-            print(f"Successfully updated {rows_affected} rows in ESPMFIRSTTEST table.")
-            
-        except pyodbc.Error as e:
-            # Ensure temp table is cleaned up
+            cursor.execute(storage.create_index_sql(index_name, table_name, key_columns, included_columns))
+            db.commit()
+        except storage.Error as e:
             try:
-                cursor.execute("DROP TABLE #TempPropertyData")
+                connection.rollback()
             except:
                 pass
-            print(f"Error updating property data: {e}")
-            connection.rollback()
-    # format of new table - espmid,cost,usage,startdate,enddate
-    # query all entries from specific date ranges
-    gasdata=[]
-    electricdata=[]
-    solardata=[]
-    for espmid in idlist:
+            print(f"Warning: Could not create index {index_name}: {e}")
+
+
+def maintain_meter_indexes(table_name, reorganize_percent=10, rebuild_percent=30):
+    """
+    Reorganize or rebuild a meter table's indexes once loading has fragmented them.
+    """
+    if not storage.supports_maintenance:
+        return
+    connection, cursor = db.current()
+    try:
+        cursor.execute("""
+            SELECT i.name, s.avg_fragmentation_in_percent
+            FROM sys.dm_db_index_physical_stats(DB_ID(), OBJECT_ID(?), NULL, NULL, 'LIMITED') s
+            JOIN sys.indexes i ON i.object_id = s.object_id AND i.index_id = s.index_id
+            WHERE i.name IS NOT NULL AND s.page_count > 100
+        """, (table_name,))
+        fragmented = [(name, pct) for name, pct in cursor.fetchall() if pct >= reorganize_percent]
+        for index_name, fragmentation in fragmented:
+            action = 'REBUILD' if fragmentation >= rebuild_percent else 'REORGANIZE'
+            cursor.execute(f"ALTER INDEX [{index_name}] ON {table_name} {action}")
+            db.commit()
+            print(f"{action} {index_name} ({fragmentation:.0f}% fragmented).")
+    except storage.Error as e:
         try:
-            response = requests.get(f'https://portfoliomanager.energystar.gov/ws/association/property/{espmid}/meter', auth=HTTPBasicAuth(user, pw), timeout=60)
-            dict_data = xmltodict.parse(response.content)
-            
-            # Handle case where meterId might be a single value or a list
-            meter_list_data = dict_data.get('meterPropertyAssociationList', {}).get('energyMeterAssociation', {}).get('meters', {})
-            if not meter_list_data:
-                print(f"No meter data found for espmid {espmid}")
-                continue
-            
-            meter_ids = meter_list_data.get('meterId')
-            if meter_ids is None:
-                print(f"No meterId found for espmid {espmid}")
-                continue
-            
-            # Normalize to list: if it's a single value, make it a list
-            if isinstance(meter_ids, list):
-                meter_id_list = meter_ids
-            else:
-                meter_id_list = [meter_ids]
+            connection.rollback()
+        except:
+            pass
+        print(f"Warning: Could not maintain indexes on {table_name}: {e}")
 
-            for meter in meter_id_list:
-                try:
-                    response = requests.get(f'https://portfoliomanager.energystar.gov/ws/meter/{meter}', auth=HTTPBasicAuth(user, pw), timeout=60)  
-                    dict_data = xmltodict.parse(response.content)
-                    #Meter Data
-                    # Check if 'meter' key exists in the response
-                    if 'meter' not in dict_data:
-                        print(f"Warning: 'meter' key not found in response for meter ID {meter}")
-                        print(f'ESPM ID of affected meter{espmid}')
-                        print(f"Response keys: {list(dict_data.keys())}")
-                        continue
-                    if dict_data['meter'].get('inUse')=="False":
-                        
-                       continue 
-                    if dict_data['meter'].get('type') == 'Natural Gas':
-                        print("it's gas")
-                        meter_id = dict_data['meter'].get('id')
-                        if not meter_id:
-                            print(f"Warning: No meter ID found for meter {meter}")
-                            continue
-                        response = requests.get(f'https://portfoliomanager.energystar.gov/ws/meter/{meter_id}/consumptionData?startDate=2020-01-01',auth=HTTPBasicAuth(user, pw), timeout=60)
-                        d = xmltodict.parse(response.content)
-                        
-                        # Handle case where meterConsumption might be a single dict or a list
-                        meter_consumption = d.get('meterData', {}).get('meterConsumption')
-                        if meter_consumption is None:
-                            print(f"No consumption data found for meter {meter}")
-                            continue
-                        
-                        # Normalize to list: if it's a dict, make it a list with one item
-                        if isinstance(meter_consumption, dict):
-                            consumption_list = [meter_consumption]
-                        elif isinstance(meter_consumption, list):
-                            consumption_list = meter_consumption
-                        else:
-                            print(f"Unexpected data type for meterConsumption: {type(meter_consumption)}")
-                            continue
-                        
-                        for entry in consumption_list:
-                            # Ensure entry is a dictionary
-                            if not isinstance(entry, dict):
-                                print(f"Skipping entry - not a dictionary: {entry}")
-                                continue
-                            
-                            entryid=entry.get('id')
-                            meterid=meter
-                            cost=entry.get('cost',0)
-                            usage=entry.get('usage')
-                            startdate_str=entry.get('startDate')
-                            enddate_str=entry.get('endDate')
-                            
-                            # Convert date strings to datetime objects for smalldatetime
-                            startdate = None
-                            enddate = None
-                            
-                            if startdate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    startdate_dt = datetime.datetime.strptime(startdate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    startdate_dt = startdate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if startdate_dt >= datetime.datetime(1900, 1, 1) and startdate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        startdate = startdate_dt
-                                    else:
-                                        print(f"Warning: startdate {startdate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse startdate {startdate_str}: {e}")
-                            
-                            if enddate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    enddate_dt = datetime.datetime.strptime(enddate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    enddate_dt = enddate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if enddate_dt >= datetime.datetime(1900, 1, 1) and enddate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        enddate = enddate_dt
-                                    else:
-                                        print(f"Warning: enddate {enddate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse enddate {enddate_str}: {e}")
-                            
-                            # Create a unique entryid by combining meterid and entryid to prevent duplicates
-                            # This ensures uniqueness across different meters that might have the same entryid
-                            if entryid and meterid:
-                                unique_entryid = f"{meterid}_{entryid}"
-                            elif entryid:
-                                # If we have entryid but no meterid, still use entryid but add espmid for uniqueness
-                                unique_entryid = f"{espmid}_{entryid}"
-                            elif meterid:
-                                # If entryid is None, create one using meterid and dates
-                                if startdate_str and enddate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}_{enddate_str}"
-                                elif startdate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}"
-                                else:
-                                    # Fallback: use meterid, espmid, and index to ensure uniqueness
-                                    unique_entryid = f"{meterid}_{espmid}_{len(gasdata)}"
-
-                            
-                            gasdata.append({
-                                'espmid': espmid,
-                                'entryid': unique_entryid,
-                                'meterid': str(meterid) if meterid else None,
-                                'cost': str(cost) if cost else None,
-                                'usage': str(usage) if usage else None,
-                                'startdate': startdate,
-                                'enddate': enddate,
-                            })
-                    elif dict_data['meter'].get('type') == 'Electric':
-                        print("it's electric")
-                        meter_id = dict_data['meter'].get('id')
-                        if not meter_id:
-                            print(f"Warning: No meter ID found for meter {meter}")
-                            continue
-                        response = requests.get(f'https://portfoliomanager.energystar.gov/ws/meter/{meter_id}/consumptionData?startDate=2020-01-01',auth=HTTPBasicAuth(user, pw), timeout=60)
-                        d = xmltodict.parse(response.content)
-                        
-                        # Handle case where meterConsumption might be a single dict or a list
-                        meter_consumption = d.get('meterData', {}).get('meterConsumption')
-                        if meter_consumption is None:
-                            print(f"No consumption data found for meter {meter}")
-                            continue
-                        
-                        # Normalize to list: if it's a dict, make it a list with one item
-                        if isinstance(meter_consumption, dict):
-                            consumption_list = [meter_consumption]
-                        elif isinstance(meter_consumption, list):
-                            consumption_list = meter_consumption
-                        else:
-                            print(f"Unexpected data type for meterConsumption: {type(meter_consumption)}")
-                            continue
-                        
-                        for entry in consumption_list:
-                            # Ensure entry is a dictionary
-                            if not isinstance(entry, dict):
-                                print(f"Skipping entry - not a dictionary: {entry}")
-                                continue
-                            
-                            entryid=entry.get('id')
-                            meterid=meter
-                            cost=entry.get('cost',0)
-                            usage=entry.get('usage')
-                            startdate_str=entry.get('startDate')
-                            enddate_str=entry.get('endDate')
-                            
-                            # Convert date strings to datetime objects for smalldatetime
-                            startdate = None
-                            enddate = None
-                            
-                            if startdate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    startdate_dt = datetime.datetime.strptime(startdate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    startdate_dt = startdate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if startdate_dt >= datetime.datetime(1900, 1, 1) and startdate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        startdate = startdate_dt
-                                    else:
-                                        print(f"Warning: startdate {startdate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse startdate {startdate_str}: {e}")
-                            
-                            if enddate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    enddate_dt = datetime.datetime.strptime(enddate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    enddate_dt = enddate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if enddate_dt >= datetime.datetime(1900, 1, 1) and enddate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        enddate = enddate_dt
-                                    else:
-                                        print(f"Warning: enddate {enddate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse enddate {enddate_str}: {e}")
-                            
-                            # Create a unique entryid by combining meterid and entryid to prevent duplicates
-                            # This ensures uniqueness across different meters that might have the same entryid
-                            if entryid and meterid:
-                                unique_entryid = f"{meterid}_{entryid}"
-                            elif entryid:
-                                # If we have entryid but no meterid, still use entryid but add espmid for uniqueness
-                                unique_entryid = f"{espmid}_{entryid}"
-                            elif meterid:
-                                # If entryid is None, create one using meterid and dates
-                                if startdate_str and enddate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}_{enddate_str}"
-                                elif startdate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}"
-                                else:
-                                    # Fallback: use meterid, espmid, and index to ensure uniqueness
-                                    unique_entryid = f"{meterid}_{espmid}_{len(electricdata)}"
-
-                            
-                            electricdata.append({
-                                'espmid': espmid,
-                                'entryid': unique_entryid,
-                                'meterid': str(meterid) if meterid else None,
-                                'cost': str(cost) if cost else None,
-                                'usage': str(usage) if usage else None,
-                                'startdate': startdate,
-                                'enddate': enddate,
-                            })
-                    elif dict_data['meter'].get('type') == 'Electric on Site Solar':
-                        print("it's solar")
-                        meter_id = dict_data['meter'].get('id')
-                        if not meter_id:
-                            print(f"Warning: No meter ID found for meter {meter}")
-                            continue
-                        response = requests.get(f'https://portfoliomanager.energystar.gov/ws/meter/{meter_id}/consumptionData?startDate=2020-01-01',auth=HTTPBasicAuth(user, pw), timeout=60)
-                        d = xmltodict.parse(response.content)
-                        
-                        # Handle case where meterConsumption might be a single dict or a list
-                        meter_consumption = d.get('meterData', {}).get('meterConsumption')
-                        if meter_consumption is None:
-                            print(f"No consumption data found for meter {meter}")
-                            continue
-                        
-                        # Normalize to list: if it's a dict, make it a list with one item
-                        if isinstance(meter_consumption, dict):
-                            consumption_list = [meter_consumption]
-                        elif isinstance(meter_consumption, list):
-                            consumption_list = meter_consumption
-                        else:
-                            print(f"Unexpected data type for meterConsumption: {type(meter_consumption)}")
-                            continue
-                        
-                        for entry in consumption_list:
-                            # Ensure entry is a dictionary
-                            if not isinstance(entry, dict):
-                                print(f"Skipping entry - not a dictionary: {entry}")
-                                continue
-                            
-                            entryid=entry.get('id')
-                            meterid=meter
-                            cost=entry.get('cost',0)
-                            usage=entry.get('usage')
-                            startdate_str=entry.get('startDate')
-                            enddate_str=entry.get('endDate')
-                            
-                            # Convert date strings to datetime objects for smalldatetime
-                            startdate = None
-                            enddate = None
-                            
-                            if startdate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    startdate_dt = datetime.datetime.strptime(startdate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    startdate_dt = startdate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if startdate_dt >= datetime.datetime(1900, 1, 1) and startdate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        startdate = startdate_dt
-                                    else:
-                                        print(f"Warning: startdate {startdate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse startdate {startdate_str}: {e}")
-                            
-                            if enddate_str:
-                                try:
-                                    # Parse ISO format date (YYYY-MM-DD) to datetime
-                                    enddate_dt = datetime.datetime.strptime(enddate_str, '%Y-%m-%d')
-                                    # Round to nearest minute (smalldatetime precision) and ensure valid range
-                                    enddate_dt = enddate_dt.replace(second=0, microsecond=0)
-                                    # Check if within smalldatetime range (1900-01-01 to 2079-06-06)
-                                    if enddate_dt >= datetime.datetime(1900, 1, 1) and enddate_dt <= datetime.datetime(2079, 6, 6, 23, 59):
-                                        enddate = enddate_dt
-                                    else:
-                                        print(f"Warning: enddate {enddate_str} is outside smalldatetime range")
-                                except ValueError as e:
-                                    print(f"Warning: Could not parse enddate {enddate_str}: {e}")
-                            
-                            # Create a unique entryid by combining meterid and entryid to prevent duplicates
-                            # This ensures uniqueness across different meters that might have the same entryid
-                            if entryid and meterid:
-                                unique_entryid = f"{meterid}_{entryid}"
-                            elif entryid:
-                                # If we have entryid but no meterid, still use entryid but add espmid for uniqueness
-                                unique_entryid = f"{espmid}_{entryid}"
-                            elif meterid:
-                                # If entryid is None, create one using meterid and dates
-                                if startdate_str and enddate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}_{enddate_str}"
-                                elif startdate_str:
-                                    unique_entryid = f"{meterid}_{startdate_str}"
-                                else:
-                                    # Fallback: use meterid, espmid, and index to ensure uniqueness
-                                    unique_entryid = f"{meterid}_{espmid}_{len(solardata)}"
-
-                            
-                            solardata.append({
-                                'espmid': espmid,
-                                'entryid': unique_entryid,
-                                'meterid': str(meterid) if meterid else None,
-                                'cost': str(cost) if cost else None,
-                                'usage': str(usage) if usage else None,
-                                'startdate': startdate,
-                                'enddate': enddate,
-                            })
-                except Exception as meter_error:
-                    print(f"Error processing meter {meter} for espmid {espmid}: {meter_error}")
-                    continue
-        except Exception as espmid_error:
-            print(f"Error processing espmid {espmid}: {espmid_error}")
-            continue
 
-    # Ensure naturalgas table exists and has correct column sizes
-    # First, check if table exists and alter entryid column size if needed
-    # Check connection first
-    connection, cursor = check_and_reconnect()
+def report_index_usage():
+    """
+    Print seeks, scans, lookups and updates for every index on the meter tables since the last restart,
+    so it's easy to check the dashboard reads are hitting the nonclustered indexes.
+    """
+    if not storage.supports_maintenance:
+        return
+    connection, cursor = db.current()
+    table_list = ", ".join(f"OBJECT_ID(N'{table_name}')" for table_name in METER_TABLES)
     try:
-        # Try to alter the entryid column to be larger (if table exists)
-        cursor.execute("ALTER TABLE naturalgas ALTER COLUMN entryid NVARCHAR(100)")
+        cursor.execute(f"""
+            SELECT OBJECT_NAME(i.object_id), i.name,
+                   ISNULL(u.user_seeks, 0), ISNULL(u.user_scans, 0), ISNULL(u.user_lookups, 0), ISNULL(u.user_updates, 0)
+            FROM sys.indexes i
+            LEFT JOIN sys.dm_db_index_usage_stats u
+                ON u.object_id = i.object_id AND u.index_id = i.index_id AND u.database_id = DB_ID()
+            WHERE i.object_id IN ({table_list}) AND i.name IS NOT NULL
+            ORDER BY 1, 2
+        """)
+        print("Index usage (seeks / scans / lookups / updates):")
+        for table_name, index_name, seeks, scans, lookups, updates in cursor.fetchall():
+            print(f"  {table_name}.{index_name}: {seeks} / {scans} / {lookups} / {updates}")
+    except storage.Error as e:
         try:
-            connection.commit()
-        except pyodbc.Error as commit_error:
-            if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                connection, cursor = check_and_reconnect()
-                connection.commit()
-            else:
-                raise
-        print("Updated 'entryid' column size in naturalgas table.")
-    except pyodbc.Error as alter_error:
-        error_str = str(alter_error).lower()
-        if "does not exist" in error_str or "invalid object" in error_str:
-            # Table doesn't exist, create it
-            try:
-                cursor.execute("""
-                    CREATE TABLE naturalgas (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'naturalgas' created successfully!")
-            except pyodbc.Error as create_error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                print(f"Error creating naturalgas table: {create_error}")
+            connection.rollback()
+        except:
+            pass
+        print(f"Warning: Could not read index usage: {e}")
+
+
+def ensure_energy_rollup_table():
+    """
+    Create the energy_rollup table if needed: one row per building, year and fuel with native-unit usage,
+    kBTU and cost, totalled from the calendarized energy_monthly. kbtu is the signed contribution to site
+    energy (solar is negative), so SUM(kbtu) over a building's fuels is its site energy for the year.
+
+    Returns:
+        True if the table was just created and needs a full backfill
+    """
+    connection, cursor = db.current()
+    if storage.table_exists(cursor, 'energy_rollup'):
+        return False
+    cursor.execute("""
+        CREATE TABLE energy_rollup (
+            espmid INT NOT NULL,
+            year INT NOT NULL,
+            fuel NVARCHAR(50) NOT NULL,
+            usage FLOAT,
+            kbtu FLOAT,
+            cost DECIMAL(18,2),
+            PRIMARY KEY (espmid, year, fuel)
+        )
+    """)
+    db.commit()
+    print("Table 'energy_rollup' created successfully!")
+    return True
+
+
+def ensure_energy_monthly_table():
+    """
+    Create the energy_monthly table if needed: calendarized usage, kBTU and cost per building, fuel and
+    calendar month, the series energy_rollup is totalled from.
+
+    Returns:
+        True if the table was just created and needs a full backfill
+    """
+    connection, cursor = db.current()
+    if storage.table_exists(cursor, 'energy_monthly'):
+        return False
+    cursor.execute("""
+        CREATE TABLE energy_monthly (
+            espmid INT NOT NULL,
+            fuel NVARCHAR(50) NOT NULL,
+            year INT NOT NULL,
+            month INT NOT NULL,
+            usage FLOAT,
+            kbtu FLOAT,
+            cost FLOAT,
+            PRIMARY KEY (espmid, fuel, year, month)
+        )
+    """)
+    db.commit()
+    print("Table 'energy_monthly' created successfully!")
+    return True
+
+
+def read_meter_periods(cursor, espmid_table):
+    """
+    Every meter period of the buildings in espmid_table, across all fuels, with its signed kBTU.
+    """
+    frames = []
+    for meter_type in METER_TYPES.values():
+        cursor.execute(f"""
+            SELECT m.espmid, m.startdate, m.enddate, m.usage, m.cost
+            FROM {meter_type['table']} m JOIN {espmid_table} t ON t.espmid = m.espmid
+        """)
+        periods = pd.DataFrame.from_records(
+            [tuple(row) for row in cursor.fetchall()], columns=['espmid', 'startdate', 'enddate', 'usage', 'cost']
+        )
+        periods['fuel'] = meter_type['energy_type']
+        periods['usage'] = pd.to_numeric(periods['usage'], errors='coerce')
+        periods['kbtu'] = periods['usage'] * meter_type['kbtu_factor'] * meter_type['sign']
+        frames.append(periods)
+    return pd.concat(frames, ignore_index=True)
+
+
+def refresh_energy_rollup(espmids=None):
+    """
+    Recompute energy_monthly from the meter tables for the given buildings, or for every building when
+    espmids is None, then energy_rollup from energy_monthly. Every billing period is calendarized (split
+    across the months it covers by day), so a December-January bill counts toward both years.
+    Buildings are done ROLLUP_CHUNK at a time to bound memory on a full backfill.
+    """
+    if espmids is not None and not espmids:
+        print("No meter rows changed, energy_rollup is up to date.")
+        return
+    connection, cursor = db.current()
+    rollup_espmids = storage.staging_table('RollupEspmids')
+    try:
+        if espmids is None:
+            cursor.execute(" UNION ".join(
+                f"SELECT espmid FROM {table_name} WHERE espmid IS NOT NULL" for table_name in METER_TABLES
+            ))
+            espmids = {row[0] for row in cursor.fetchall()}
+            scope = "all buildings"
         else:
-            # Column might already be the right size, or other error
+            scope = f"{len(espmids)} buildings"
+        espmids = sorted(int(espmid) for espmid in espmids)
+
+        storage.create_staging_table(cursor, rollup_espmids, "espmid INT PRIMARY KEY")
+        monthly_rows = rollup_rows = 0
+        for i in range(0, len(espmids), ROLLUP_CHUNK):
+            cursor.execute(f"DELETE FROM {rollup_espmids}")
+            cursor.executemany(f"INSERT INTO {rollup_espmids} (espmid) VALUES (?)", [(espmid,) for espmid in espmids[i:i + ROLLUP_CHUNK]])
+
+            monthly = calendarize(read_meter_periods(cursor, rollup_espmids), ['espmid', 'fuel'], ['usage', 'kbtu', 'cost'])
+            cursor.execute(f"DELETE FROM energy_monthly WHERE espmid IN (SELECT espmid FROM {rollup_espmids})")
+            if len(monthly):
+                cursor.executemany(
+                    "INSERT INTO energy_monthly (espmid, fuel, year, month, usage, kbtu, cost) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    db_rows(monthly[['espmid', 'fuel', 'year', 'month', 'usage', 'kbtu', 'cost']])
+                )
+            monthly_rows += len(monthly)
+
+            cursor.execute(f"DELETE FROM energy_rollup WHERE espmid IN (SELECT espmid FROM {rollup_espmids})")
+            cursor.execute(f"""
+                INSERT INTO energy_rollup (espmid, year, fuel, usage, kbtu, cost)
+                SELECT m.espmid, m.year, m.fuel, SUM(m.usage), SUM(m.kbtu), SUM(m.cost)
+                FROM energy_monthly m JOIN {rollup_espmids} t ON t.espmid = m.espmid
+                GROUP BY m.espmid, m.year, m.fuel
+            """)
+            rollup_rows += cursor.rowcount
+        cursor.execute(f"DROP TABLE {rollup_espmids}")
+        db.commit()
+        print(f"Refreshed energy_monthly and energy_rollup for {scope} ({monthly_rows} monthly rows, {rollup_rows} annual rows).")
+    except storage.Error as e:
+        try:
+            cursor.execute(f"DROP TABLE {rollup_espmids}")
+        except:
+            pass
+        try:
             connection.rollback()
-            # Try to create table if it doesn't exist (in case of different error)
-            try:
-                cursor.execute("""
-                    CREATE TABLE naturalgas (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'naturalgas' created successfully!")
-            except pyodbc.Error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                # Table likely exists with wrong column size, let's try to fix it
-                pass
-    
-    # Ensure electric table exists and has correct column sizes
-    connection, cursor = check_and_reconnect()
+        except:
+            pass
+        print(f"Error refreshing energy_rollup: {e}")
+
+
+def ensure_building_metrics_table():
+    """
+    Create building_metrics if needed: the per-building, per-year matrix behind the Building Comparison page.
+    It holds kBTU by fuel (signed like energy_rollup), site kBTU, cost, EUI and cost per sq ft. It also
+    holds EUI against the use type's baseline, and months_covered: how many calendar months of the year have
+    calendarized energy. A year is only complete at 12; the current year, still being billed, never is.
+    """
+    connection, cursor = db.current()
+    fuel_columns = "".join(f"{column} FLOAT, " for column in FUEL_KBTU_COLUMNS.values())
+    storage.create_table_if_missing(cursor, 'building_metrics', f"""
+        espmid INT NOT NULL,
+        year INT NOT NULL,
+        {fuel_columns}site_kbtu FLOAT,
+        cost DECIMAL(18,2),
+        sqfootage DECIMAL(18,2),
+        eui FLOAT,
+        cost_per_sqft FLOAT,
+        baseline_eui FLOAT,
+        pct_vs_baseline FLOAT,
+        months_covered INT,
+        PRIMARY KEY (espmid, year)
+    """)
+    db.commit()
+    try:
+        cursor.execute("SELECT months_covered FROM building_metrics WHERE 1 = 0")
+        cursor.fetchall()
+    except storage.Error:
+        # Created before months_covered; the table is rebuilt every run, so the new column fills in straight away
+        try:
+            connection.rollback()
+        except:
+            pass
+        cursor.execute("ALTER TABLE building_metrics ADD months_covered INT")
+        db.commit()
+        print("Added 'months_covered' column to building_metrics table.")
+
+
+def refresh_building_metrics():
+    """
+    Rebuild building_metrics from energy_rollup, the months covered in energy_monthly, the building details
+    in ESPMFIRSTTEST and BASELINE_EUI. It's one row per building and year, so the whole table is recomputed
+    every run; that also picks up changed square footage or use types, which don't touch the rollup.
+    """
+    def refresh(connection, cursor):
+        baselines = storage.staging_table('BaselineEui')
+        try:
+            cursor.execute(f"DROP TABLE {baselines}")
+        except storage.Error:
+            pass
+        storage.create_staging_table(cursor, baselines, "usetype NVARCHAR(100) PRIMARY KEY, baseline_eui FLOAT")
+        cursor.executemany(f"INSERT INTO {baselines} (usetype, baseline_eui) VALUES (?, ?)", list(BASELINE_EUI.items()))
+
+        fuel_sums = "".join(
+            f"SUM(CASE WHEN fuel = '{fuel}' THEN kbtu ELSE 0 END) AS {column}, "
+            for fuel, column in FUEL_KBTU_COLUMNS.items()
+        )
+        fuel_columns = "".join(f"{column}, " for column in FUEL_KBTU_COLUMNS.values())
+        cursor.execute("DELETE FROM building_metrics")
+        cursor.execute(f"""
+            INSERT INTO building_metrics (espmid, year, {fuel_columns}site_kbtu, cost, sqfootage, eui, cost_per_sqft, baseline_eui, pct_vs_baseline, months_covered)
+            SELECT r.espmid, r.year, {", ".join(f"r.{column}" for column in FUEL_KBTU_COLUMNS.values())}, r.site_kbtu, r.cost, b.sqfootage,
+                   CASE WHEN b.sqfootage > 0 THEN r.site_kbtu / CAST(b.sqfootage AS FLOAT) END,
+                   CASE WHEN b.sqfootage > 0 THEN CAST(r.cost AS FLOAT) / CAST(b.sqfootage AS FLOAT) END,
+                   bl.baseline_eui,
+                   CASE WHEN b.sqfootage > 0 AND bl.baseline_eui > 0
+                        THEN (r.site_kbtu / CAST(b.sqfootage AS FLOAT) - bl.baseline_eui) * 100.0 / bl.baseline_eui END,
+                   COALESCE(mc.months_covered, 0)
+            FROM (
+                SELECT espmid, year, {fuel_sums}SUM(kbtu) AS site_kbtu, SUM(cost) AS cost
+                FROM energy_rollup
+                GROUP BY espmid, year
+            ) r
+            JOIN ESPMFIRSTTEST b ON b.espmid = r.espmid
+            LEFT JOIN {baselines} bl ON bl.usetype = b.usetype
+            LEFT JOIN (
+                SELECT espmid, year, COUNT(DISTINCT month) AS months_covered
+                FROM energy_monthly
+                GROUP BY espmid, year
+            ) mc ON mc.espmid = r.espmid AND mc.year = r.year
+        """)
+        rows_written = cursor.rowcount
+        cursor.execute(f"DROP TABLE {baselines}")
+        connection.commit()
+        return rows_written
+
+    try:
+        rows_written = db.run(refresh, 'building metrics refresh')
+        print(f"Refreshed building_metrics ({rows_written} building-years).")
+    except storage.Error as e:
+        print(f"Error refreshing building_metrics: {e}")
+
+
+def ensure_peer_tables():
+    """
+    Create the peer benchmarking tables if needed. Peer groups are a building's use type and its category
+    (BUILDING_CATEGORIES), per year.
+
+    peer_benchmarks has the EUI distribution of each peer group. peer_percentiles holds each building's place
+    in its groups, keyed by building so a page reads it with one lookup.
+    """
+    connection, cursor = db.current()
+    quantile_columns = "".join(f"eui_{suffix} FLOAT, " for suffix in PEER_QUANTILES)
+    storage.create_table_if_missing(cursor, 'peer_benchmarks', f"""
+        peer_type NVARCHAR(20) NOT NULL,
+        peer_group NVARCHAR(100) NOT NULL,
+        year INT NOT NULL,
+        building_count INT NOT NULL,
+        eui_min FLOAT,
+        {quantile_columns}eui_max FLOAT,
+        eui_mean FLOAT,
+        PRIMARY KEY (peer_type, peer_group, year)
+    """)
+    storage.create_table_if_missing(cursor, 'peer_percentiles', """
+        espmid INT NOT NULL,
+        year INT NOT NULL,
+        peer_type NVARCHAR(20) NOT NULL,
+        peer_group NVARCHAR(100) NOT NULL,
+        eui FLOAT,
+        percentile FLOAT,
+        peer_count INT NOT NULL,
+        PRIMARY KEY (espmid, year, peer_type)
+    """)
+    db.commit()
+
+
+def refresh_peer_benchmarks():
+    """
+    Recompute peer_benchmarks and peer_percentiles from building_metrics and the buildings' use types. Only
+    complete building-years (all 12 months covered) are ranked: a few months of the current year would make
+    every building look more efficient than it is, and buildings billed to different dates unevenly so.
+    """
+    def refresh(connection, cursor):
+        cursor.execute("""
+            SELECT m.espmid, m.year, b.usetype, m.eui
+            FROM building_metrics m
+            JOIN ESPMFIRSTTEST b ON b.espmid = m.espmid
+            WHERE m.eui > 0 AND m.months_covered = 12
+        """)
+        building_euis = pd.DataFrame.from_records(
+            [tuple(row) for row in cursor.fetchall()], columns=['espmid', 'year', 'usetype', 'eui']
+        )
+        benchmarks, percentiles = compute_peer_benchmarks(building_euis)
+
+        quantile_columns = "".join(f"eui_{suffix}, " for suffix in PEER_QUANTILES)
+        cursor.execute("DELETE FROM peer_benchmarks")
+        cursor.execute("DELETE FROM peer_percentiles")
+        if len(benchmarks):
+            cursor.executemany(
+                f"INSERT INTO peer_benchmarks (peer_type, peer_group, year, building_count, eui_min, {quantile_columns}eui_max, eui_mean) "
+                f"VALUES ({', '.join('?' * benchmarks.shape[1])})",
+                db_rows(benchmarks)
+            )
+            cursor.executemany(
+                "INSERT INTO peer_percentiles (espmid, year, peer_type, peer_group, eui, percentile, peer_count) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                db_rows(percentiles)
+            )
+        connection.commit()
+        return len(benchmarks), len(percentiles)
+
+    try:
+        group_count, building_count = db.run(refresh, 'peer benchmark refresh')
+        print(f"Refreshed peer benchmarks ({group_count} peer group-years, {building_count} building percentiles).")
+    except storage.Error as e:
+        print(f"Error refreshing peer benchmarks: {e}")
+
+
+def ensure_weather_normalized_table():
+    connection, cursor = db.current()
+    storage.create_table_if_missing(cursor, 'weather_normalized', """
+        espmid INT NOT NULL,
+        year INT NOT NULL,
+        fuel NVARCHAR(50) NOT NULL,
+        kbtu FLOAT,
+        normalized_kbtu FLOAT,
+        r_squared FLOAT,
+        PRIMARY KEY (espmid, year, fuel)
+    """)
+    db.commit()
+
+
+def refresh_weather_normalization():
+    """
+    Recompute weather_normalized (keyed like energy_rollup) for every building from energy_monthly and the
+    degree days in DEGREE_DAYS_PATH. Everything is refitted each run, since new degree-day rows shift the
+    normals. Skipped, leaving the table as it is, while the degree-day file is empty; the file ships with only
+    its header, so a deployment warns every run until it's filled in (see data/README.md).
+    """
+    degree_days = load_degree_days(DEGREE_DAYS_PATH)
+    if degree_days.empty:
+        print(f"Warning: No degree-day data in {DEGREE_DAYS_PATH}, so weather normalization is skipped and the "
+              f"dashboard shows no weather-normalized EUI. Add monthly HDD/CDD for a nearby station (see data/README.md).")
+        return
+
+    def refresh(connection, cursor):
+        cursor.execute("SELECT espmid, fuel, year, month, kbtu FROM energy_monthly")
+        monthly = pd.DataFrame.from_records(
+            [tuple(row) for row in cursor.fetchall()], columns=['espmid', 'fuel', 'year', 'month', 'kbtu']
+        )
+        normalized = normalize(monthly, degree_days)
+        cursor.execute("DELETE FROM weather_normalized")
+        if len(normalized):
+            cursor.executemany(
+                "INSERT INTO weather_normalized (espmid, year, fuel, kbtu, normalized_kbtu, r_squared) VALUES (?, ?, ?, ?, ?, ?)",
+                db_rows(normalized)
+            )
+        connection.commit()
+        return len(normalized)
+
     try:
-        # Try to alter the entryid column to be larger (if table exists)
-        cursor.execute("ALTER TABLE electric ALTER COLUMN entryid NVARCHAR(100)")
+        rows_written = db.run(refresh, 'weather normalization')
+        print(f"Weather-normalized {rows_written} building-fuel-years against {len(degree_days)} months of degree days.")
+        if not rows_written:
+            print(f"Warning: Degree days in {DEGREE_DAYS_PATH} don't give every calendar month a normal or don't cover "
+                  f"any full year of meter data, so nothing was weather-normalized.")
+    except storage.Error as e:
+        print(f"Error refreshing weather normalization: {e}")
+
+
+def ensure_emissions_table():
+    connection, cursor = db.current()
+    storage.create_table_if_missing(cursor, 'emissions', """
+        espmid INT NOT NULL,
+        year INT NOT NULL,
+        fuel NVARCHAR(50) NOT NULL,
+        usage FLOAT,
+        kg_co2e FLOAT,
+        PRIMARY KEY (espmid, year, fuel)
+    """)
+    db.commit()
+
+
+def refresh_emissions():
+    """
+    Recompute the emissions table (keyed like energy_rollup, solar negative) for every building and year in one
+    statement: annual usage from energy_rollup times that year's factor from EMISSION_FACTORS_PATH. A year
+    without its own factor uses the nearest one (see factors_by_year), and the log says which; a fuel with no
+    factor at all gets no rows and a warning. Skipped, leaving the table as it is, while the factor file is empty.
+    """
+    factors = load_emission_factors(EMISSION_FACTORS_PATH)
+    if factors.empty:
+        print(f"Warning: No emission factors in {EMISSION_FACTORS_PATH}, skipping emissions.")
+        return
+
+    def refresh(connection, cursor):
+        cursor.execute("SELECT DISTINCT year FROM energy_rollup")
+        year_factors = factors_by_year(factors, [row[0] for row in cursor.fetchall()])
+        missing, fallbacks = describe_factors(year_factors)
+        for fuel, factor_year, first_year, last_year in fallbacks:
+            years = str(first_year) if first_year == last_year else f"{first_year}-{last_year}"
+            print(f"Emission factors: {fuel} {years} uses the {factor_year} factor.")
+        if missing:
+            print(f"Warning: No emission factor for {', '.join(missing)} in {EMISSION_FACTORS_PATH}; "
+                  f"emissions from those fuels aren't computed (see data/README.md).")
+
+        factor_table = storage.staging_table('EmissionFactors')
+        try:
+            cursor.execute(f"DROP TABLE {factor_table}")
+        except storage.Error:
+            pass
+        storage.create_staging_table(cursor, factor_table, "year INT, fuel NVARCHAR(50), kg_co2e_per_unit FLOAT, PRIMARY KEY (year, fuel)")
+        if len(year_factors):
+            cursor.executemany(
+                f"INSERT INTO {factor_table} (year, fuel, kg_co2e_per_unit) VALUES (?, ?, ?)",
+                db_rows(year_factors[['year', 'fuel', 'kg_co2e_per_unit']])
+            )
+
+        cursor.execute("DELETE FROM emissions")
+        cursor.execute(f"""
+            INSERT INTO emissions (espmid, year, fuel, usage, kg_co2e)
+            SELECT r.espmid, r.year, r.fuel, r.usage, r.usage * f.kg_co2e_per_unit
+            FROM energy_rollup r
+            JOIN {factor_table} f ON f.year = r.year AND f.fuel = r.fuel
+        """)
+        rows_written = cursor.rowcount
+        cursor.execute(f"DROP TABLE {factor_table}")
+        connection.commit()
+        return rows_written
+
+    try:
+        rows_written = db.run(refresh, 'emissions refresh')
+        print(f"Refreshed emissions ({rows_written} building-fuel-years).")
+    except storage.Error as e:
+        print(f"Error refreshing emissions: {e}")
+
+
+def bump_data_version():
+    """
+    Record that a refresh finished by bumping the single row in data_version. The dashboard's query cache
+    keys on this number, so pages pick up the new data on their next version check.
+    """
+    connection, cursor = db.current()
+    try:
+        storage.create_table_if_missing(cursor, 'data_version', """
+            id INT PRIMARY KEY,
+            version INT NOT NULL,
+            refreshed_at DATETIME2 NOT NULL
+        """)
+        cursor.execute(storage.bump_version_sql('data_version'))
+        db.commit()
+        print("Bumped dashboard data version.")
+    except storage.Error as e:
+        try:
+            connection.rollback()
+        except:
+            pass
+        print(f"Warning: Could not bump data version, dashboards may serve cached data until it expires: {e}")
+
+
+def ensure_bulk_merge(table_name):
+    """
+    Set up the table-valued-parameter load path for a meter table (see BULK_MODE). Leaves the table on the
+    executemany path if the backend can't do it or the type/procedure can't be created (e.g. no CREATE TYPE permission).
+    """
+    if BULK_MODE != 'tvp' or not storage.supports_bulk_merge:
+        return
+    connection, cursor = db.current()
+    try:
+        storage.ensure_bulk_merge(
+            cursor, table_name, METER_TABLE_COLUMNS, 'entryid', METER_VALUE_COLUMNS,
+            float_columns=('usage',), output_column='espmid'
+        )
+        db.commit()
+        bulk_merge_tables.add(table_name)
+    except storage.Error as e:
+        try:
+            connection.rollback()
+        except:
+            pass
+        print(f"Warning: Could not set up bulk merge for {table_name}, staging with executemany instead: {e}")
+
+
+def bulk_merge_meter_data(cursor, table_name, insert_data):
+    """
+    Send rows to a meter table's merge procedure as one table-valued parameter.
+
+    Returns:
+        list of the espmid of every inserted or updated row
+    """
+    cursor.execute(storage.bulk_merge_call(table_name), (insert_data,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def merge_meter_data(table_name, insert_data):
+    """
+    Upsert (entryid, espmid, meterid, cost, usage, startdate, enddate) rows into a meter table on the calling
+    thread's connection, retrying the whole load under the shared retry policy if the connection drops.
+    Tables set up by ensure_bulk_merge() get the rows as one table-valued parameter; otherwise they are
+    staged into a temp table in batches and merged from there.
+
+    Returns:
+        (rows inserted or updated, set of espmids those rows belong to)
+    """
+    temp_table = storage.staging_table(f"Temp_{table_name}")
+
+    def load(connection, cursor):
+        if table_name in bulk_merge_tables:
+            # One round trip for the whole flush
+            with metrics.stage('merge'):
+                touched_espmids = bulk_merge_meter_data(cursor, table_name, insert_data)
+            connection.commit()
+            return touched_espmids
+
+        try:
+            cursor.execute(f"DROP TABLE {temp_table}")
+        except:
+            pass
+        storage.create_staging_table(cursor, temp_table, METER_TABLE_COLUMNS)
         try:
+            # Insert in batches of 1000 to reduce transaction time
+            temp_insert_query = f"""
+                INSERT INTO {temp_table} (entryid, espmid, meterid, cost, usage, startdate, enddate)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """
+            batch_size = 1000
+            with metrics.stage('staging_insert'):
+                for i in range(0, len(insert_data), batch_size):
+                    cursor.executemany(temp_insert_query, insert_data[i:i + batch_size])
+
+            # Insert new rows or update rows whose values changed
+            with metrics.stage('merge'):
+                cursor.execute(storage.upsert_sql(table_name, temp_table, ('entryid',), METER_VALUE_COLUMNS, output_column='espmid'))
+
+                # One output row per inserted or updated row
+                touched_espmids = [row[0] for row in cursor.fetchall()]
             connection.commit()
-        except pyodbc.Error as commit_error:
-            if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                connection, cursor = check_and_reconnect()
-                connection.commit()
-            else:
-                raise
-        print("Updated 'entryid' column size in electric table.")
-    except pyodbc.Error as alter_error:
-        error_str = str(alter_error).lower()
-        if "does not exist" in error_str or "invalid object" in error_str:
-            # Table doesn't exist, create it
-            try:
-                cursor.execute("""
-                    CREATE TABLE electric (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'electric' created successfully!")
-            except pyodbc.Error as create_error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                print(f"Error creating electric table: {create_error}")
-        else:
-            # Column might already be the right size, or other error
-            connection.rollback()
-            # Try to create table if it doesn't exist (in case of different error)
+            return touched_espmids
+        finally:
+            # Clean up the temp table whether or not the load made it
             try:
-                cursor.execute("""
-                    CREATE TABLE electric (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'electric' created successfully!")
-            except pyodbc.Error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                # Table likely exists with wrong column size, let's try to fix it
+                cursor.execute(f"DROP TABLE {temp_table}")
+            except:
                 pass
+
+    try:
+        touched_espmids = db.run(load, f"{table_name} data insertion")
+    except storage.Error as e:
+        print(f"Error updating {table_name} data: {e}")
+        raise
+    rows_affected = len(touched_espmids)
+    print(f"Successfully processed {rows_affected} rows in {table_name} table.")
+    return rows_affected, set(touched_espmids)
+
+
+##Establish Database Columns 
+run_status = 'failed'
+try:
+    # This thread's pooled connection (cursor with fast_executemany on SQL Server for better performance)
+    print(f'Connecting to {storage.name}...')
+    connection, cursor = db.current()
+    print('Connection Successful')
+
+    # Define the CREATE TABLE SQL query
+    create_table_query = """
+    CREATE TABLE ESPMFIRSTTEST (
+        espmid INT PRIMARY KEY,
+        buildingname NVARCHAR(100),
+        sqfootage DECIMAL(18,2),
+        address NVARCHAR(100),
+        occupancy INT,
+        numbuildings INT,
+        usetype NVARCHAR(100)
+    )
+    """
     
-    # Ensure solar table exists and has correct column sizes
-    connection, cursor = check_and_reconnect()
+    # Execute the query
     try:
-        # Try to alter the entryid column to be larger (if table exists)
-        cursor.execute("ALTER TABLE solar ALTER COLUMN entryid NVARCHAR(100)")
-        try:
-            connection.commit()
-        except pyodbc.Error as commit_error:
-            if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                connection, cursor = check_and_reconnect()
+        cursor.execute(create_table_query)
+        print("Table 'espm basics' created successfully!")
+        connection.commit()
+    except storage.Error as create_error:
+        # Table might already exist, that's okay
+        if "already exists" in str(create_error).lower() or "There is already an object" in str(create_error):
+            print("Table 'ESPM basics' already exists (or creation failed), continuing...")
+            connection.rollback()
+            
+            # Add new columns if they don't exist (for existing tables)
+            try:
+                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD occupancy INT")
+                print("Added 'occupancy' column to ESPMFIRSTTEST table.")
                 connection.commit()
-            else:
-                raise
-        print("Updated 'entryid' column size in solar table.")
-    except pyodbc.Error as alter_error:
-        error_str = str(alter_error).lower()
-        if "does not exist" in error_str or "invalid object" in error_str:
-            # Table doesn't exist, create it
+            except storage.Error as e:
+                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
+                    pass  # Column already exists
+                else:
+                    print(f"Warning: Could not add 'occupancy' column: {e}")
+            
             try:
-                cursor.execute("""
-                    CREATE TABLE solar (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'solar' created successfully!")
-            except pyodbc.Error as create_error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                print(f"Error creating solar table: {create_error}")
-        else:
-            # Column might already be the right size, or other error
-            connection.rollback()
-            # Try to create table if it doesn't exist (in case of different error)
+                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD numbuildings INT")
+                print("Added 'numbuildings' column to ESPMFIRSTTEST table.")
+                connection.commit()
+            except storage.Error as e:
+                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
+                    pass  # Column already exists
+                else:
+                    print(f"Warning: Could not add 'numbuildings' column: {e}")
+            
             try:
-                cursor.execute("""
-                    CREATE TABLE solar (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    if 'communication link failure' in str(commit_error).lower() or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        connection.commit()
-                    else:
-                        raise
-                print("Table 'solar' created successfully!")
-            except pyodbc.Error:
-                try:
-                    connection.rollback()
-                except:
-                    pass
-                # Table likely exists with wrong column size, let's try to fix it
-                pass
+                cursor.execute("ALTER TABLE ESPMFIRSTTEST ADD usetype NVARCHAR(100)")
+                print("Added 'usetype' column to ESPMFIRSTTEST table.")
+                connection.commit()
+            except storage.Error as e:
+                if "duplicate column name" in str(e).lower() or "already exists" in str(e).lower():
+                    pass  # Column already exists
+                else:
+                    print(f"Warning: Could not add 'usetype' column: {e}")
+        else:
+            raise  # Re-raise if it's a different error
+
+    # Convert text columns left over from the original schema to numeric types
+    migrate_numeric_columns('ESPMFIRSTTEST')
+
+    # Documents seen on earlier runs, so unchanged ones can be skipped
+    ensure_sync_state_table()
+    sync_state = SyncState(load_sync_state())
+
+    # Pick up an unfinished run where it stopped, or start a new one
+    ensure_ingest_run_tables()
+    ingest_run_id, completed_espmids, properties_done = start_ingest_run()
+
+
+#Pull All ESPM ID's and input them into database
+    with metrics.stage('property_list'):
+        idlist=[]
+        response = espm_get(f'/account/{ESPM_ACCOUNT_ID}/property/list')
+        dict_data = xmltodict.parse(response.content)
+        print("This is the meter list info")
+        for entry in dict_data['response']['links']['link']:
+            idlist.append(entry['@id'])
     
-    # Insert gas data into database
-    if gasdata:
-        # Remove duplicates based on entryid before processing
-        # Keep only the first occurrence of each unique entryid
-        seen_entryids = set()
-        unique_gasdata = []
-        duplicates_removed = 0
-        for gas in gasdata:
-            entryid = gas.get('entryid')
-            if entryid and entryid not in seen_entryids:
-                seen_entryids.add(entryid)
-                unique_gasdata.append(gas)
-            elif not entryid:
-                # Skip entries with None entryid (shouldn't happen with our fix, but just in case)
-                duplicates_removed += 1
-                print(f"Warning: Found entry with None entryid, skipping. Meter: {gas.get('meterid')}, ESPMID: {gas.get('espmid')}")
-            else:
-                duplicates_removed += 1
-                print(f"Warning: Duplicate entryid found: {entryid}. Skipping duplicate entry.")
-        
-        if duplicates_removed > 0:
-            print(f"Removed {duplicates_removed} duplicate entries from gasdata.")
-        
-        gasdata = unique_gasdata
+        # Mass insert/update espmid values using optimized bulk insert
+        # Convert idlist items to integers (they come as strings from XML)
+        idlist_int = [int(id_val) for id_val in idlist]
+    
+        if not idlist_int:
+            print("No IDs to insert.")
+        else:
+            print(f"Processing {len(idlist_int)} ESPM IDs...")
         
-        max_retries = 3
-        for attempt in range(max_retries):
+            #Merge using temp table - PUT espm ID's into new table and check vs existing one
+            connection, cursor = db.current()
             try:
-                # Check connection before starting
-                connection, cursor = check_and_reconnect()
-                try:
-                    cursor.execute("DROP TABLE #TempGasData")
-                except:
-                    pass
-                # Create temporary table with all gas data
-                cursor.execute("""
-                    CREATE TABLE #TempGasData (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                
-                # Insert all gas data into temp table in batches to avoid long transactions
-                temp_insert_query = """
-                    INSERT INTO #TempGasData (entryid, espmid, meterid, cost, usage, startdate, enddate) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """
-                insert_data = [
-                    (
-                        gas['entryid'],
-                        gas['espmid'],
-                        gas['meterid'],
-                        gas['cost'],
-                        gas['usage'],
-                        gas['startdate'],
-                        gas['enddate']
-                    )
-                    for gas in gasdata
-                ]
-                
-                # Insert in batches of 1000 to reduce transaction time
-                batch_size = 1000
-                for i in range(0, len(insert_data), batch_size):
-                    batch = insert_data[i:i + batch_size]
-                    cursor.executemany(temp_insert_query, batch)
-                
-                # Use MERGE to insert or update gas data
-                merge_query = """
-                    MERGE naturalgas AS target
-                    USING #TempGasData AS source
-                    ON target.entryid = source.entryid
-                    WHEN MATCHED AND (
-                        ISNULL(target.espmid, 0) <> ISNULL(source.espmid, 0) OR
-                        ISNULL(target.meterid, '') <> ISNULL(source.meterid, '') OR
-                        ISNULL(target.cost, '') <> ISNULL(source.cost, '') OR
-                        ISNULL(target.usage, '') <> ISNULL(source.usage, '') OR
-                        target.startdate <> source.startdate OR
-                        target.enddate <> source.enddate
-                    ) THEN
-                        UPDATE SET
-                            espmid = source.espmid,
-                            meterid = source.meterid,
-                            cost = source.cost,
-                            usage = source.usage,
-                            startdate = source.startdate,
-                            enddate = source.enddate
-                    WHEN NOT MATCHED THEN
-                        INSERT (entryid, espmid, meterid, cost, usage, startdate, enddate)
-                        VALUES (source.entryid, source.espmid, source.meterid, source.cost, source.usage, source.startdate, source.enddate);
-                """
-                cursor.execute(merge_query)
-                
-                # Get count of affected rows
-                cursor.execute("SELECT @@ROWCOUNT")
-                rows_affected = cursor.fetchone()[0]
-                
-                # Commit with retry
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    error_str = str(commit_error).lower()
-                    if 'communication link failure' in error_str or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        # Retry commit
-                        connection.commit()
-                    else:
-                        raise
-                
-                # Drop temp table
-                try:
-                    cursor.execute("DROP TABLE #TempGasData")
-                except:
-                    pass
-                
-                print(f"Successfully processed {rows_affected} rows in naturalgas table.")
-                break  # Success, exit retry loop
-                
-            except pyodbc.Error as e:
-                error_str = str(e).lower()
+                # Create temporary table
+                temp_espmids = storage.staging_table('TempESPMIDs')
+                storage.create_staging_table(cursor, temp_espmids, "espmid INT PRIMARY KEY")
+                # Bulk insert into temp table using fast_executemany (optimized for bulk operations)
+                temp_insert_query = f"INSERT INTO {temp_espmids} (espmid) VALUES (?)"
+                cursor.executemany(temp_insert_query, [(id_val,) for id_val in idlist_int])
+            
+                # Use merge to insert only new ID
+                cursor.execute(storage.upsert_sql('ESPMFIRSTTEST', temp_espmids, ('espmid',), ()))
+            
+                # Get count of inserted rows (MERGE returns affected rows)
+                rows_inserted = cursor.rowcount
+            
+                connection.commit()
+            
+                # Drop temp table (in finally block to ensure cleanup)
+            
+                print(f"Successfully processed {len(idlist_int)} ESPM IDs. {rows_inserted} new IDs inserted.")
+            
+            except storage.Error as e:
                 # Ensure temp table is cleaned up
                 try:
-                    cursor.execute("DROP TABLE #TempGasData")
+                    cursor.execute(f"DROP TABLE {temp_espmids}")
                 except:
                     pass
+            
+                # Fallback: If MERGE fails, try direct insert with error handling
+                print(f"MERGE approach failed, trying alternative method: {e}")
+                connection.rollback()
+            
+                try:
+                    # Try using INSERT with error handling - batch in chunks for better performance
+                    batch_size = 1000  # Process in batches to avoid memory issues
+                    insert_query = "INSERT INTO ESPMFIRSTTEST (espmid) VALUES (?)"
                 
-                # Check if it's a connection error
-                if ('communication link failure' in error_str or '08S01' in str(e) or 
-                    'connection' in error_str or 'timeout' in error_str):
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        print(f"Connection error during gas data insertion. Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
-                        # Reconnect for next attempt
-                        try:
-                            connection.rollback()
-                        except:
-                            pass
-                        connection, cursor = check_and_reconnect()
-                        continue
-                    else:
-                        print(f"Error updating gas data after {max_retries} attempts: {e}")
+                    total_inserted = 0
+                    for i in range(0, len(idlist_int), batch_size):
+                        batch = idlist_int[i:i + batch_size]
                         try:
+                            cursor.executemany(insert_query, [(id_val,) for id_val in batch])
+                            total_inserted += len(batch)
+                        except storage.IntegrityError:
+                            # Some IDs in this batch exist, insert individually
                             connection.rollback()
-                        except:
-                            pass
-                        raise
-                else:
-                    # Not a connection error, re-raise immediately
-                    print(f"Error updating gas data: {e}")
-                    try:
-                        connection.rollback()
-                    except:
-                        pass
-                    raise
-    else:
-        print("No gas data to insert.")
-    
-    # Insert electric data into database
-    if electricdata:
-        # Remove duplicates based on entryid before processing
-        # Keep only the first occurrence of each unique entryid
-        seen_entryids = set()
-        unique_electricdata = []
-        duplicates_removed = 0
-        for electric in electricdata:
-            entryid = electric.get('entryid')
-            if entryid and entryid not in seen_entryids:
-                seen_entryids.add(entryid)
-                unique_electricdata.append(electric)
-            elif not entryid:
-                # Skip entries with None entryid (shouldn't happen with our fix, but just in case)
-                duplicates_removed += 1
-                print(f"Warning: Found entry with None entryid, skipping. Meter: {electric.get('meterid')}, ESPMID: {electric.get('espmid')}")
-            else:
-                duplicates_removed += 1
-                print(f"Warning: Duplicate entryid found: {entryid}. Skipping duplicate entry.")
-        
-        if duplicates_removed > 0:
-            print(f"Removed {duplicates_removed} duplicate entries from electricdata.")
-        
-        electricdata = unique_electricdata
-        
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                # Check connection before starting
-                connection, cursor = check_and_reconnect()
-                try:
-                    cursor.execute("DROP TABLE #TempElectricData")
-                except:
-                    pass
-                # Create temporary table with all electric data
-                cursor.execute("""
-                    CREATE TABLE #TempElectricData (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
-                """)
-                
-                # Insert all electric data into temp table in batches to avoid long transactions
-                temp_insert_query = """
-                    INSERT INTO #TempElectricData (entryid, espmid, meterid, cost, usage, startdate, enddate) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """
-                insert_data = [
-                    (
-                        electric['entryid'],
-                        electric['espmid'],
-                        electric['meterid'],
-                        electric['cost'],
-                        electric['usage'],
-                        electric['startdate'],
-                        electric['enddate']
-                    )
-                    for electric in electricdata
-                ]
-                
-                # Insert in batches of 1000 to reduce transaction time
-                batch_size = 1000
-                for i in range(0, len(insert_data), batch_size):
-                    batch = insert_data[i:i + batch_size]
-                    cursor.executemany(temp_insert_query, batch)
-                
-                # Use MERGE to insert or update electric data
-                merge_query = """
-                    MERGE electric AS target
-                    USING #TempElectricData AS source
-                    ON target.entryid = source.entryid
-                    WHEN MATCHED AND (
-                        ISNULL(target.espmid, 0) <> ISNULL(source.espmid, 0) OR
-                        ISNULL(target.meterid, '') <> ISNULL(source.meterid, '') OR
-                        ISNULL(target.cost, '') <> ISNULL(source.cost, '') OR
-                        ISNULL(target.usage, '') <> ISNULL(source.usage, '') OR
-                        target.startdate <> source.startdate OR
-                        target.enddate <> source.enddate
-                    ) THEN
-                        UPDATE SET
-                            espmid = source.espmid,
-                            meterid = source.meterid,
-                            cost = source.cost,
-                            usage = source.usage,
-                            startdate = source.startdate,
-                            enddate = source.enddate
-                    WHEN NOT MATCHED THEN
-                        INSERT (entryid, espmid, meterid, cost, usage, startdate, enddate)
-                        VALUES (source.entryid, source.espmid, source.meterid, source.cost, source.usage, source.startdate, source.enddate);
-                """
-                cursor.execute(merge_query)
-                
-                # Get count of affected rows
-                cursor.execute("SELECT @@ROWCOUNT")
-                rows_affected = cursor.fetchone()[0]
-                
-                # Commit with retry
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    error_str = str(commit_error).lower()
-                    if 'communication link failure' in error_str or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        # Retry commit
-                        connection.commit()
-                    else:
-                        raise
-                
-                # Drop temp table
-                try:
-                    cursor.execute("DROP TABLE #TempElectricData")
-                except:
-                    pass
-                
-                print(f"Successfully processed {rows_affected} rows in electric table.")
-                break  # Success, exit retry loop
+                            for id_val in batch:
+                                try:
+                                    cursor.execute(insert_query, (id_val,))
+                                    total_inserted += 1
+                                except storage.IntegrityError:
+                                    pass  # ID already exists, skip
+                            connection.commit()
+                        else:
+                            connection.commit()
                 
-            except pyodbc.Error as e:
-                error_str = str(e).lower()
-                # Ensure temp table is cleaned up
-                try:
-                    cursor.execute("DROP TABLE #TempElectricData")
-                except:
-                    pass
+                    print(f"Inserted {total_inserted} new ESPM IDs. {len(idlist_int) - total_inserted} IDs already existed.")
                 
-                # Check if it's a connection error
-                if ('communication link failure' in error_str or '08S01' in str(e) or 
-                    'connection' in error_str or 'timeout' in error_str):
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        print(f"Connection error during electric data insertion. Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
-                        # Reconnect for next attempt
-                        try:
-                            connection.rollback()
-                        except:
-                            pass
-                        connection, cursor = check_and_reconnect()
-                        continue
-                    else:
-                        print(f"Error updating electric data after {max_retries} attempts: {e}")
-                        try:
-                            connection.rollback()
-                        except:
-                            pass
-                        raise
-                else:
-                    # Not a connection error, re-raise immediately
-                    print(f"Error updating electric data: {e}")
-                    try:
-                        connection.rollback()
-                    except:
-                        pass
-                    raise
-    else:
-        print("No electric data to insert.")
+                except storage.Error as fallback_error:
+                    print(f"Error inserting ESPM IDs: {fallback_error}")
+                    connection.rollback()
+
     
-    # Insert solar data into database
-    if solardata:
-        # Remove duplicates based on entryid before processing
-        # Keep only the first occurrence of each unique entryid
-        seen_entryids = set()
-        unique_solardata = []
-        duplicates_removed = 0
-        for solar in solardata:
-            entryid = solar.get('entryid')
-            if entryid and entryid not in seen_entryids:
-                seen_entryids.add(entryid)
-                unique_solardata.append(solar)
-            elif not entryid:
-                # Skip entries with None entryid (shouldn't happen with our fix, but just in case)
-                duplicates_removed += 1
-                print(f"Warning: Found entry with None entryid, skipping. Meter: {solar.get('meterid')}, ESPMID: {solar.get('espmid')}")
-            else:
-                duplicates_removed += 1
-                print(f"Warning: Duplicate entryid found: {entryid}. Skipping duplicate entry.")
-        
-        if duplicates_removed > 0:
-            print(f"Removed {duplicates_removed} duplicate entries from solardata.")
-        
-        solardata = unique_solardata
-        
-        max_retries = 3
-        for attempt in range(max_retries):
+
+    # For each ESPM id, iterate through and pull specific data
+    # data we need - sq footage,name,postal code,primary use type, gas data, electric data,water data,year built,#buildings # stories,, Migreenpower    
+    # Collect all property data first (fetched concurrently, kept in idlist order)
+    if properties_done:
+        print("Property details were already loaded by this run, skipping to meters.")
+        property_data = []
+    else:
+        with metrics.stage('property_details'):
+            property_data = [prop for prop in iter_concurrently(fetch_property_details, idlist) if prop]
+
+    with metrics.stage('property_merge'):
+        # Create temp table and perform bulk update if we have data
+        if property_data:
+            # The connection sat idle while details were fetched, so this is where it gets checked
+            connection, cursor = db.current()
             try:
-                # Check connection before starting
-                connection, cursor = check_and_reconnect()
-                try:
-                    cursor.execute("DROP TABLE #TempSolarData")
-                except:
-                    pass
-                # Create temporary table with all solar data
-                cursor.execute("""
-                    CREATE TABLE #TempSolarData (
-                        entryid NVARCHAR(100) PRIMARY KEY,
-                        espmid INT,
-                        meterid NVARCHAR(100),
-                        cost NVARCHAR(100),
-                        usage NVARCHAR(100),
-                        startdate SMALLDATETIME,
-                        enddate SMALLDATETIME
-                    )
+                # Create temporary table with all property data
+                temp_property_data = storage.staging_table('TempPropertyData')
+                storage.create_staging_table(cursor, temp_property_data, """
+                    espmid INT PRIMARY KEY,
+                    buildingname NVARCHAR(100),
+                    sqfootage DECIMAL(18,2),
+                    address NVARCHAR(100),
+                    occupancy INT,
+                    numbuildings INT,
+                    usetype NVARCHAR(100)
                 """)
-                
-                # Insert all solar data into temp table in batches to avoid long transactions
-                temp_insert_query = """
-                    INSERT INTO #TempSolarData (entryid, espmid, meterid, cost, usage, startdate, enddate) 
+            
+                # Insert all property data into temp table
+                temp_insert_query = f"""
+                    INSERT INTO {temp_property_data} (espmid, buildingname, sqfootage, address, occupancy, numbuildings, usetype) 
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 """
                 insert_data = [
                     (
-                        solar['entryid'],
-                        solar['espmid'],
-                        solar['meterid'],
-                        solar['cost'],
-                        solar['usage'],
-                        solar['startdate'],
-                        solar['enddate']
+                        prop['espmid'],
+                        prop['name'],
+                        prop['gfa'],
+                        prop['address'],
+                        prop['occupancy'],
+                        prop['numbuildings'],
+                        prop['usetype']
                     )
-                    for solar in solardata
+                    for prop in property_data
                 ]
-                
-                # Insert in batches of 1000 to reduce transaction time
-                batch_size = 1000
-                for i in range(0, len(insert_data), batch_size):
-                    batch = insert_data[i:i + batch_size]
-                    cursor.executemany(temp_insert_query, batch)
-                
-                # Use MERGE to insert or update solar data
-                merge_query = """
-                    MERGE solar AS target
-                    USING #TempSolarData AS source
-                    ON target.entryid = source.entryid
-                    WHEN MATCHED AND (
-                        ISNULL(target.espmid, 0) <> ISNULL(source.espmid, 0) OR
-                        ISNULL(target.meterid, '') <> ISNULL(source.meterid, '') OR
-                        ISNULL(target.cost, '') <> ISNULL(source.cost, '') OR
-                        ISNULL(target.usage, '') <> ISNULL(source.usage, '') OR
-                        target.startdate <> source.startdate OR
-                        target.enddate <> source.enddate
-                    ) THEN
-                        UPDATE SET
-                            espmid = source.espmid,
-                            meterid = source.meterid,
-                            cost = source.cost,
-                            usage = source.usage,
-                            startdate = source.startdate,
-                            enddate = source.enddate
-                    WHEN NOT MATCHED THEN
-                        INSERT (entryid, espmid, meterid, cost, usage, startdate, enddate)
-                        VALUES (source.entryid, source.espmid, source.meterid, source.cost, source.usage, source.startdate, source.enddate);
-                """
-                cursor.execute(merge_query)
-                
-                # Get count of affected rows
-                cursor.execute("SELECT @@ROWCOUNT")
-                rows_affected = cursor.fetchone()[0]
-                
-                # Commit with retry
-                try:
-                    connection.commit()
-                except pyodbc.Error as commit_error:
-                    error_str = str(commit_error).lower()
-                    if 'communication link failure' in error_str or '08S01' in str(commit_error):
-                        connection, cursor = check_and_reconnect()
-                        # Retry commit
-                        connection.commit()
-                    else:
-                        raise
-                
+                cursor.executemany(temp_insert_query, insert_data)
+            
+                # Use MERGE to update only where values differ
+                cursor.execute(storage.upsert_sql(
+                    'ESPMFIRSTTEST', temp_property_data, ('espmid',),
+                    ('buildingname', 'sqfootage', 'address', 'occupancy', 'numbuildings', 'usetype')
+                ))
+            
+                # Get count of updated rows
+                rows_affected = cursor.rowcount
+            
+                connection.commit()
+            
                 # Drop temp table
-                try:
-                    cursor.execute("DROP TABLE #TempSolarData")
-                except:
-                    pass
-                
-                print(f"Successfully processed {rows_affected} rows in solar table.")
-                break  # Success, exit retry loop
-                
-            except pyodbc.Error as e:
-                error_str = str(e).lower()
+                cursor.execute(f"DROP TABLE {temp_property_data}")
+            
+                print(f"Successfully updated {rows_affected} rows in ESPMFIRSTTEST table.")
+
+                # Only now that they're stored can these property documents be skipped next run
+                save_sync_state([prop['sync_state'] for prop in property_data])
+            
+            except storage.Error as e:
                 # Ensure temp table is cleaned up
                 try:
-                    cursor.execute("DROP TABLE #TempSolarData")
+                    cursor.execute(f"DROP TABLE {temp_property_data}")
                 except:
                     pass
-                
-                # Check if it's a connection error
-                if ('communication link failure' in error_str or '08S01' in str(e) or 
-                    'connection' in error_str or 'timeout' in error_str):
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        print(f"Connection error during solar data insertion. Retrying in {wait_time} seconds... (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(wait_time)
-                        # Reconnect for next attempt
-                        try:
-                            connection.rollback()
-                        except:
-                            pass
-                        connection, cursor = check_and_reconnect()
-                        continue
-                    else:
-                        print(f"Error updating solar data after {max_retries} attempts: {e}")
-                        try:
-                            connection.rollback()
-                        except:
-                            pass
-                        raise
-                else:
-                    # Not a connection error, re-raise immediately
-                    print(f"Error updating solar data: {e}")
-                    try:
-                        connection.rollback()
-                    except:
-                        pass
-                    raise
-    else:
-        print("No solar data to insert.")
+                print(f"Error updating property data: {e}")
+                connection.rollback()
+    # format of new table - espmid,cost,usage,startdate,enddate
+    # query only entries after each meter's stored watermark (minus the look-back window)
+    if not properties_done:
+        mark_properties_done()
+    sync_watermarks = load_sync_watermarks()
+
+    # Make sure every meter table exists, with numeric cost/usage, its read indexes and its bulk-load procedure, before loading
+    for table_name in METER_TABLES:
+        ensure_meter_table(table_name)
+        migrate_numeric_columns(table_name)
+        ensure_meter_indexes(table_name)
+        ensure_bulk_merge(table_name)
+
+    # Properties are fetched concurrently but collected in idlist order, so rows come out the same as a serial
+    # walk. They are deduped as they arrive and flushed to the meter tables every ESPM_FLUSH_ROWS rows, and each
+    # flush checkpoints its properties. Properties a resumed run already checkpointed are skipped.
+    with metrics.stage('meter_sync'):
+        pending_ids = [espmid for espmid in idlist if int(espmid) not in completed_espmids]
+        consumption_store = ConsumptionStore(METER_TABLES)
+        for espmid, (property_rows, new_states) in zip(pending_ids, iter_concurrently(fetch_property_meters, pending_ids)):
+            for table_name, rows in property_rows.items():
+                consumption_store.add_rows(table_name, rows)
+            consumption_store.add_sync_states(new_states)
+            consumption_store.complete_property(espmid)
+            consumption_store.flush_if_full()
+        consumption_store.flush()
+
+    for table_name in METER_TABLES:
+        if consumption_store.duplicates_removed[table_name] > 0:
+            print(f"Removed {consumption_store.duplicates_removed[table_name]} duplicate entries from {table_name} data.")
+        if consumption_store.rows_accepted[table_name]:
+            print(f"Loaded {consumption_store.rows_accepted[table_name]} rows into {table_name} ({consumption_store.rows_affected[table_name]} inserted or updated).")
+        else:
+            print(f"No {table_name} data to insert.")
+        with metrics.stage('index_maintenance'):
+            maintain_meter_indexes(table_name)
+    report_index_usage()
+
+    # Keep the building-year rollup in step with the meter tables, touching only buildings that changed.
+    # What changed before a restart isn't known any more, so every property the resumed run finished is included.
+    with metrics.stage('rollup_refresh'):
+        # A newly created table of either kind needs every building backfilled
+        if ensure_energy_rollup_table() | ensure_energy_monthly_table():
+            refresh_energy_rollup()
+        else:
+            refresh_energy_rollup(consumption_store.touched_espmids | completed_espmids)
+
+    # Rebuild the comparison matrix from the refreshed rollup and the current building details
+    with metrics.stage('building_metrics'):
+        ensure_building_metrics_table()
+        refresh_building_metrics()
+
+    # Annual kBTU under typical weather, next to the rollup
+    with metrics.stage('weather_normalization'):
+        ensure_weather_normalized_table()
+        refresh_weather_normalization()
+
+    # Emissions per building, year and fuel from the rollup
+    with metrics.stage('emissions'):
+        ensure_emissions_table()
+        refresh_emissions()
+
+    # EUI distribution per use type and category, and where each building falls in it
+    with metrics.stage('peer_benchmarks'):
+        ensure_peer_tables()
+        refresh_peer_benchmarks()
+
+    sync_state.report()
+
+    # Tell the dashboard caches there is new data
+    bump_data_version()
+    finish_ingest_run()
+    run_status = 'complete'
 
 
 
@@ -1480,12 +1934,9 @@ try:
 
 except Exception as e:
     print(f"An error occurred: {e}")
-    if connection:
-        connection.rollback()
 finally:
-    # Close the cursor and connection
-    if cursor:
-        cursor.close()
-    if connection:
-        connection.close()
+    # Where the time went, for this run and for comparing runs over releases
+    metrics.write(INGEST_REPORT_PATH, INGEST_PROMETHEUS_PATH, status=run_status)
+    # Roll back anything uncommitted and close every pooled connection
+    db.close_all()
     print("Connection closed.")
\ No newline at end of file
@@ -0,0 +1,140 @@
+# ingest_metrics.py
+# Run instrumentation for full_update.py: time spent per stage, counters (HTTP calls, retries, bytes, rows) and
+# per-endpoint latency histograms. Written at the end of every run as a JSON report, and optionally as
+# Prometheus text exposition (e.g. for node_exporter's textfile collector) so runs can be compared over releases.
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Upper bounds (seconds) of the request latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_ID_PATTERN = re.compile(r'/\d+')
+
+
+def endpoint_name(path):
+    """Collapse a request path to its endpoint, e.g. /meter/123/consumptionData?startDate=... -> /meter/{id}/consumptionData"""
+    return _ID_PATTERN.sub('/{id}', path.split('?', 1)[0])
+
+
+class IngestMetrics:
+    """
+    Thread-safe metrics for one ingest run.
+
+    Stages timed on worker threads (fetching, parsing) add up across threads, so their seconds can exceed
+    the run's wall time; the 'calls' count says how many times each stage ran.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        # stage -> {'seconds': total, 'calls': n}
+        self.stages = {}
+        # (name, sorted label items) -> value
+        self.counters = {}
+        # endpoint -> {'buckets': [count per bucket + Inf], 'sum': seconds, 'count': n}
+        self.latencies = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                stage['seconds'] += elapsed
+                stage['calls'] += 1
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe_request(self, path, seconds, status, nbytes):
+        """Record one Portfolio Manager request: its latency, status and body size."""
+        endpoint = endpoint_name(path)
+        with self.lock:
+            histogram = self.latencies.setdefault(
+                endpoint, {'buckets': [0] * (len(LATENCY_BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+            )
+            bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+            histogram['buckets'][bucket] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+        self.increment('http_requests', endpoint=endpoint, status=str(status))
+        self.increment('http_bytes', nbytes, endpoint=endpoint)
+
+    def report(self, status='complete'):
+        """The run as a JSON-serializable dict."""
+        with self.lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label_text = ",".join(f"{label}={label_value}" for label, label_value in labels)
+                counters[f"{name}{{{label_text}}}" if label_text else name] = value
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'status': status,
+                'wall_seconds': round(time.perf_counter() - self.started, 3),
+                'stages': {name: {'seconds': round(stage['seconds'], 3), 'calls': stage['calls']} for name, stage in self.stages.items()},
+                'counters': counters,
+                'latency': {
+                    endpoint: {
+                        'count': histogram['count'],
+                        'mean_seconds': round(histogram['sum'] / histogram['count'], 4) if histogram['count'] else None,
+                        'buckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram['buckets'])),
+                    }
+                    for endpoint, histogram in self.latencies.items()
+                },
+            }
+
+    def prometheus_text(self, status='complete'):
+        """The run in Prometheus text exposition format."""
+        lines = [
+            '# HELP espm_ingest_wall_seconds Wall time of the last ingest run.',
+            '# TYPE espm_ingest_wall_seconds gauge',
+            f'espm_ingest_wall_seconds{{status="{status}"}} {time.perf_counter() - self.started:.3f}',
+            '# HELP espm_ingest_stage_seconds Time spent per ingest stage (summed across worker threads).',
+            '# TYPE espm_ingest_stage_seconds gauge',
+        ]
+        with self.lock:
+            for name, stage in self.stages.items():
+                lines.append(f'espm_ingest_stage_seconds{{stage="{name}"}} {stage["seconds"]:.3f}')
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE espm_ingest_{name}_total counter')
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+                        lines.append(f'espm_ingest_{name}_total{{{label_text}}} {value}')
+            lines.append('# HELP espm_ingest_request_seconds Portfolio Manager request latency per endpoint.')
+            lines.append('# TYPE espm_ingest_request_seconds histogram')
+            for endpoint, histogram in self.latencies.items():
+                cumulative = 0
+                for bound, count in zip([str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'], histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'espm_ingest_request_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+                lines.append(f'espm_ingest_request_seconds_sum{{endpoint="{endpoint}"}} {histogram["sum"]:.3f}')
+                lines.append(f'espm_ingest_request_seconds_count{{endpoint="{endpoint}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, report_path=None, prometheus_path=None, status='complete'):
+        """
+        Write the JSON report and/or Prometheus text, and print where each stage's time went.
+        """
+        report = self.report(status)
+        print(f"Ingest {status} in {report['wall_seconds']:.1f}s. Time per stage:")
+        for name, stage in sorted(report['stages'].items(), key=lambda item: -item[1]['seconds']):
+            print(f"  {name}: {stage['seconds']:.1f}s over {stage['calls']} calls")
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Wrote ingest report to {report_path}.")
+        if prometheus_path:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.prometheus_text(status))
+            print(f"Wrote Prometheus metrics to {prometheus_path}.")
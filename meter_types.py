@@ -0,0 +1,45 @@
+# meter_types.py
+# Registry of the Portfolio Manager meter types we ingest. full_update.py drives its whole meter pipeline
+# (fetch, parse, dedupe, staging and MERGE) off this dict, so adding a meter type is one new entry here.
+
+KWH_TO_KBTU = 3.412  # 1 kWh = 3.412 kBTU
+THERM_TO_KBTU = 100  # 1 therm = 100 kBTU (also ~1 CCF = 100 kBTU)
+
+# Portfolio Manager meter 'type' string -> where it is stored, how it is labelled and how it counts toward EUI.
+# 'sign' is -1 for generation that offsets site energy (on-site solar). 'emission_factor' names the fuel in
+# data/emission_factors.csv whose factor applies; solar displaces grid electricity, so it nets off at the grid factor.
+METER_TYPES = {
+    'Natural Gas': {
+        'table': 'naturalgas',
+        'label': 'gas',
+        'energy_type': 'Natural Gas',
+        'unit': 'therms',
+        'kbtu_factor': THERM_TO_KBTU,
+        'sign': 1,
+        'emission_factor': 'Natural Gas',
+    },
+    'Electric': {
+        'table': 'electric',
+        'label': 'electric',
+        'energy_type': 'Electric',
+        'unit': 'kWh',
+        'kbtu_factor': KWH_TO_KBTU,
+        'sign': 1,
+        'emission_factor': 'Electric',
+    },
+    'Electric on Site Solar': {
+        'table': 'solar',
+        'label': 'solar',
+        'energy_type': 'Solar',
+        'unit': 'kWh',
+        'kbtu_factor': KWH_TO_KBTU,
+        'sign': -1,
+        'emission_factor': 'Electric',
+    },
+}
+
+# Target tables in registry order
+METER_TABLES = [meter_type['table'] for meter_type in METER_TYPES.values()]
+
+# building_metrics column holding each fuel's annual kBTU, e.g. 'Natural Gas' -> gas_kbtu
+FUEL_KBTU_COLUMNS = {meter_type['energy_type']: f"{meter_type['label']}_kbtu" for meter_type in METER_TYPES.values()}
@@ -0,0 +1,52 @@
+# peer_benchmarks.py
+# EUI distributions per peer group (a building's use type and its category) and each building's percentile
+# within its groups, computed in pandas over every building-year at once for full_update.py to store in
+# peer_benchmarks and peer_percentiles.
+import pandas as pd
+
+from reference_data import UNCATEGORIZED, USETYPE_CATEGORY
+
+# EUI percentiles stored per peer group and year in peer_benchmarks: column suffix -> quantile
+PEER_QUANTILES = {'p10': 0.1, 'p25': 0.25, 'median': 0.5, 'p75': 0.75, 'p90': 0.9}
+
+BENCHMARK_COLUMNS = ['peer_type', 'peer_group', 'year', 'count', 'min'] + list(PEER_QUANTILES) + ['max', 'mean']
+PERCENTILE_COLUMNS = ['espmid', 'year', 'peer_type', 'peer_group', 'eui', 'percentile', 'peer_count']
+
+
+def compute_peer_benchmarks(building_euis):
+    """
+    Group EUI distributions and each building's percentile within its groups, for every year.
+
+    The percentile is the share of the other buildings in the group with a lower EUI (PERCENT_RANK): 0 is the
+    most efficient, 100 the least. It is NULL for a building with no peers that year.
+
+    Args:
+        building_euis: DataFrame of espmid, year, usetype, eui (buildings with a positive EUI)
+
+    Returns:
+        (peer_benchmarks DataFrame, peer_percentiles DataFrame) in the tables' column order; both are empty
+        when there are no buildings
+    """
+    # Rows straight from the database can be Decimal or, with no rows at all, object columns
+    building_euis = building_euis.assign(
+        year=pd.to_numeric(building_euis['year']),
+        eui=pd.to_numeric(building_euis['eui'], errors='coerce').astype(float),
+    ).dropna(subset=['year', 'eui'])
+    if building_euis.empty:
+        return pd.DataFrame(columns=BENCHMARK_COLUMNS), pd.DataFrame(columns=PERCENTILE_COLUMNS)
+
+    peers = pd.concat([
+        building_euis.assign(peer_type='usetype', peer_group=building_euis['usetype']),
+        building_euis.assign(peer_type='category', peer_group=building_euis['usetype'].map(USETYPE_CATEGORY).fillna(UNCATEGORIZED)),
+    ]).dropna(subset=['peer_group'])
+    grouped = peers.groupby(['peer_type', 'peer_group', 'year'])['eui']
+
+    peers['peer_count'] = grouped.transform('count')
+    peers['percentile'] = ((grouped.rank(method='min') - 1) / (peers['peer_count'] - 1) * 100).where(peers['peer_count'] > 1)
+    percentiles = peers[PERCENTILE_COLUMNS]
+
+    benchmarks = grouped.agg(['count', 'min', 'max', 'mean'])
+    quantiles = grouped.quantile(list(PEER_QUANTILES.values())).unstack()
+    quantiles.columns = list(PEER_QUANTILES)
+    benchmarks = benchmarks.join(quantiles).reset_index()
+    return benchmarks[BENCHMARK_COLUMNS], percentiles
@@ -0,0 +1,69 @@
+# query_cache.py
+# Shared query cache for the dashboard pages. Data only changes when full_update.py runs (weekly), so results
+# are kept for the whole refresh cycle and keyed on the data version that full_update.py bumps after each run.
+import threading
+from datetime import timedelta
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from storage import dashboard_sql
+
+# Results live for a full refresh cycle; a new data version makes them unreachable sooner
+CACHE_TTL = timedelta(days=7)
+# How often pages re-read the data version, i.e. the longest a finished refresh can go unseen
+VERSION_CHECK_TTL = timedelta(minutes=5)
+
+
+@st.cache_resource
+def _stats():
+    # Shared across all sessions for the life of the server process
+    return {"lock": threading.Lock(), "calls": 0, "misses": 0}
+
+
+@st.cache_data(ttl=VERSION_CHECK_TTL, show_spinner=False)
+def _data_version(_conn):
+    schema = dashboard_sql(_conn.engine.dialect.name)['schema']
+    try:
+        with _conn.engine.connect() as connection:
+            version = connection.execute(text(f"SELECT [version] FROM {schema}[data_version] WHERE [id] = 1")).scalar()
+    except Exception:
+        # No refresh has recorded a version yet
+        return 0
+    return int(version or 0)
+
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=2000, show_spinner=False)
+def _run_query(_conn, sql, params, version):
+    stats = _stats()
+    with stats["lock"]:
+        stats["misses"] += 1
+    with _conn.engine.connect() as connection:
+        return pd.read_sql_query(text(sql), connection, params=params)
+
+
+def cached_query(conn, sql, params=None):
+    """
+    Run a read-only query through the shared cache. Repeat calls with the same SQL and parameters are served
+    from memory until the next data refresh, so widget interactions don't go back to Azure SQL.
+    """
+    stats = _stats()
+    with stats["lock"]:
+        stats["calls"] += 1
+    return _run_query(conn, sql, params or {}, _data_version(conn))
+
+
+def cache_stats():
+    """
+    Hit/miss counters for cached_query since the server started.
+    """
+    stats = _stats()
+    with stats["lock"]:
+        calls, misses = stats["calls"], stats["misses"]
+    return {
+        "calls": calls,
+        "hits": calls - misses,
+        "misses": misses,
+        "hit_rate": (calls - misses) / calls if calls else 0.0,
+    }
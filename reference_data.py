@@ -0,0 +1,90 @@
+# reference_data.py
+# Static reference tables shared by the ingest (full_update.py) and the dashboard pages.
+
+# Baseline EUI per Portfolio Manager use type, in kBTU/sq ft - is this correct?
+BASELINE_EUI = {
+    "Adult Education": 60,
+    "Bar/Nightclub": 150,
+    "College/University": 100,
+    "Courthouse": 79,
+    "Distribution Center": 50,
+    "Drinking Water Treatment & Distribution": 300,
+    "Energy/Power Station": 100,
+    "Financial Office": 100,
+    "Fire Station": 79,
+    "Fitness Center/Health Club/Gym": 55,
+    "Heated Swimming Pool": 354,
+    "Hotel": 88,
+    "Ice/Curling Rink": 150,
+    "K-12 School": 80,
+    "Laboratory": 50,
+    "Library": 50,
+    "Manufacturing/Industrial Plant": 50,
+    "Mixed Use Property": 50,
+    "Multifamily Housing": 55,
+    "Museum": 50,
+    "Non-Refrigerated Warehouse": 50,
+    "Office": 80,
+    "Other": 40,
+    "Other - Education": 40,
+    "Other - Entertainment/Public Assembly": 40,
+    "Other - Mall": 40,
+    "Other - Public Services": 40,
+    "Other - Recreation": 50,
+    "Other - Restaurant/Bar": 231,
+    "Other - Technology/Science": 50,
+    "Other - Utility": 50,
+    "Personal Services (Health/Beauty, Dry Cleaning, etc.)": 50,
+    "Residence Hall/Dormitory": 125,
+    "Restaurant": 200,
+    "Retail Store": 105,
+    "Single-Family Home": 39,
+    "Social/Meeting Hall": 100,
+    "Strip Mall": 110,
+    "Transportation Terminal/Station": 150,
+    "Worship Facility": 50
+}
+
+# 4 categories of use types: Commercial,City-Owned,Multi-Unit,Institutional. The Portfolio Data pie chart groups
+# square footage by them, and buildings are benchmarked against their category as well as their use type.
+BUILDING_CATEGORIES = {
+    'Commercial': [
+        'Bar/Nightclub', 'Bowling Alley', 'Convenience Store without Gas Station',
+        'Financial Office', 'Fitness Center/Health Club/Gym', 'Food Service',
+        'Hotel', 'Ice/Curling Rink', 'Mixed Use Property', 'Museum', 'Office',
+        'Other - Entertainment/Public Assembly', 'Other - Mall', 'Other - Recreation',
+        'Other - Restaurant/Bar', 'Other - Services', 'Parking',
+        'Personal Services (Health/Beauty, Dry Cleaning, etc)', 'Restaurant',
+        'Retail Store', 'Self-Storage Facility', 'Strip Mall', 'Supermarket/Grocery Store',
+        'Swimming Pool', 'Vehicle Dealership', 'Vehicle Repair Services',
+        'Wholesale Club/Supercenter', 'Other - Lodging/Residential'
+    ],
+    
+    'City-Owned': [
+        'Courthouse', 'Fire Station', 'Library', 'Police Station', 'Prison/Incarceration',
+        'Drinking Water Treatment & Distribution', 'Wastewater Treatment Plant',
+        'Transportation Terminal/Station', 'Other - Public Services', 'Other - Utility'
+    ],
+    
+    'Multi-Unit': [
+        'Multifamily Housing', 'Residence Hall/Dormitory', 'Residential Care Facility',
+        'Senior Living Community'
+    ],
+    
+    'Institutional': [
+        'Adult Education', 'College/University', 'Community Center and Social Meeting Hall',
+        'K-12 School', 'Laboratory', 'Medical Office', 'Other - Education',
+        'Other - Technology/Science', 'Worship Facility', 'Distribution Center',
+        'Energy/Power Station', 'Manufacturing/Industrial Plant',
+        'Non-Refrigerated Warehouse', 'Other'
+    ]
+}
+
+UNCATEGORIZED = 'Uncategorized'
+
+# Use type -> category
+USETYPE_CATEGORY = {
+    usetype: category
+    for category, usetypes in BUILDING_CATEGORIES.items()
+    for usetype in usetypes
+}
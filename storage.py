@@ -0,0 +1,278 @@
+# storage.py
+# Storage backends shared by the ingest (full_update.py) and the dashboard. SQL Server (Azure SQL) is the
+# production store; SQLite keeps the same tables in a local file for offline runs, benchmarking and edge
+# deployments. full_update.py picks one with STORAGE_BACKEND=sqlserver|sqlite (and SQLITE_PATH for the file);
+# the dashboard follows whatever URL [connections.sql] in .streamlit/secrets.toml points at.
+import datetime
+import hashlib
+import os
+import sqlite3
+
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'energy.db')
+
+# Dialect-specific pieces of the dashboard's query text, keyed by SQLAlchemy dialect name
+DASHBOARD_SQL = {
+    'mssql': {'schema': '[dbo].', 'top_1000': 'TOP (1000)', 'limit_1000': '', 'json_values': 'OPENJSON'},
+    'sqlite': {'schema': '', 'top_1000': '', 'limit_1000': 'LIMIT 1000', 'json_values': 'json_each'},
+}
+
+
+class SqlServerStorage:
+    """
+    SQL Server / Azure SQL through pyodbc. Upserts are MERGE statements from #temp staging tables.
+    """
+    name = 'sqlserver'
+    # Index fragmentation and usage DMVs, and in-place column type migrations
+    supports_maintenance = True
+    # Table-valued parameters into per-table merge procedures (ensure_bulk_merge / bulk_merge_call)
+    supports_bulk_merge = True
+    # Separate sessions can MERGE into different tables at the same time
+    supports_concurrent_writes = True
+
+    def __init__(self, connection_string):
+        # Only this backend needs the ODBC driver, so SQLite deployments don't have to install it
+        import pyodbc
+        self.connection_string = connection_string
+        self.Error = pyodbc.Error
+        self.IntegrityError = pyodbc.IntegrityError
+        self.OperationalError = pyodbc.OperationalError
+        self._connect = pyodbc.connect
+
+    def connect(self):
+        return self._connect(self.connection_string)
+
+    def cursor(self, connection):
+        cursor = connection.cursor()
+        # Enable fast_executemany for bulk operations (much faster for large datasets)
+        cursor.fast_executemany = True
+        return cursor
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute("SELECT OBJECT_ID(?, N'U')", (table_name,))
+        return cursor.fetchone()[0] is not None
+
+    def create_table_if_missing(self, cursor, table_name, columns):
+        cursor.execute(f"IF OBJECT_ID(N'{table_name}', N'U') IS NULL CREATE TABLE {table_name} ({columns})")
+
+    def staging_table(self, name):
+        return f"#{name}"
+
+    def create_staging_table(self, cursor, staging_table, columns):
+        cursor.execute(f"CREATE TABLE {staging_table} ({columns})")
+
+    def upsert_sql(self, target, source, key_columns, value_columns, output_column=None):
+        """
+        MERGE source into target on key_columns, inserting new rows and updating rows where any of
+        value_columns differ (NULL-safe, via EXCEPT). With output_column, one row is returned per
+        inserted or updated row holding that column.
+        """
+        columns = list(key_columns) + list(value_columns)
+        join = " AND ".join(f"target.{column} = source.{column}" for column in key_columns)
+        matched = ""
+        if value_columns:
+            matched = f"""
+                WHEN MATCHED AND EXISTS (
+                    SELECT {", ".join(f"source.{column}" for column in value_columns)}
+                    EXCEPT
+                    SELECT {", ".join(f"target.{column}" for column in value_columns)}
+                ) THEN
+                    UPDATE SET {", ".join(f"{column} = source.{column}" for column in value_columns)}"""
+        output = f"\n                OUTPUT inserted.{output_column}" if output_column else ""
+        return f"""
+                MERGE {target} AS target
+                USING {source} AS source
+                ON {join}{matched}
+                WHEN NOT MATCHED THEN
+                    INSERT ({", ".join(columns)})
+                    VALUES ({", ".join(f"source.{column}" for column in columns)}){output};
+            """
+
+    def row_hash_sql(self, alias, columns, float_columns=()):
+        """
+        SHA2-256 over a row's columns, for comparing a whole row in one predicate. Floats are converted
+        with style 3 (17 significant digits) so small revisions aren't rounded away.
+        """
+        values = ", '|', ".join(
+            f"CONVERT(NVARCHAR(100), {alias}.{column}{', 3' if column in float_columns else ''})"
+            for column in columns
+        )
+        return f"HASHBYTES('SHA2_256', CONCAT({values}))"
+
+    def ensure_bulk_merge(self, cursor, table_name, columns, key_column, value_columns, float_columns=(), output_column=None):
+        """
+        Create the table type and merge procedure that bulk_merge_call() uses for a table. Rows arrive as one
+        table-valued parameter instead of a temp table filled by executemany, and changed rows are found by
+        comparing row hashes. The procedure is recreated every run so it always matches the column list here.
+        A table type can't be altered, so the type is dropped (after the procedure that uses it) and recreated
+        whenever its column definitions change; a hash of them is kept on the type as an extended property.
+
+        Args:
+            columns: column definitions for the table type, same as the target table
+        """
+        type_name = f"{table_name}_rows"
+        definition_hash = hashlib.sha256(" ".join(columns.split()).encode()).hexdigest()
+        cursor.execute(
+            "SELECT CAST(value AS NVARCHAR(64)) FROM sys.extended_properties "
+            "WHERE class = 6 AND major_id = TYPE_ID(?) AND name = N'definition_hash'",
+            (f"dbo.{type_name}",)
+        )
+        saved = cursor.fetchone()
+        if saved is None or saved[0] != definition_hash:
+            cursor.execute(f"DROP PROCEDURE IF EXISTS dbo.usp_merge_{table_name}")
+            cursor.execute(f"DROP TYPE IF EXISTS dbo.{type_name}")
+            cursor.execute(f"CREATE TYPE dbo.{type_name} AS TABLE ({columns})")
+            cursor.execute(
+                "EXEC sys.sp_addextendedproperty @name = N'definition_hash', @value = ?, "
+                "@level0type = N'SCHEMA', @level0name = N'dbo', @level1type = N'TYPE', @level1name = ?",
+                (definition_hash, type_name)
+            )
+        all_columns = [key_column] + list(value_columns)
+        output = f"\n                OUTPUT inserted.{output_column}" if output_column else ""
+        cursor.execute(f"""
+            CREATE OR ALTER PROCEDURE dbo.usp_merge_{table_name} @rows dbo.{type_name} READONLY AS
+            BEGIN
+                SET NOCOUNT ON;
+                MERGE {table_name} AS target
+                USING @rows AS source
+                ON target.{key_column} = source.{key_column}
+                WHEN MATCHED AND {self.row_hash_sql('target', value_columns, float_columns)}
+                              <> {self.row_hash_sql('source', value_columns, float_columns)} THEN
+                    UPDATE SET {", ".join(f"{column} = source.{column}" for column in value_columns)}
+                WHEN NOT MATCHED THEN
+                    INSERT ({", ".join(all_columns)})
+                    VALUES ({", ".join(f"source.{column}" for column in all_columns)}){output};
+            END
+        """)
+
+    def bulk_merge_call(self, table_name):
+        # pyodbc sends a list of row tuples bound to the one parameter as a table-valued parameter
+        return f"{{CALL dbo.usp_merge_{table_name} (?)}}"
+
+    def year_sql(self, column):
+        return f"YEAR({column})"
+
+    def create_index_sql(self, index_name, table_name, key_columns, included_columns=None):
+        include_clause = f" INCLUDE ({included_columns})" if included_columns else ""
+        return f"""
+            IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = '{index_name}' AND object_id = OBJECT_ID(N'{table_name}'))
+                CREATE NONCLUSTERED INDEX {index_name} ON {table_name} ({key_columns}){include_clause}
+        """
+
+    def bump_version_sql(self, table_name):
+        return f"""
+            MERGE {table_name} AS target
+            USING (SELECT 1 AS id) AS source
+            ON target.id = source.id
+            WHEN MATCHED THEN
+                UPDATE SET version = target.version + 1, refreshed_at = SYSUTCDATETIME()
+            WHEN NOT MATCHED THEN
+                INSERT (id, version, refreshed_at) VALUES (1, 1, SYSUTCDATETIME());
+        """
+
+    def parse_datetime(self, value):
+        # pyodbc already returns datetime objects
+        return value
+
+
+class SqliteStorage:
+    """
+    Local SQLite file with the same tables. Upserts are INSERT ... ON CONFLICT DO UPDATE from TEMP staging
+    tables, with the same only-if-changed semantics as the SQL Server MERGE.
+    """
+    name = 'sqlite'
+    supports_maintenance = False
+    # In-process executemany into a TEMP table is already the fast path
+    supports_bulk_merge = False
+    # One writer at a time per database file, so parallel merges would only queue on the lock
+    supports_concurrent_writes = False
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    OperationalError = sqlite3.OperationalError
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+
+    def connect(self):
+        # Pooled connections move between threads, though only one thread uses a connection at a time
+        connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # WAL lets the dashboard keep reading while the ingest writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def cursor(self, connection):
+        return connection.cursor()
+
+    def table_exists(self, cursor, table_name):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+        return cursor.fetchone() is not None
+
+    def create_table_if_missing(self, cursor, table_name, columns):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({columns})")
+
+    def staging_table(self, name):
+        return f"temp.{name}"
+
+    def create_staging_table(self, cursor, staging_table, columns):
+        cursor.execute(f"CREATE TABLE {staging_table} ({columns})")
+
+    def upsert_sql(self, target, source, key_columns, value_columns, output_column=None):
+        """
+        Upsert source into target on key_columns, updating only rows where any of value_columns differ
+        (IS NOT is NULL-safe). With output_column, one row is returned per inserted or updated row.
+        """
+        columns = ", ".join(list(key_columns) + list(value_columns))
+        if value_columns:
+            conflict = f"""DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in value_columns)}
+                WHERE {" OR ".join(f"excluded.{column} IS NOT {target}.{column}" for column in value_columns)}"""
+        else:
+            conflict = "DO NOTHING"
+        returning = f"\n                RETURNING {output_column}" if output_column else ""
+        # WHERE true keeps SQLite from reading ON CONFLICT as a join constraint of the SELECT
+        return f"""
+                INSERT INTO {target} ({columns})
+                SELECT {columns} FROM {source} WHERE true
+                ON CONFLICT ({", ".join(key_columns)}) {conflict}{returning}
+            """
+
+    def year_sql(self, column):
+        return f"CAST(strftime('%Y', {column}) AS INTEGER)"
+
+    def create_index_sql(self, index_name, table_name, key_columns, included_columns=None):
+        # No INCLUDE in SQLite; appending the columns to the key makes the index covering all the same
+        columns = f"{key_columns}, {included_columns}" if included_columns else key_columns
+        return f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({columns})"
+
+    def bump_version_sql(self, table_name):
+        return f"""
+            INSERT INTO {table_name} (id, version, refreshed_at) VALUES (1, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (id) DO UPDATE SET version = version + 1, refreshed_at = CURRENT_TIMESTAMP
+        """
+
+    def parse_datetime(self, value):
+        # Dates are stored as ISO text
+        return datetime.datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+# Store datetimes as ISO text explicitly (the default adapter is deprecated)
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+
+
+def get_storage(connection_string=None):
+    """
+    The ingest's storage backend, chosen by STORAGE_BACKEND (default sqlserver).
+
+    Args:
+        connection_string: ODBC connection string for the SQL Server backend
+    """
+    backend = os.environ.get('STORAGE_BACKEND', 'sqlserver').lower()
+    if backend == 'sqlite':
+        return SqliteStorage()
+    if backend == 'sqlserver':
+        return SqlServerStorage(connection_string)
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}, expected 'sqlserver' or 'sqlite'")
+
+
+def dashboard_sql(dialect_name):
+    """Fragments for the dashboard's query templates, for a SQLAlchemy dialect name ('mssql' or 'sqlite')."""
+    return DASHBOARD_SQL[dialect_name]
@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+import pandas as pd
+
+from peer_benchmarks import BENCHMARK_COLUMNS, PERCENTILE_COLUMNS, compute_peer_benchmarks
+
+BUILDING_EUI_COLUMNS = ['espmid', 'year', 'usetype', 'eui']
+
+
+def test_no_buildings_gives_empty_tables():
+    # What refresh_peer_benchmarks builds when no building has a positive EUI (fresh database, no meters)
+    building_euis = pd.DataFrame.from_records([], columns=BUILDING_EUI_COLUMNS)
+
+    benchmarks, percentiles = compute_peer_benchmarks(building_euis)
+
+    assert benchmarks.empty and list(benchmarks.columns) == BENCHMARK_COLUMNS
+    assert percentiles.empty and list(percentiles.columns) == PERCENTILE_COLUMNS
+
+
+def test_percentiles_and_quantiles_per_peer_group():
+    building_euis = pd.DataFrame.from_records([
+        (1, 2024, 'Office', Decimal('50')),
+        (2, 2024, 'Office', Decimal('100')),
+        (3, 2024, 'Office', Decimal('150')),
+        (4, 2024, 'K-12 School', Decimal('80')),
+    ], columns=BUILDING_EUI_COLUMNS)
+
+    benchmarks, percentiles = compute_peer_benchmarks(building_euis)
+
+    office = benchmarks[(benchmarks['peer_type'] == 'usetype') & (benchmarks['peer_group'] == 'Office')].iloc[0]
+    assert office['count'] == 3
+    assert office['median'] == 100
+    assert office['min'] == 50 and office['max'] == 150
+
+    by_usetype = percentiles[percentiles['peer_type'] == 'usetype'].set_index('espmid')
+    assert by_usetype.loc[[1, 2, 3], 'percentile'].tolist() == [0, 50, 100]
+    # Alone in its use type, so no percentile
+    assert pd.isna(by_usetype.loc[4, 'percentile'])
@@ -0,0 +1,103 @@
+# weather_normalization.py
+# Weather-normalized energy use from monthly degree days (data/degree_days.csv). For every building, fuel
+# and year with 12 months of data, monthly kBTU is regressed on heating and cooling degree days:
+#
+#     kbtu_month = base + heating * HDD_month + cooling * CDD_month
+#
+# and the fitted model is evaluated under normal weather (each month's average HDD/CDD over the years in
+# the file) to give what the building would have used in a typical year. All models are fitted together as
+# one stack of 12x3 least-squares problems.
+import numpy as np
+import pandas as pd
+
+# Fuels whose use doesn't follow the weather; their normalized kBTU is the actual kBTU
+UNNORMALIZED_FUELS = ('Solar',)
+
+
+def load_degree_days(path):
+    """
+    Monthly degree days from a CSV of year, month, hdd, cdd.
+
+    Returns:
+        DataFrame of year, month, hdd, cdd (empty if the file has no rows or doesn't exist)
+    """
+    try:
+        degree_days = pd.read_csv(path, dtype={'year': 'Int64', 'month': 'Int64', 'hdd': float, 'cdd': float})
+    except FileNotFoundError:
+        return pd.DataFrame(columns=['year', 'month', 'hdd', 'cdd'])
+    degree_days = degree_days.dropna(subset=['year', 'month', 'hdd', 'cdd'])
+    return degree_days.astype({'year': int, 'month': int})[['year', 'month', 'hdd', 'cdd']]
+
+
+def normal_degree_days(degree_days):
+    """
+    Typical weather: each calendar month's average HDD and CDD over all years in degree_days.
+
+    Returns:
+        (12, 2) array of [hdd, cdd] for January through December, NaN for months the file never covers
+    """
+    normals = degree_days.groupby('month')[['hdd', 'cdd']].mean().reindex(range(1, 13))
+    return normals.to_numpy()
+
+
+def _fit(X, y, active):
+    # Least squares for every model at once; inactive columns are zeroed so they get a zero coefficient
+    return (np.linalg.pinv(X * active[:, None, :]) @ y[:, :, None])[:, :, 0]
+
+
+def normalize(monthly, degree_days):
+    """
+    Weather-normalize annual kBTU per building, fuel and year.
+
+    A degree-day term whose fitted slope comes out negative (e.g. cooling for a gas meter) is dropped and
+    the model refitted, so usage never goes down as weather gets more severe.
+
+    Args:
+        monthly: DataFrame of espmid, fuel, year, month, kbtu (calendarized, e.g. energy_monthly)
+        degree_days: DataFrame from load_degree_days()
+
+    Returns:
+        DataFrame of espmid, year, fuel, kbtu, normalized_kbtu, r_squared for every building-fuel-year that
+        has all 12 months of energy and degree-day data
+    """
+    columns = ['espmid', 'year', 'fuel', 'kbtu', 'normalized_kbtu', 'r_squared']
+    normals = normal_degree_days(degree_days)
+    if monthly.empty or degree_days.empty or np.isnan(normals).any():
+        return pd.DataFrame(columns=columns)
+
+    months = monthly.dropna(subset=['kbtu']).merge(degree_days, on=['year', 'month'])
+    keys = ['espmid', 'fuel', 'year']
+    complete = months.groupby(keys)['month'].transform('nunique') == 12
+    months = months[complete].sort_values(keys + ['month'])
+    if months.empty:
+        return pd.DataFrame(columns=columns)
+
+    # One 12-month block per building-fuel-year
+    groups = months[keys].iloc[::12].reset_index(drop=True)
+    y = months['kbtu'].to_numpy(dtype=float).reshape(-1, 12)
+    X = np.stack([
+        np.ones_like(y),
+        months['hdd'].to_numpy(dtype=float).reshape(-1, 12),
+        months['cdd'].to_numpy(dtype=float).reshape(-1, 12),
+    ], axis=2)
+
+    active = np.ones((len(y), 3))
+    coefficients = _fit(X, y, active)
+    active[:, 1:] = coefficients[:, 1:] >= 0
+    coefficients = _fit(X, y, active)
+
+    fitted = (X @ coefficients[:, :, None])[:, :, 0]
+    residual = ((y - fitted) ** 2).sum(axis=1)
+    total = ((y - y.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_squared = np.where(total > 0, 1 - residual / total, np.nan)
+
+    normal_X = np.column_stack([np.ones(12), normals])
+    normalized = np.clip(coefficients @ normal_X.T, 0, None).sum(axis=1)
+
+    actual = y.sum(axis=1)
+    unnormalized = groups['fuel'].isin(UNNORMALIZED_FUELS).to_numpy()
+    groups['kbtu'] = actual
+    groups['normalized_kbtu'] = np.where(unnormalized, actual, normalized)
+    groups['r_squared'] = np.where(unnormalized, np.nan, r_squared)
+    return groups[columns]